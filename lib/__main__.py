@@ -0,0 +1,63 @@
+"""
+Command line entry point
+
+    python -m lib worker <queue_dir>    Claim and run the jobs of a WorkQueue
+    python -m lib status <queue_dir>    Print the number of jobs in each state of a WorkQueue
+"""
+import argparse
+
+from lib.data_classes.runTelemetry import RunTelemetry
+from lib.data_classes.workQueue import WorkQueue
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "python -m lib")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    worker_parser = commands.add_parser("worker", help = "Claim and run the jobs of a work queue")
+    worker_parser.add_argument("queue_dir", help = "Folder of the work queue")
+    worker_parser.add_argument("--worker-id", default = None, help = "Name of the worker, defaults to <host>-<pid>")
+    worker_parser.add_argument("--poll-interval", type = float, default = 5.0,
+                               help = "Seconds to wait when the queue is empty")
+    worker_parser.add_argument("--stale-after", type = float, default = 600.0,
+                               help = "Seconds without a heartbeat after which a running job is put back in the queue")
+    worker_parser.add_argument("--max-attempts", type = int, default = 3,
+                               help = "Number of times a job is claimed before it's failed")
+    worker_parser.add_argument("--max-runs", type = int, default = None, help = "Stop after this many jobs")
+    worker_parser.add_argument("--exit-when-empty", action = "store_true",
+                               help = "Stop when there are no pending or running jobs")
+    worker_parser.add_argument("--print-output", action = "store_true", help = "Print the output of the solver")
+    worker_parser.add_argument("--telemetry", default = None,
+                               help = "SQLite database on a local disk that the time and resources of each stage are stored in")
+    worker_parser.add_argument("--stop-on-nan", action = "store_true",
+                               help = "Stop a stage when a NaN is written to its .PAR_ or .OUT files")
+    worker_parser.add_argument("--max-q", type = float, default = None,
+                               help = "Stop a stage when the deviatoric stress q of a material point is above this")
+    worker_parser.add_argument("--stall-time", type = float, default = None,
+                               help = "Stop a stage when its .PAR_ and .OUT files didn't grow for this many seconds")
+    worker_parser.add_argument("--scratch-dir", default = None,
+                               help = "Local or tmpfs folder that each stage runs in before its results are copied back")
+
+    status_parser = commands.add_parser("status", help = "Print the number of jobs in each state")
+    status_parser.add_argument("queue_dir", help = "Folder of the work queue")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        queue = WorkQueue(args.queue_dir, stale_after = args.stale_after, max_attempts = args.max_attempts)
+        telemetry = RunTelemetry(args.telemetry) if args.telemetry is not None else None
+
+        # A watchdog is only attached when one of its rules is asked for
+        watchdog = None
+        if args.stop_on_nan or args.max_q is not None or args.stall_time is not None:
+            watchdog = {"check_nan": args.stop_on_nan, "max_q": args.max_q, "stall_time": args.stall_time}
+
+        queue.run_worker(worker_id = args.worker_id, poll_interval = args.poll_interval,
+                         exit_when_empty = args.exit_when_empty, max_runs = args.max_runs,
+                         print_output = args.print_output, telemetry = telemetry, watchdog = watchdog,
+                         scratch_dir = args.scratch_dir)
+
+    elif args.command == "status":
+        print(WorkQueue(args.queue_dir))
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 # Class to represent a CPS file and get information from it
 # It inherits flagFile
 import os
+import numpy as np
+
 from lib.data_classes.flagFile import FlagFile
 
 class CPSFile(FlagFile):
@@ -35,13 +37,13 @@ class CPSFile(FlagFile):
         Update the material points that are going to be updated
         """
 
-        if not isinstance(point_ids, list):
+        if isinstance(point_ids, (tuple, range, np.ndarray)):
+            point_ids = [int(point_id) for point_id in point_ids]
+        elif not isinstance(point_ids, list):
             point_ids = [point_ids]
 
         num_material_points = len(point_ids)
 
-        # update the number of material points
-        self.modify_flag(num_mat_points_flag, num_material_points)
-
-        # Update the output material point ids
-        self.modify_flag(mat_point_ids_flag, point_ids)
\ No newline at end of file
+        # Update the number of material points and their ids with one write
+        self.modify_flags({num_mat_points_flag: num_material_points,
+                           mat_point_ids_flag: point_ids})
@@ -0,0 +1,164 @@
+"""
+Class to share the cores of the machine between solvers that run at the same time
+"""
+import asyncio
+import collections
+import os
+import threading
+
+class CpuBudget:
+    """
+    A pool of cpus that jobs take a share of while they run.
+
+    A job asks for a number of cpus and waits until that many are free. Waiting jobs are served in
+    the order they asked, but a job that fits into the free cpus starts before an earlier job that
+    doesn't fit, so small jobs fill the cores that a large job leaves idle. The ids of the cpus that
+    a job is given can be used to pin the solver to them (see executing_runs.run_solver_async).
+
+    Attributes
+    ----------
+    cpu_ids : list of int
+        The cpus in the pool
+    """
+
+    def __init__(self, num_cpus = None, cpu_ids = None):
+        """
+        Parameters
+        ----------
+        num_cpus : int (Optional)
+            Number of cpus in the pool, the first num_cpus of cpu_ids. Defaults to every cpu in cpu_ids
+        cpu_ids : list of int (Optional)
+            The cpus that may be used. Defaults to the cpus this process may run on
+        """
+        if cpu_ids is None:
+            if hasattr(os, "sched_getaffinity"):
+                cpu_ids = sorted(os.sched_getaffinity(0))
+            else:
+                cpu_ids = list(range(os.cpu_count() or 1))
+
+        cpu_ids = list(cpu_ids)
+
+        if num_cpus is not None:
+            if num_cpus < 1 or num_cpus > len(cpu_ids):
+                raise ValueError(f"num_cpus must be between 1 and the {len(cpu_ids)} available cpus")
+            cpu_ids = cpu_ids[:num_cpus]
+
+        self.cpu_ids = cpu_ids
+
+        self._free_cpus = set(cpu_ids)
+        self._waiters = collections.deque()
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return (f"Number of cpus: {self.num_cpus}\n"
+                f"Free cpus: {self.num_free}\n"
+                f"Waiting jobs: {len(self._waiters)}\n")
+
+    @property
+    def num_cpus(self):
+        return len(self.cpu_ids)
+
+    @property
+    def num_free(self):
+        return len(self._free_cpus)
+
+    def acquire(self, num_cpus = 1):
+        """
+        Wait until num_cpus cpus are free and take them
+
+        Returns
+        -------
+        list of int
+            The ids of the cpus, give them back with release
+        """
+        waiter = self._add_waiter(num_cpus, threading.Event())
+        waiter["event"].wait()
+
+        return waiter["cpus"]
+
+    async def acquire_async(self, num_cpus = 1):
+        """
+        Version of acquire that waits in the event loop
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._add_waiter(num_cpus, None, grant)
+
+        try:
+            await future
+
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    granted = False
+                else:
+                    granted = True
+
+            # The cpus were given in the mean time
+            if granted:
+                self.release(waiter["cpus"])
+            raise
+
+        return waiter["cpus"]
+
+    def release(self, cpus):
+        """
+        Give back cpus taken with acquire and start the waiting jobs that now fit
+        """
+        with self._lock:
+            self._free_cpus.update(cpus)
+            granted = self._grant()
+
+        self._notify(granted)
+
+    def _add_waiter(self, num_cpus, event, grant = None):
+        if num_cpus < 1 or num_cpus > self.num_cpus:
+            raise ValueError(f"A job can use between 1 and {self.num_cpus} cpus, {num_cpus} were asked for")
+
+        waiter = {"num_cpus": num_cpus, "cpus": None, "event": event, "grant": grant}
+
+        with self._lock:
+            self._waiters.append(waiter)
+            granted = self._grant()
+
+        self._notify(granted)
+
+        return waiter
+
+    def _grant(self):
+        """
+        Give cpus to the waiting jobs that fit, in the order they asked. Called with the lock held
+
+        Returns
+        -------
+        list of dict
+            The waiters that were given cpus
+        """
+        granted = []
+
+        for waiter in list(self._waiters):
+            if waiter["num_cpus"] > len(self._free_cpus):
+                continue
+
+            # Lowest ids first so the cpus of a job are close together
+            cpus = sorted(self._free_cpus)[:waiter["num_cpus"]]
+            self._free_cpus.difference_update(cpus)
+
+            waiter["cpus"] = cpus
+            self._waiters.remove(waiter)
+            granted.append(waiter)
+
+        return granted
+
+    @staticmethod
+    def _notify(granted):
+        for waiter in granted:
+            if waiter["event"] is not None:
+                waiter["event"].set()
+            else:
+                waiter["grant"]()
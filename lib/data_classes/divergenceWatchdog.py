@@ -0,0 +1,270 @@
+"""
+Class to stop a stage whose solution diverges instead of waiting for the solver to end
+"""
+import os
+import re
+import threading
+import time
+import numpy as np
+
+from lib.data_classes.parFile import ParFile
+from lib.general_functions.par_reader import STRESS_COLS_2D, STRESS_COLS_3D, is_par_file
+
+class DivergenceWatchdog:
+    """
+    Follows the .PAR_ and .OUT files that a running stage writes and reports when the run diverges.
+
+    Unstable parameter sets can run for a long time while writing NaNs or exploding stresses. Each
+    call to check only reads the bytes that were appended to the files since the previous call (see
+    ParFile.refresh_data) and tests the new rows against the rules that are switched on:
+
+    - check_nan: a NaN or infinite value (or a value that can't be read, e.g. a Fortran "****"
+      overflow) in a .PAR_ file, or "NaN" / "Infinity" in an .OUT file
+    - max_q: the deviatoric stress q of a material point is above the limit
+    - stall_time: none of the files grew for this many seconds
+
+    Give the object to AnuraModel.run_stage or run_stage_async (or a dict of its arguments to a
+    RunScheduler). The solver is terminated when a rule fires and the stage is marked as diverged
+    with the reason. Rows written before start was called (e.g. by an earlier stage) aren't checked.
+
+    Attributes
+    ----------
+    folder_dir : str
+        Folder the files are written in
+    interval : float
+        Seconds between the checks while the stage runs
+    reason : str or None
+        Why the run diverged, None while no rule fired
+    """
+
+    # Words in the .OUT file that mean a value is no longer finite
+    out_pattern = re.compile(rb"\b(nan|infinity)\b", re.IGNORECASE)
+
+    def __init__(self, folder_dir, check_nan = True, max_q = None, stall_time = None, interval = 5.0):
+        """
+        Parameters
+        ----------
+        folder_dir : str
+            Folder of the model
+        check_nan : bool (Optional)
+            Stop when a value isn't finite
+        max_q : float (Optional)
+            Stop when the deviatoric stress q of a material point is above this value
+        stall_time : float (Optional)
+            Stop when no .PAR_ or .OUT file grew for this many seconds
+        interval : float (Optional)
+            Seconds between the checks
+        """
+        self.folder_dir = folder_dir
+        self.check_nan = check_nan
+        self.max_q = max_q
+        self.stall_time = stall_time
+        self.interval = interval
+
+        self.reason = None
+
+        self._par_files = {}
+        self._checked_rows = {}
+        self._out_offsets = {}
+        self._sizes = {}
+        self._last_progress = None
+
+        # A check that runs in a thread can outlive the task that started it
+        self._lock = threading.RLock()
+
+    def __str__(self):
+        rules = []
+        if self.check_nan:
+            rules.append("NaN")
+        if self.max_q is not None:
+            rules.append(f"q > {self.max_q}")
+        if self.stall_time is not None:
+            rules.append(f"no progress for {self.stall_time} s")
+
+        return (f"Divergence watchdog: {self.folder_dir}\n"
+                f"Rules: {', '.join(rules) or 'none'}\n"
+                f"Diverged: {self.reason}\n")
+
+    @property
+    def diverged(self):
+        return self.reason is not None
+
+    def start(self):
+        """
+        Forget the earlier checks and skip what is already in the files. Called before each stage
+        """
+        with self._lock:
+            self.reason = None
+            self._par_files = {}
+            self._checked_rows = {}
+            self._out_offsets = {}
+            self._sizes = {}
+            self._last_progress = None
+
+            for file_name, size in self._get_watched_files().items():
+                self._sizes[file_name] = size
+
+                if is_par_file(file_name):
+                    self._read_par_file(file_name)
+                else:
+                    self._out_offsets[file_name] = size
+
+            self._last_progress = time.monotonic()
+
+    def check(self, check_stall = True):
+        """
+        Read what was appended to the files and test the rules
+
+        Parameters
+        ----------
+        check_stall : bool (Optional)
+            Test the stall_time rule. The last check after the solver ended skips it
+
+        Returns
+        -------
+        str or None
+            The reason the run diverged, None if it didn't. The reason is also stored in self.reason
+        """
+        with self._lock:
+            return self._check(check_stall)
+
+    def _check(self, check_stall):
+        if self.reason is not None:
+            return self.reason
+
+        if self._last_progress is None:
+            self.start()
+
+        watched_files = self._get_watched_files()
+
+        if any(size != self._sizes.get(file_name) for file_name, size in watched_files.items()):
+            self._last_progress = time.monotonic()
+        self._sizes = watched_files
+
+        for file_name in watched_files:
+            if is_par_file(file_name):
+                reason = self._check_par_file(file_name)
+            else:
+                reason = self._check_out_file(file_name)
+
+            if reason is not None:
+                self.reason = reason
+                return reason
+
+        stalled_time = time.monotonic() - self._last_progress
+        if check_stall and self.stall_time is not None and stalled_time > self.stall_time:
+            self.reason = f"No .PAR_ or .OUT file grew for {stalled_time:.0f} s"
+
+        return self.reason
+
+    def _get_watched_files(self):
+        """
+        Returns file name -> size of the .PAR_ and .OUT files in the folder
+        """
+        watched_files = {}
+
+        with os.scandir(self.folder_dir) as entries:
+            for entry in entries:
+                if (is_par_file(entry.name) or entry.name.upper().endswith(".OUT")) and entry.is_file():
+                    watched_files[entry.name] = entry.stat().st_size
+
+        return watched_files
+
+    def _read_par_file(self, file_name):
+        """
+        Read the new rows of a .PAR_ file
+
+        Returns
+        -------
+        ParFile
+        """
+        par_file = self._par_files.get(file_name)
+
+        if par_file is None:
+            par_file = ParFile(os.path.join(self.folder_dir, file_name), flag_3D = None)
+            self._par_files[file_name] = par_file
+            self._checked_rows[file_name] = 0
+
+        if par_file.stream_offset is not None and os.path.getsize(par_file.file_dir) < par_file.stream_offset:
+            # The file was written again from the start, refresh_data reads it from the top
+            self._checked_rows[file_name] = 0
+
+        par_file.refresh_data()
+
+        if par_file.values is None:
+            # The header hasn't been written yet
+            return par_file
+
+        if par_file.base_stress_cols is None:
+            for stress_cols in (STRESS_COLS_3D, STRESS_COLS_2D):
+                if all(col in par_file.header for col in stress_cols):
+                    par_file.flag_3D = stress_cols is STRESS_COLS_3D
+                    par_file.store_output_stress(stress_cols)
+                    break
+
+        if self._last_progress is None:
+            # Rows from before start aren't checked
+            self._checked_rows[file_name] = len(par_file.values)
+
+        return par_file
+
+    def _check_par_file(self, file_name):
+        try:
+            par_file = self._read_par_file(file_name)
+        except ValueError as e:
+            if self.check_nan:
+                return f"Unreadable value in {file_name}: {e}"
+            raise
+
+        if par_file.values is None:
+            return None
+
+        first_row = self._checked_rows[file_name]
+        new_values = par_file.values[first_row:]
+        self._checked_rows[file_name] = len(par_file.values)
+
+        if len(new_values) == 0:
+            return None
+
+        if self.check_nan:
+            finite_rows = np.isfinite(new_values).all(axis = 1)
+            if not finite_rows.all():
+                row = first_row + int(np.argmin(finite_rows))
+                return f"NaN or infinite value in {file_name} at row {row}"
+
+        if self.max_q is not None and par_file.base_stress_cols is not None:
+            new_q = par_file.get_q_invariant()[first_row:]
+            above_rows = np.flatnonzero(new_q > self.max_q)
+            if len(above_rows) > 0:
+                row = first_row + int(above_rows[0])
+                return f"q = {new_q[above_rows[0]]:.4g} above {self.max_q} in {file_name} at row {row}"
+
+        return None
+
+    def _check_out_file(self, file_name):
+        offset = self._out_offsets.get(file_name, 0)
+        file_dir = os.path.join(self.folder_dir, file_name)
+
+        if os.path.getsize(file_dir) < offset:
+            # The file was written again from the start
+            offset = 0
+
+        with open(file_dir, "rb") as f:
+            f.seek(offset)
+            new_bytes = f.read()
+
+        # Only up to the last complete line, a word could be cut at the end
+        end_index = new_bytes.rfind(b"\n") + 1
+        self._out_offsets[file_name] = offset + end_index
+
+        if not self.check_nan:
+            return None
+
+        match = self.out_pattern.search(new_bytes[:end_index])
+        if match is not None:
+            line_start = new_bytes.rfind(b"\n", 0, match.start()) + 1
+            line_end = new_bytes.find(b"\n", match.start())
+            line = new_bytes[line_start:line_end].decode("ISO-8859-1").strip()
+            return f"{match.group().decode()} in {file_name}: {line}"
+
+        return None
@@ -1,5 +1,10 @@
+import bisect
+import os
+import shutil
+
 from lib.data_classes.fileClass import File
-from lib.general_functions.general_functions import check_ranges_overlap, sort_dict_by_range
+from lib.data_classes.flagTemplate import FlagTemplate
+from lib.general_functions.general_functions import check_ranges_overlap, sort_dict_by_range, format_flag_value
 # Inherit the file class and add on the ability to work with files that contains flags
 
 class FlagFile(File):
@@ -9,17 +14,61 @@ class FlagFile(File):
     This class inherits from the File class and provides functionality for 
     retrieving and modifying specific flag values within a file.
 
+    The file is read once into memory together with an index of the lines that contain a flag.
+    Lookups are served from memory until the size or modification time of the file changes.
+
     Methods
     -------
-    modify_single_value_flag(flag, new_value)
-        Modifies the value associated with a given flag.
     get_flag_value(init_flag, end_symbol)
         Retrieves the value of a flag between the flag and a specified end symbol.
+    get_flag_index()
+        Returns the ordered index of the flags in the file.
+    modify_flags(flags_dict, end_symbol)
+        Overwrites the values of flags.
     """
 
+    # Marker that every flag line contains
+    flag_marker = "$$"
+
     def __init__(self, file_dir):
         super().__init__(file_dir)
 
+        # In memory copy of the file, filled by _check_index
+        self._clear_index()
+
+    def get_lines(self):
+        """
+        Returns the lines of the file. The file is only read again if it changed since the last call.
+
+        The list is shared with the index so it shouldn't be modified.
+        """
+        self._check_index()
+        return self._lines
+
+    def get_flag_index(self):
+        """
+        Returns the ordered index of the flags in the file.
+
+        Returns
+        -------
+        dict
+            flag -> (start line, end line) in the order the flags appear in the file. The start line is
+            the line of the flag and the end line is the line of the next flag (None for the last flag),
+            so the value lines are lines[start+1:end]. Only the first occurrence of a repeated flag is stored.
+        """
+        self._check_index()
+
+        if self._flag_index is None:
+            flag_index = {}
+            flag_line_ids = self._flag_line_ids + [None]
+
+            for start, end in zip(flag_line_ids[:-1], flag_line_ids[1:]):
+                flag_index.setdefault(self._lines[start].strip(), (start, end))
+
+            self._flag_index = flag_index
+
+        return self._flag_index
+
     def get_flag_value(self, init_flag, end_symbol = "$$"):
         """
         Retrieve the value associated with a specific flag in the file.
@@ -40,92 +89,131 @@ class FlagFile(File):
             The extracted value between the flag and the end symbol, or None if 
             the flag is not found.
         """
-        # Init start index
-        start_index = None
-        return_lines = []
+        self._check_index()
+
+        key = (init_flag, end_symbol)
+        if key not in self._value_cache:
+            span = self._get_span(init_flag, end_symbol)
+
+            if span is None or span[1] is None:
+                # The flag or the end symbol is not found
+                self._value_cache[key] = None
+            else:
+                start, end = span
+                self._value_cache[key] = [line.strip() for line in self._lines[start+1:end]]
 
-        with open(self.file_dir, 'r') as file:
-            for line in file:
-                if start_index is not None and not end_symbol in line:
-                    return_lines.append(line.strip())
-                
-                elif init_flag in line:
-                    start_index = line.find(init_flag) + len(init_flag)
-                
-                elif start_index is not None and end_symbol in line:
-                    return return_lines
+        value = self._value_cache[key]
 
-        return None  # Return None if the flag is not found
+        # Return a copy so that the cached value can't be changed by the caller
+        return None if value is None else list(value)
 
     def modify_flags(self, flags_dict, end_symbol = "$$"):
-            """
-            Modify the values of specific flags in the file. Supports single or multiple values after a flag.
-
-            Parameters
-            ----------
-            flags : str or list of str
-                The flag(s) to search for in the file.
-            new_values : str, list of str, or list of list of str
-                The new value(s) to overwrite after each flag. Each entry can be a single value (for single-value flags)
-                or a list of values (for multi-value flags).
-            """
-
-            # Init list to hold the modified file
-            modified_lines = []
-
-            # Store all of the keys
-            flag_keys = list(flags_dict.keys())
-            
-            # Read all of the lines
-            with open(self.file_dir, "r") as file:
-                lines = file.readlines()
+        """
+        Modify the values of specific flags in the file. Supports single or multiple values after a flag.
 
-            indices_dict = self.find_flag_start_end_index(lines, flag_keys, end_symbols=end_symbol)
+        The file is written once through an edit session. Use :meth:`edit` to batch this with other edits.
 
-            if check_ranges_overlap(indices_dict):
-                # Checking if the ranges of the returned tuples overlap
-                raise ValueError("Ranges can't overlap\n"
-                                    f"{indices_dict}")
-            
-            # Reorder the indices dict based on the ranges
-            indices_dict = sort_dict_by_range(indices_dict)
-
-            ranges = list(indices_dict.values())
-
-            for i, (flag, curr_range) in enumerate(indices_dict.items()):
-                
-                # Get the new values for the selected flag
-                new_values = flags_dict[flag]
-
-                if not isinstance(new_values, list):
-                    new_values = [new_values]
-                
-                # Track how far the list should be written
-                if i < len(ranges)-1:
-                    next_start = ranges[i][0]
-                else:
-                    next_start = -1
-                
-                # Add the new line character to each of the new values
-                modified_values = [str(value) + "\n" for value in new_values]
-
-                if i==0:
-                    modified_lines.extend(lines[:curr_range[0]+1])
-                else: 
-                    prev_range = ranges[i-1]
-                    modified_lines.extend(lines[prev_range[1]+1:curr_range[0]+1])
-
-                modified_lines.extend(modified_values)
-
-                if next_start != -1:                
-                    modified_lines.extend(lines[curr_range[1]:next_start])
-                else:
-                    modified_lines.extend(lines[curr_range[1]+1:])
-
-            # Write the modified content back to the file
-            with open(self.file_dir, "w") as file:
-                file.writelines(modified_lines)
+        Parameters
+        ----------
+        flags_dict : dict
+            flag -> new value(s). Each entry can be a single value (for single-value flags)
+            or a list of values (for multi-value flags).
+        end_symbol : str
+            The symbol that marks the end of the flag's value.
+        """
+        with self.edit() as session:
+            session.modify_flags(flags_dict, end_symbol = end_symbol)
+
+    def edit(self):
+        """
+        Start an edit session. The edits are queued in memory and the file is written once on commit.
+
+        Use as a context manager, the session is committed when the block exits normally and discarded
+        if an exception is raised:
+
+            with cps_file.edit() as session:
+                session.modify_flags({"$$NUMBER_OF_LOADSTEPS": 10})
+                session.modify_flags({"$$OUTPUT_MATERIAL_POINTS": [1, 2]})
+
+        Returns
+        -------
+        FlagFileEdit
+        """
+        return FlagFileEdit(self)
+
+    def get_template(self, flags, end_symbol = "$$"):
+        """
+        Compile the file into a template where the values of the flags can be replaced. See FlagTemplate
+        """
+        return FlagTemplate(self, flags, end_symbol = end_symbol)
+
+    def _replace_flag_values(self, lines, flags_dict, end_symbol = "$$"):
+        """
+        Returns a new list of lines with the values after the flags replaced. lines isn't changed.
+        """
+        # Init list to hold the modified file
+        modified_lines = []
+
+        # Store all of the keys
+        flag_keys = list(flags_dict.keys())
+
+        indices_dict = self.find_flag_start_end_index(lines, flag_keys, end_symbols=end_symbol)
+
+        if check_ranges_overlap(indices_dict):
+            # Checking if the ranges of the returned tuples overlap
+            raise ValueError("Ranges can't overlap\n"
+                                f"{indices_dict}")
+        
+        # Reorder the indices dict based on the ranges
+        indices_dict = sort_dict_by_range(indices_dict)
+
+        ranges = list(indices_dict.values())
+
+        for i, (flag, curr_range) in enumerate(indices_dict.items()):
             
+            # Get the new values for the selected flag
+            new_values = flags_dict[flag]
+
+            modified_values = format_flag_value(new_values)
+
+            if i==0:
+                modified_lines.extend(lines[:curr_range[0]+1])
+            else: 
+                prev_range = ranges[i-1]
+                modified_lines.extend(lines[prev_range[1]+1:curr_range[0]+1])
+
+            modified_lines.extend(modified_values)
+
+            if i == len(ranges)-1:
+                modified_lines.extend(lines[curr_range[1]+1:])
+
+        return modified_lines
+
+    def _write_lines(self, lines):
+        """
+        Write the lines to the file through a temp file that replaces the file, so the file is never
+        half written. The in memory copy is replaced by the lines that were written.
+        """
+        tmp_path = f"{self.file_dir}.{os.getpid()}.tmp"
+
+        try:
+            with open(tmp_path, "w") as file:
+                file.writelines(lines)
+
+            # The temp file gets the default permissions, keep the ones of the file
+            shutil.copymode(self.file_dir, tmp_path)
+            os.replace(tmp_path, self.file_dir)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        # Keep the written lines so the file doesn't have to be read again
+        self._clear_index()
+        stat = os.stat(self.file_dir)
+        self._lines = lines
+        self._flag_line_ids = self._find_flag_line_ids(lines)
+        self._index_key = (stat.st_size, stat.st_mtime_ns)
+
     def find_flag_start_end_index(self, lines, flags, end_symbols):
         """
         Find the line index after the line where the flag was found and the line index that 
@@ -133,16 +221,22 @@ class FlagFile(File):
 
         Parameters
         ----------
-        flag : str
-            The flag to search for in the file.
-        end_symbol : str
-            The symbol that indicates the end of the flag's value.
+        lines : list of str
+            The lines of the file. The memoized index is used if these are the lines from get_lines.
+        flags : str or list of str
+            The flag(s) to search for in the file.
+        end_symbols : str or list of str
+            The symbol that indicates the end of each flag's value.
 
         Returns
         -------
-        tuple
-            A tuple containing two integers: the line index after the flag's line and 
-            the line index where the end symbol is found. Returns (-1, -1) if not found.
+        dict
+            flag -> (line index of the flag, line index before the end symbol).
+
+        Raises
+        ------
+        ValueError
+            If a flag or its end symbol isn't found.
         """
 
         if not isinstance(flags, list):
@@ -154,41 +248,215 @@ class FlagFile(File):
         # If a single end symbol was entered but there are mutltiple flags assume at the end symbol applies to all the 
         if len(end_symbols) ==1 and len(flags) > 1:
             end_symbols = end_symbols * len(flags)
-        
+
+        if lines is self._lines:
+            # Use the memoized spans of the file
+            get_span = self._get_span
+        else:
+            flag_line_ids = self._find_flag_line_ids(lines)
+            get_span = lambda flag, end_symbol: self._search_span(lines, flag_line_ids, flag, end_symbol)
+
         # init dict to hold start and end indices
-        indices_dict = {flag: (-1, -1) for flag in flags}
-
-        for line_number, line in enumerate(lines):
-            # Check if any of the flags are in the line and if the flag is in the 
-            matching_index, matching_value = next(((i, flag) for i, flag in enumerate(flags) if flag in line), (None, None))
-
-            if not matching_index is None:
-                # Pop the found value from the list so that that index isn't searched for anymore
-                flags.pop(matching_index)
-
-                # Store the start index
-                start_line_index = line_number
-                
-                # Get the end symbol
-                end_symbol = end_symbols[matching_index]
-                # Pop corresponding end symbol
-                end_symbols.pop(matching_index)
-
-                # Loop over the next lines and see if you can find the end symbol
-                for subsequent_line_number, subsequent_line in enumerate(lines[start_line_index+1:]):
-                            if end_symbol in subsequent_line:
-                                # Store the indices of the matching values
-                                # This will store the keys in order
-                                indices_dict[matching_value] = (start_line_index, subsequent_line_number+start_line_index)
-
-                                break
-                
-                if len(flags) == 0:
-                    # If all the values have been popped return the dict
-                    return indices_dict
-                
-        # If you make it here a flag wasn't found
-        raise ValueError("The following flags weren't found.\n"
-                         f"flag: {flags}\n",
-                         f"End symbols: {end_symbols} ")
-        
+        indices_dict = {}
+        missing_flags = []
+
+        for flag, end_symbol in zip(flags, end_symbols):
+            span = get_span(flag, end_symbol)
+
+            if span is None or span[1] is None:
+                missing_flags.append((flag, end_symbol))
+            else:
+                # The end index is the last line of the value
+                indices_dict[flag] = (span[0], span[1] - 1)
+
+        if missing_flags:
+            raise ValueError("The following flags or their end symbols weren't found.\n"
+                             f"(flag, end symbol): {missing_flags}")
+
+        return indices_dict
+
+    def _get_span(self, init_flag, end_symbol):
+        """
+        Memoized version of _search_span for the lines of the file
+        """
+        self._check_index()
+
+        key = (init_flag, end_symbol)
+        if key not in self._span_cache:
+            self._span_cache[key] = self._search_span(self._lines, self._flag_line_ids, init_flag, end_symbol)
+
+        return self._span_cache[key]
+
+    def _search_span(self, lines, flag_line_ids, init_flag, end_symbol):
+        """
+        Find the first line that contains init_flag and the first line after it that contains end_symbol.
+
+        Only the flag lines are searched when the flag or end symbol contains the flag marker, so the
+        value lines (e.g. the mesh in a GOM file) are skipped.
+
+        Returns
+        -------
+        tuple or None
+            (start line, end line). The end line is None if the end symbol isn't found after the flag.
+            None if the flag isn't found.
+        """
+        if self.flag_marker in init_flag:
+            start_candidates = flag_line_ids
+        else:
+            start_candidates = range(len(lines))
+
+        start = next((i for i in start_candidates if init_flag in lines[i]), None)
+
+        if start is None:
+            return None
+
+        if self.flag_marker in end_symbol:
+            end_candidates = flag_line_ids[bisect.bisect_right(flag_line_ids, start):]
+        else:
+            end_candidates = range(start + 1, len(lines))
+
+        end = next((i for i in end_candidates if end_symbol in lines[i]), None)
+
+        return (start, end)
+
+    def _find_flag_line_ids(self, lines):
+        """
+        Returns the ids of the lines that contain the flag marker
+        """
+        return [i for i, line in enumerate(lines) if self.flag_marker in line]
+
+    def _check_index(self):
+        """
+        Read the file and build the line index if the file changed since it was last read
+        """
+        stat = os.stat(self.file_dir)
+        index_key = (stat.st_size, stat.st_mtime_ns)
+
+        if index_key == self._index_key:
+            return
+
+        with open(self.file_dir, "r") as file:
+            lines = file.readlines()
+
+        self._clear_index()
+        self._lines = lines
+        self._flag_line_ids = self._find_flag_line_ids(lines)
+        self._index_key = index_key
+
+    def _clear_index(self):
+        """
+        Drop the in memory copy of the file
+        """
+        self._lines = None
+        self._flag_line_ids = None
+        self._flag_index = None
+        self._span_cache = {}
+        self._value_cache = {}
+        self._index_key = None
+
+
+class FlagFileEdit:
+    """
+    Batch of edits to a FlagFile that is written to disk once.
+
+    The edits are applied in the order they are queued to an in memory copy of the file when the
+    session is committed. The result is written to a temp file that replaces the original, so a crash
+    can never leave a half written input file. Nothing is written if an edit fails.
+
+    Attributes
+    ----------
+    flag_file : FlagFile
+        The file that is edited
+    edits : list
+        The queued edits as (method name, args) tuples
+    """
+
+    def __init__(self, flag_file):
+        self.flag_file = flag_file
+        self.edits = []
+        self.committed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+        # Don't suppress the exception
+        return False
+
+    def __len__(self):
+        return len(self.edits)
+
+    def modify_flags(self, flags_dict, end_symbol = "$$"):
+        """
+        Queue overwriting the values after flags. Same arguments as FlagFile.modify_flags
+        """
+        self._queue("_apply_modify_flags", (dict(flags_dict), end_symbol))
+        return self
+
+    def replace_lines(self, target_string, new_line):
+        """
+        Queue replacing every line that contains target_string with new_line
+        """
+        self._queue("_apply_replace_lines", (target_string, new_line))
+        return self
+
+    def commit(self):
+        """
+        Apply the queued edits and write the file once. Nothing is written if there are no edits.
+
+        Returns
+        -------
+        bool
+            True if the file was written
+        """
+        if self.committed:
+            raise RuntimeError(f"The edit session of {self.flag_file.file_name} was already committed")
+
+        self.committed = True
+
+        if not self.edits:
+            return False
+
+        # Copy the list so the cached lines of the file aren't changed if an edit fails
+        lines = list(self.flag_file.get_lines())
+
+        for method_name, args in self.edits:
+            lines = getattr(self, method_name)(lines, *args)
+
+        self.flag_file._write_lines(lines)
+        self.edits = []
+
+        return True
+
+    def discard(self):
+        """
+        Drop the queued edits without writing
+        """
+        self.edits = []
+        self.committed = True
+
+    def _queue(self, method_name, args):
+        if self.committed:
+            raise RuntimeError(f"The edit session of {self.flag_file.file_name} was already committed")
+
+        self.edits.append((method_name, args))
+
+    def _apply_modify_flags(self, lines, flags_dict, end_symbol):
+        return self.flag_file._replace_flag_values(lines, flags_dict, end_symbol = end_symbol)
+
+    def _apply_replace_lines(self, lines, target_string, new_line):
+        new_lines = format_flag_value(str(new_line))
+
+        modified_lines = []
+        for line in lines:
+            if target_string in line:
+                modified_lines.extend(new_lines)
+            else:
+                modified_lines.append(line)
+
+        return modified_lines
@@ -0,0 +1,129 @@
+"""
+Class to render many variants of a CPS or GOM file that only differ in the values of some flags
+"""
+import os
+import shutil
+
+from lib.general_functions.general_functions import check_ranges_overlap, format_flag_value
+
+class FlagTemplate:
+    """
+    A flag file compiled into static text and value slots.
+
+    The file is scanned once when the template is made. The text between the parameterized flags is
+    joined into chunks, so rendering a variant only joins the chunks with the formatted values.
+    Flags that aren't given a value when rendering keep the value of the base file.
+
+    Attributes
+    ----------
+    source_dir : str
+        Path of the file that the template was made from
+    flags : list of str
+        The parameterized flags in the order they appear in the file
+    chunks : list of str
+        Static text. chunks[i] is written before the value of flags[i] and chunks[-1] after the last value
+    defaults : dict
+        flag -> value text of the base file
+    """
+
+    def __init__(self, flag_file, flags, end_symbol = "$$"):
+        """
+        Parameters
+        ----------
+        flag_file : FlagFile
+            The base file
+        flags : str, list of str or dict
+            The flag(s) whose values are replaced. A dict maps each flag to its end symbol, e.g.
+            {esm_name: "$$INITIAL_STATE_VARIABLE_SOLID_01"} for the ESM material parameter block
+        end_symbol : str (Optional)
+            End symbol of the flags when they aren't given as a dict
+        """
+        if isinstance(flags, str):
+            flags = [flags]
+
+        if isinstance(flags, dict):
+            end_symbols = list(flags.values())
+            flags = list(flags.keys())
+        else:
+            flags = list(flags)
+            end_symbols = [end_symbol] * len(flags)
+
+        self.source_dir = flag_file.file_dir
+
+        lines = flag_file.get_lines()
+
+        # flag -> (line of the flag, last line of the value)
+        indices_dict = flag_file.find_flag_start_end_index(lines, flags, end_symbols)
+
+        if check_ranges_overlap(indices_dict):
+            raise ValueError("The values of the flags can't overlap\n"
+                             f"{indices_dict}")
+
+        self.flags = sorted(indices_dict, key = lambda flag: indices_dict[flag][0])
+        self.chunks = []
+        self.defaults = {}
+
+        line_id = 0
+        for flag in self.flags:
+            start, last = indices_dict[flag]
+
+            self.chunks.append("".join(lines[line_id:start+1]))
+            self.defaults[flag] = "".join(lines[start+1:last+1])
+
+            line_id = last + 1
+
+        self.chunks.append("".join(lines[line_id:]))
+
+    def __str__(self):
+        return (f"Template of: {self.source_dir}\n"
+                f"Flags: {self.flags}\n")
+
+    def render(self, values = None):
+        """
+        Returns the text of the file with the values of the flags replaced
+
+        Parameters
+        ----------
+        values : dict (Optional)
+            flag -> new value(s), formatted the same as FlagFile.modify_flags. Missing flags keep the
+            value of the base file
+
+        Returns
+        -------
+        str
+        """
+        if values is None:
+            values = {}
+
+        unknown_flags = [flag for flag in values if flag not in self.defaults]
+        if unknown_flags:
+            raise KeyError(f"{unknown_flags} aren't flags of the template. Template flags: {self.flags}")
+
+        parts = []
+        for chunk, flag in zip(self.chunks, self.flags):
+            parts.append(chunk)
+
+            if flag in values:
+                parts.append("".join(format_flag_value(values[flag])))
+            else:
+                parts.append(self.defaults[flag])
+
+        parts.append(self.chunks[-1])
+
+        return "".join(parts)
+
+    def write(self, file_dir, values = None):
+        """
+        Render a variant and write it to file_dir. The file is written to a temp file that replaces
+        file_dir so it's never half written
+        """
+        text = self.render(values)
+
+        tmp_path = f"{file_dir}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(text)
+
+        if os.path.exists(file_dir):
+            # The temp file gets the default permissions, keep the ones of the file it replaces
+            shutil.copymode(file_dir, tmp_path)
+        os.replace(tmp_path, file_dir)
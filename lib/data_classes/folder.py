@@ -4,9 +4,13 @@ import fnmatch  # Import fnmatch module for filename matching
 import glob  # Import glob module for pathname matching
 from pathlib import Path  # Import Path class from pathlib module
 import os
+import re
 import shutil
+import time
 
 from lib.general_functions.general_functions import delete_files_with_extensions
+from lib.data_classes.parCache import ParCache
+from lib.general_functions.par_reader import get_material_point_id, is_par_file, par_file_sort_key
 
 class Folder:
     """
@@ -31,8 +35,20 @@ class Folder:
         Get the number of files in the folder with a specific file extension.
     get_directories_by_extension(file_extension, recursive, subfolder="")
         Get a list of file directories with a specific file extension in the folder.
+    purge_par_cache()
+        Delete the binary sidecars written by the .PAR_ file cache.
+    get_file_index(refresh)
+        Get the cached index of the files in the folder.
+    get_highest_numbered_file(base_extension)
+        Get the file with the highest number after a base extension, e.g. the last .CPS_ file.
+    get_par_file_names()
+        Get the .PAR_ file names sorted by material point id.
     """
 
+    # Seconds after a change to the folder in which the index is always rebuilt. Files created 
+    # within the mtime resolution of the file system wouldn't change the folder mtime
+    index_settle_time = 2.0
+
     def __init__(self, folder_dir):
         """
         Initialize the Folder object with the specified folder directory.
@@ -45,6 +61,10 @@ class Folder:
         """
         self.folder_dir = folder_dir  # Store the folder directory
 
+        # Cached index of the files in the folder and the folder mtime it was made at
+        self._file_index = None
+        self._file_index_mtime = None
+
     def __str__(self):
         """
         Return a string representation of the Folder object.
@@ -67,7 +87,7 @@ class Folder:
         file_extension : str
             The file extension (e.g., '.txt', '.csv').
         recursive : bool
-            Boolean flag to indicate whether to search subdirectories recursively.
+            Not used, only the files directly inside of the folder are counted (from the file index).
 
         Returns
         -------
@@ -76,7 +96,7 @@ class Folder:
             The number of files with the specified extension.
         """
         # Count files matching the file extension in the folder
-        count = len(glob.glob(self.folder_dir + "/*" + file_extension, recursive=recursive))
+        count = len([name for name in self.get_file_index()["files"] if name.endswith(file_extension)])
         return count
 
     def get_directories_by_extension(self, file_extension, recursive, subfolder=""):
@@ -124,12 +144,117 @@ class Folder:
         #TODO: Make this overwritable in the future
         delete_files_with_extensions(self.folder_dir, keep_extensions)
 
-    def copy_files_2_folder(self, new_folder_dir, overwrite = True):
+    def get_file_index(self, refresh = False):
+        """
+        Get the index of the files in the folder.
+
+        The folder is scanned once with os.scandir and the index is reused until the modification time
+        of the folder changes (a file is added, removed or renamed).
+
+        Parameters
+        ----------
+        refresh : bool (Optional)
+            Force the folder to be scanned again.
+
+        Returns
+        -------
+        dict
+            "files": sorted list of the file names.
+            "by_extension": extension -> list of file names. Numbered extensions are stored under their
+            base, e.g. "model.CPS_002" is under ".CPS_".
+            "by_number": base extension -> {number: file name}, e.g. {".CPS_": {1: "model.CPS_001"}}.
+            "by_point": material point id -> .PAR_ file name.
+            "par_files": .PAR_ file names sorted by material point id.
+        """
+        dir_mtime = os.stat(self.folder_dir).st_mtime_ns
+
+        # The mtime might not change for files created right after it was made, so rescan recent folders
+        recently_changed = time.time() - dir_mtime / 1e9 < self.index_settle_time
+
+        if refresh or self._file_index is None or dir_mtime != self._file_index_mtime or recently_changed:
+            self._file_index = self._scan_folder()
+            self._file_index_mtime = dir_mtime
+
+        return self._file_index
+
+    def _scan_folder(self):
+        """
+        Scan the folder and make the file index
+        """
+        with os.scandir(self.folder_dir) as entries:
+            files = sorted(entry.name for entry in entries if entry.is_file())
+
+        index = {"files": files, "by_extension": {}, "by_number": {}, "by_point": {}}
+
+        # .PAR_ files sorted by material point id, without the binary copies written next to them
+        index["par_files"] = sorted((name for name in files if is_par_file(name)), key = par_file_sort_key)
+
+        for name in files:
+            extension = os.path.splitext(name)[1]
+
+            # Split numbered extensions (.CPS_001, .PAR_00001) into the base and the number
+            match = re.fullmatch(r"(\.\w*_)(\d+)", extension)
+            if match:
+                extension = match.group(1)
+                index["by_number"].setdefault(extension, {})[int(match.group(2))] = name
+
+            index["by_extension"].setdefault(extension, []).append(name)
+
+        # Index the .PAR_ files by material point id
+        for name in index["par_files"]:
+            point_id = get_material_point_id(name)
+            if point_id is not None:
+                index["by_point"][point_id] = name
+
+        return index
+
+    def get_file_names(self, extension = None):
+        """
+        Get the file names in the folder from the index
+
+        Parameters
+        ----------
+        extension : str (Optional)
+            Only return files with this extension, numbered extensions use their base e.g. ".CPS_"
+        """
+        index = self.get_file_index()
+
+        if extension is None:
+            return list(index["files"])
+
+        return list(index["by_extension"].get(extension, []))
+
+    def get_highest_numbered_file(self, base_extension):
+        """
+        Get the name of the file with the highest number after the base extension, e.g. the last ".CPS_" file.
+        Returns None if there isn't a matching file.
+        """
+        numbered_files = self.get_file_index()["by_number"].get(base_extension)
+
+        if not numbered_files:
+            return None
+
+        return numbered_files[max(numbered_files)]
+
+    def get_par_file_names(self):
+        """
+        Get the .PAR_ file names sorted by material point id. Binary copies written next to them aren't included
+        """
+        return list(self.get_file_index()["par_files"])
+
+    def purge_par_cache(self):
+        """
+        Delete the binary sidecars that were written by the .PAR_ file cache in this folder
+        """
+        ParCache(self.folder_dir).purge()
+
+    def copy_files_2_folder(self, new_folder_dir, overwrite = True, file_filter = None):
         """
         Copy all files from the current folder to a new folder.
         
         Parameters:
         - new_folder_dir (str): Path to the new folder where files will be copied.
+        - file_filter (callable, optional): Only files whose name it returns True for are copied.
         """
         # Create the new folder if it doesn't exist
         os.makedirs(new_folder_dir, exist_ok=True)
@@ -137,6 +262,9 @@ class Folder:
         # Loop through all files in the current folder
         for filename in os.listdir(self.folder_dir):
             file_path = os.path.join(self.folder_dir, filename)
+
+            if file_filter is not None and not file_filter(filename):
+                continue
             
             # Only copy files (skip directories)
             if os.path.isfile(file_path):
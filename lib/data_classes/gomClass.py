@@ -2,15 +2,23 @@
 Class to represent the GOM file
 """
 import os
+import numpy as np
 
 from lib.data_classes.flagFile import FlagFile
+from lib.data_classes.gomMesh import GomMesh
+from lib.general_functions.mesh_functions import parse_numeric_block
 from lib.general_functions.general_functions import pad_integer_to_string, overwrite_line_after_string
 
 class GomFile(FlagFile):
 
+    # Suffix of the binary copy of the mesh
+    mesh_cache_suffix = ".mesh.npz"
+
     def __init__(self, file_dir):
         super().__init__(file_dir)
 
+        self.mesh = None
+
     def get_model_dimension(self):
         """
         Get the dimension that the model is
@@ -24,6 +32,117 @@ class GomFile(FlagFile):
             flag_3D = True
 
         return (dim, flag_3D) 
+
+    def load_mesh(self, cache = False, node_flag = "$$STARTNODES", node_end_flag = "$$FINISHNODES",
+                  element_flag = "$$STARTELEMCON", element_end_flag = "$$FINISHELEMCON",
+                  element_type_flag = "$$ELEMENTTYPE"):
+        """
+        Parse the node coordinates and the element connectivity into NumPy arrays.
+
+        Each block is parsed in one call to numpy's C parser. A counter line (number of nodes and
+        elements) at the start of the node or element block is skipped.
+
+        Parameters
+        ----------
+        cache : bool (Optional)
+            If True the mesh is loaded from ``<file>.GOM.mesh.npz`` when it was made from the current
+            version of the GOM file. Otherwise the mesh is parsed and the .npz file is written.
+        node_flag, node_end_flag : str (Optional)
+            Flags around the node coordinates
+        element_flag, element_end_flag : str (Optional)
+            Flags around the element connectivity
+        element_type_flag : str (Optional)
+            Flag of the element type. Not required
+
+        Returns
+        -------
+        GomMesh
+            The mesh, which is also stored in self.mesh
+        """
+        flags = [node_flag, node_end_flag, element_flag, element_end_flag, element_type_flag]
+
+        if cache:
+            cache_dir = self.file_dir + self.mesh_cache_suffix
+            stat = os.stat(self.file_dir)
+            key = [stat.st_size, stat.st_mtime_ns] + flags
+
+            if os.path.exists(cache_dir):
+                self.mesh = GomMesh.load(cache_dir, key = key)
+                if self.mesh is not None:
+                    return self.mesh
+
+        elements = self._parse_mesh_block(element_flag, element_end_flag, np.int64)
+        nodes = self._parse_mesh_block(node_flag, node_end_flag, np.float64, num_elements = len(elements))
+
+        element_type = self.get_flag_value(element_type_flag)
+        if element_type:
+            element_type = element_type[0]
+        else:
+            element_type = None
+
+        # The GOM file uses 1 based node ids
+        self.mesh = GomMesh(nodes, elements - 1, element_type = element_type)
+
+        if cache:
+            self.mesh.save(cache_dir, key = key)
+
+        return self.mesh
+
+    def get_mesh(self, **kwargs):
+        """
+        Returns the mesh, loading it if it hasn't been loaded. kwargs are passed to :meth:`load_mesh`
+        """
+        if self.mesh is None:
+            self.load_mesh(**kwargs)
+
+        return self.mesh
+
+    def _parse_mesh_block(self, flag, end_flag, dtype, num_elements = None):
+        """
+        Parse the lines between the flag and the end flag. The first line is dropped if it's a counter line
+
+        Parameters
+        ----------
+        num_elements : int (Optional)
+            Number of elements, used to recognise the counter line in the node block
+        """
+        span = self._get_span(flag, end_flag)
+
+        if span is None or span[1] is None:
+            raise ValueError(f"The block between {flag} and {end_flag} wasn't found in {self.file_name}")
+
+        start, end = span
+
+        # Drop blank lines at the start and end of the block
+        while start + 1 < end and not self._lines[start+1].strip():
+            start += 1
+        while end - 1 > start and not self._lines[end-1].strip():
+            end -= 1
+
+        block_lines = self._lines[start+1:end]
+
+        if len(block_lines) >= 2 and self._is_counter_line(block_lines, num_elements):
+            block_lines = block_lines[1:]
+
+        return parse_numeric_block(block_lines, dtype = dtype)
+
+    @staticmethod
+    def _is_counter_line(block_lines, num_elements = None):
+        """
+        A counter line has a different number of values than the rest of the block, or holds the number
+        of lines that follow it and the number of elements
+        """
+        first_values = block_lines[0].split()
+        num_cols = len(block_lines[1].split())
+
+        if len(first_values) != num_cols:
+            return True
+
+        if not all(value.isdigit() for value in first_values):
+            return False
+
+        return (int(first_values[0]) == len(block_lines) - 1 and num_elements is not None
+                and len(first_values) > 1 and int(first_values[1]) == num_elements)
     
     def load_data(self):
         """
@@ -43,11 +162,15 @@ class GomFile(FlagFile):
         for line in self.data:
             print(line.strip())
 
-    def update_ESM_material_props(self, esm_name, props_dict:dict,
-                                  new_esm_name = None):
-        
+    # Flag that ends the ESM material block that update_ESM_material_props overwrites
+    esm_end_flag = "$$INITIAL_STATE_VARIABLE_SOLID_01"
+
+    @staticmethod
+    def make_ESM_material_value(props_dict:dict):
         """
-        Update the material properties for a ESM material
+        Returns the text that update_ESM_material_props writes after the ESM material name.
+
+        The 50 material parameters are set to 0.0 and overwritten by the values of props_dict in order.
         """
         # Make function for constructing the material parameters
         def construct_mat_param(int_id):
@@ -65,11 +188,6 @@ class GomFile(FlagFile):
                 form = form + f"\n{str(key)}\n{str(value)}"
             return form
 
-        print("Warning: In update_ESM_material_props:\n"
-              "This function overwrites all of the values in the ESM material\n"
-              "Currently only works for setting the material parameters"
-              )
-        
         # Construct the param file flags
         param_file_dict = {construct_mat_param(i+1):0.0 for i in range(50)}
 
@@ -81,29 +199,50 @@ class GomFile(FlagFile):
         for key, new_value in zip(param_file_dict, props_dict.values()):
              param_file_dict[key] = new_value
 
-        esm_dict = {}
-        esm_dict[esm_name] = construct_prop_str(param_file_dict)
+        return construct_prop_str(param_file_dict)
 
-        self.modify_flags(esm_dict, "$$INITIAL_STATE_VARIABLE_SOLID_01")
+    def update_ESM_material_props(self, esm_name, props_dict:dict,
+                                  new_esm_name = None):
         
-        # update the esm name if necessary
-        if not new_esm_name is None:
-            # Open the file
-            with open(self.file_dir, 'r') as file:
-                lines = file.readlines()
-            
-            for i, line in enumerate(lines):
-                if esm_name in line:
-                    lines[i] = new_esm_name +"\n"
-            
-            with open(self.file_dir, "w") as file:
-                file.writelines(lines)
+        """
+        Update the material properties for a ESM material
+        """
+        print("Warning: In update_ESM_material_props:\n"
+              "This function overwrites all of the values in the ESM material\n"
+              "Currently only works for setting the material parameters"
+              )
 
-            # Find the location of the 
+        esm_dict = {}
+        esm_dict[esm_name] = self.make_ESM_material_value(props_dict)
 
-        # If update the material name do that
+        # Write the properties and the new name in one pass over the file
+        with self.edit() as session:
+            session.modify_flags(esm_dict, self.esm_end_flag)
 
-        
-        
+            # update the esm name if necessary
+            if not new_esm_name is None:
+                session.replace_lines(esm_name, new_esm_name)
+
+    def get_ESM_template(self, esm_name, flags = None):
+        """
+        Compile the GOM file into a template where the ESM material block of esm_name can be replaced.
+
+        Render a variant with {esm_name: GomFile.make_ESM_material_value(props_dict)}.
+
+        Parameters
+        ----------
+        esm_name : str
+            Name of the ESM material
+        flags : list of str (Optional)
+            Other flags that should be parameterized. Their values end at the next flag
+
+        Returns
+        -------
+        FlagTemplate
+        """
+        flags_dict = {esm_name: self.esm_end_flag}
+
+        for flag in flags or []:
+            flags_dict[flag] = "$$"
 
-    
\ No newline at end of file
+        return self.get_template(flags_dict)
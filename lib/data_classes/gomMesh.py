@@ -0,0 +1,168 @@
+"""
+Class to hold the mesh of a GOM file as NumPy arrays
+"""
+import os
+import numpy as np
+
+from lib.data_classes.spatialIndex import SpatialIndex
+from lib.general_functions.mesh_functions import calc_element_bounding_boxes, calc_element_centroids, \
+                                                 calc_element_volumes, get_material_point_ids
+
+class GomMesh:
+    """
+    Node coordinates and element connectivity of a model.
+
+    Attributes
+    ----------
+    nodes : np.ndarray
+        (num_nodes, dim) node coordinates
+    elements : np.ndarray
+        (num_elements, nodes_per_element) connectivity. The node ids are 0 based so they index ``nodes``
+        directly, the GOM file uses 1 based ids
+    element_type : str or None
+        The element type from the GOM file, e.g. "tetrahedral_old"
+    """
+
+    def __init__(self, nodes, elements, element_type = None):
+        self.nodes = nodes
+        self.elements = elements
+        self.element_type = element_type
+
+        if elements.size and (elements.min() < 0 or elements.max() >= len(nodes)):
+            raise ValueError(f"The connectivity uses node ids outside of the {len(nodes)} nodes")
+
+        # Memoized element properties
+        self._element_props = {}
+        self._spatial_index = None
+
+    def __str__(self):
+        return (f"Element type: {self.element_type}\n"
+                f"Number of nodes: {self.num_nodes}\n"
+                f"Number of elements: {self.num_elements}\n"
+                f"Bounding box: {self.get_bounding_box()}\n")
+
+    @property
+    def num_nodes(self):
+        return len(self.nodes)
+
+    @property
+    def num_elements(self):
+        return len(self.elements)
+
+    @property
+    def dim(self):
+        return self.nodes.shape[1]
+
+    @property
+    def nodes_per_element(self):
+        return self.elements.shape[1]
+
+    def get_bounding_box(self):
+        """
+        Returns the (min coords, max coords) of every node
+        """
+        return self.nodes.min(axis = 0), self.nodes.max(axis = 0)
+
+    def get_element_centroids(self):
+        """
+        Returns the (num_elements, dim) centroids of the elements
+        """
+        return self._get_element_prop("centroids", calc_element_centroids)
+
+    def get_element_bounding_boxes(self):
+        """
+        Returns the (min coords, max coords) of every element, each (num_elements, dim)
+        """
+        return self._get_element_prop("bounding_boxes", calc_element_bounding_boxes)
+
+    def get_element_volumes(self):
+        """
+        Returns the volume (area for 2D meshes) of every element
+        """
+        return self._get_element_prop("volumes", calc_element_volumes)
+
+    def get_total_volume(self):
+        """
+        Returns the volume (area for 2D meshes) of the mesh
+        """
+        return self.get_element_volumes().sum()
+
+    def get_spatial_index(self):
+        """
+        Returns the spatial index over the element centroids. It's built on the first call
+        """
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self.get_element_centroids())
+
+        return self._spatial_index
+
+    def get_elements_in_box(self, min_coords, max_coords):
+        """
+        Returns the 0 based ids of the elements whose centroid is inside of the box
+        """
+        return self.get_spatial_index().query_box(min_coords, max_coords)
+
+    def get_elements_in_sphere(self, center, radius):
+        """
+        Returns the 0 based ids of the elements whose centroid is within radius of the center
+        """
+        return self.get_spatial_index().query_sphere(center, radius)
+
+    def get_nearest_elements(self, coord, k = 1):
+        """
+        Returns the 0 based ids of the k elements whose centroids are nearest to the coordinate, nearest first
+        """
+        return self.get_spatial_index().query_nearest(coord, k = k)
+
+    def get_material_point_ids(self, element_ids, mps_per_element = 1):
+        """
+        Returns the material point ids inside of the elements for CPSFile.update_output_mat_points.
+        See mesh_functions.get_material_point_ids for the numbering that is assumed
+        """
+        if np.ndim(mps_per_element) != 0 and len(mps_per_element) != self.num_elements:
+            raise ValueError(f"mps_per_element must have a value for each of the {self.num_elements} elements")
+
+        return get_material_point_ids(element_ids, mps_per_element = mps_per_element)
+
+    def save(self, file_dir, key = None):
+        """
+        Save the mesh as a .npz file. The file is written to a temp file first so it's never half written
+
+        Parameters
+        ----------
+        file_dir : str
+            Path of the .npz file
+        key : list (Optional)
+            Identifies the GOM file that the mesh was parsed from
+        """
+        tmp_path = f"{file_dir}.{os.getpid()}.tmp.npz"
+
+        np.savez(tmp_path, nodes = self.nodes, elements = self.elements,
+                 element_type = np.array("" if self.element_type is None else self.element_type),
+                 key = np.array([] if key is None else key, dtype = str))
+
+        os.replace(tmp_path, file_dir)
+
+    @classmethod
+    def load(cls, file_dir, key = None):
+        """
+        Load a mesh saved with :meth:`save`
+
+        Returns
+        -------
+        GomMesh or None
+            None if a key is given and it doesn't match the key of the file
+        """
+        with np.load(file_dir) as data:
+            if key is not None and data["key"].tolist() != [str(value) for value in key]:
+                return None
+
+            element_type = str(data["element_type"]) or None
+
+            return cls(data["nodes"], data["elements"], element_type = element_type)
+
+    def _get_element_prop(self, name, calc_func):
+        if name not in self._element_props:
+            self._element_props[name] = calc_func(self.nodes, self.elements)
+
+        return self._element_props[name]
@@ -1,18 +1,35 @@
 import os
 import copy
+import shutil
+import asyncio
+import threading
 
-from lib.general_functions.executing_runs import run_batch_script
+from lib.general_functions.executing_runs import generate_batch_script, run_batch_script, run_solver_async
 from lib.general_functions.general_functions import create_folder_if_not_exists
 from lib.data_classes.setupClass import ModelSetup
 from lib.data_classes.resultsClass import ModelResults
 from lib.data_classes.folder import Folder
-from lib.general_functions.general_functions import delete_files_with_extensions
+from lib.data_classes.gomClass import GomFile
+from lib.data_classes.scratchStage import ScratchStage
+from lib.data_classes.stageState import StageState
+from lib.general_functions.hash_functions import get_model_input_files, hash_file
+from lib.general_functions.par_reader import is_par_file
+from lib.general_functions.general_functions import delete_files_with_extensions, link_or_copy_file
 
 # Import information about the benchmarks
 
 class AnuraModel:
     # Purpose to hold information about a model
 
+    # Files that are cloned into a derivative model
+    input_extensions = ['.CPS_001', '.GOM', '.GOM' + GomFile.mesh_cache_suffix, '.dll', '.out', '.exe', '.bat']
+
+    # Files that aren't modified and are linked rather than copied into a derivative model
+    link_extensions = ('.GOM', '.GOM' + GomFile.mesh_cache_suffix, '.dll', '.exe')
+
+    # Files that are renamed with the model
+    rename_extensions = ['.CPS_001', '.GOM', '.GOM' + GomFile.mesh_cache_suffix]
+
     def __init__(self, exe_path, model_folder_path, model_name, benchmark = True, benchmark_name = None ):
         
         # Construct a folder object
@@ -34,36 +51,432 @@ class AnuraModel:
         # Init a variable to store the stage that has been run
         self.current_stage = 0
 
+        # The stages that have been run, kept on disk so a run can be resumed
+        self.stage_state = StageState(self.folder.folder_dir, model_name)
+
     def __str__(self):
         return f"Model Name: {self.model_name} \nModel Path: {self.model_path} \nExecutable Path: {self.exe_path}"
     
 
-    def run_stage(self, print_output):
+    def run_stage(self, print_output, num_threads = None, cpu_ids = None, telemetry = None, watchdog = None,
+                  scratch_dir = None, stop_event = None):
         # Purpose: Run a stage of the model 
         # run_executable(self.exe_path, self.model_path)
+        # num_threads sets the number of OpenMP threads and cpu_ids pins the solver, see run_batch_script
+        # The time and resources of the stage are stored in telemetry (RunTelemetry) if it's given
+        # A watchdog (DivergenceWatchdog) stops the solver when the run diverges, the reason is in watchdog.reason
+        # With a scratch_dir (local disk or tmpfs) the stage runs in a copy of the model folder, see ScratchStage
+        # The solver is terminated when stop_event (threading.Event) is set
+
+        if telemetry is not None:
+            stage_info = telemetry.start_stage(self)
+
+        batch_script_path = self.setup.batch_script_path
+        scratch = None
+
+        if scratch_dir is not None:
+            scratch = self._open_scratch(scratch_dir)
+            batch_script_path = os.path.join(scratch.scratch_dir, os.path.basename(batch_script_path))
+
+        if watchdog is not None:
+            # Follow the files where the stage writes them
+            watchdog.folder_dir = self.folder.folder_dir if scratch is None else scratch.scratch_dir
+
+        try:
+            # Run the batch file and return the exit code
+            exit_code, usage = run_batch_script(batch_script_path, flag_print_Blog=print_output,
+                                                num_threads=num_threads, cpu_ids=cpu_ids, return_usage=True,
+                                                watchdog=watchdog, stop_event=stop_event)
+        finally:
+            if scratch is not None:
+                scratch.close()
+
+        if telemetry is not None:
+            status = "diverged" if usage["diverged"] is not None else None
+            telemetry.record_stage(self, stage_info, usage, exit_code, status = status, num_threads = num_threads)
+
+        return exit_code
+
+    async def run_stage_async(self, print_output = False, timeout = None, log_file = None,
+                              on_stdout = None, on_stderr = None, env = None, num_threads = None, cpu_ids = None,
+                              telemetry = None, watchdog = None, scratch_dir = None):
+        """
+        Run the current stage by launching the executable directly (no shell or batch file) and stream
+        the output. See executing_runs.run_solver_async.
+
+        Parameters
+        ----------
+        print_output : bool (Optional)
+            Print each line of the output as it's written, unless callbacks are given
+        timeout : float (Optional)
+            Wall clock limit of the stage in seconds
+        log_file : str (Optional)
+            File that the output is appended to
+        on_stdout, on_stderr : callable (Optional)
+            Called with each line of the output
+        env : dict (Optional)
+            Environment of the process
+        num_threads : int (Optional)
+            Number of OpenMP threads of the solver
+        cpu_ids : list of int (Optional)
+            Pin the solver to these cpus (linux only)
+        telemetry : RunTelemetry (Optional)
+            Store the time and resources of the stage
+        watchdog : DivergenceWatchdog (Optional)
+            Stop the solver when the run diverges, the reason is in result["diverged"]
+        scratch_dir : str (Optional)
+            Run the stage in a copy of the model folder made in this folder (a local disk or tmpfs) and
+            copy the results back when it ends, see ScratchStage
+
+        Returns
+        -------
+        dict
+            The result of run_solver_async
+        """
+        if print_output:
+            on_stdout = on_stdout or print
+            on_stderr = on_stderr or print
+
+        if telemetry is not None:
+            stage_info = telemetry.start_stage(self)
+
+        folder_dir = self.folder.folder_dir
+        model_path = self.model_path
+        scratch = None
+
+        if scratch_dir is not None:
+            scratch = await self._open_scratch_async(scratch_dir)
+            folder_dir = scratch.scratch_dir
+            model_path = os.path.join(folder_dir, self.model_name)
+
+        if watchdog is not None:
+            # Follow the files where the stage writes them
+            watchdog.folder_dir = folder_dir
+
+        cmd = [self.setup.exe_path, model_path]
+
+        try:
+            result = await run_solver_async(cmd, cwd = folder_dir, env = env, timeout = timeout,
+                                            on_stdout = on_stdout, on_stderr = on_stderr, log_file = log_file,
+                                            num_threads = num_threads, cpu_ids = cpu_ids, watchdog = watchdog)
+        finally:
+            if scratch is not None:
+                # The thread finishes copying back even if the task is cancelled while waiting for it
+                await asyncio.to_thread(scratch.close)
+
+        if telemetry is not None:
+            if result["diverged"] is not None:
+                status = "diverged"
+            elif result["timed_out"]:
+                status = "timed_out"
+            else:
+                status = None
+            telemetry.record_stage(self, stage_info, result, result["exit_code"], status = status,
+                                   num_threads = num_threads)
+
+        return result
+
+    async def run_benchmark_async(self, resume = True, **kwargs):
+        """
+        Run the remaining stages with run_stage_async. Stops at the first stage that doesn't end with
+        exit code 0 or that diverged. kwargs are passed to run_stage_async. With resume the run continues after the
+        last completed stage of the stage state file, see prepare_stages
+
+        Returns
+        -------
+        list of dict
+            The result of each stage that ran
+        """
+        num_stages = self.get_num_stages()
+        results = []
+
+        self.prepare_stages(resume = resume)
+
+        while self.current_stage <= num_stages-1:
+            result = await self.run_stage_async(**kwargs)
+            results.append(result)
 
-        # Run the batch file
-        run_batch_script(self.setup.batch_script_path, flag_print_Blog=print_output)
+            if result["exit_code"] != 0 or result["diverged"] is not None:
+                break
 
-    def run_benchmark(self, print_output = True):
-        # Purpose: Run a benchmark in one go
+            self.finish_stage(result["exit_code"])
 
+        return results
+
+    def run_benchmark(self, print_output = True, run_cache = None, link_cached = False, resume = True,
+                      telemetry = None, watchdog = None, scratch_dir = None):
+        """
+        Run a benchmark in one go
+
+        Parameters
+        ----------
+        print_output : bool (Optional)
+            Print the output of each stage
+        run_cache : RunCache (Optional)
+            If the inputs of the model match a completed run in the cache, its output is restored
+            instead of running the solver. Otherwise the output is stored once every stage completed
+        link_cached : bool (Optional)
+            Hard link the restored files instead of copying them, see RunCache.restore
+        resume : bool (Optional)
+            Continue after the last completed stage of an earlier run that was stopped part way, see prepare_stages
+        telemetry : RunTelemetry (Optional)
+            Store the time and resources of each stage
+        watchdog : DivergenceWatchdog (Optional)
+            Stop the solver when the run diverges. The later stages aren't run
+        scratch_dir : str (Optional)
+            Run each stage in a copy of the model folder on a local disk or tmpfs, see ScratchStage
+        """
         # Store the setup object
         setup = self.setup
 
+        self.prepare_stages(resume = resume)
+
+        # The key is made from the inputs before anything is run
+        run_key = None
+        if run_cache is not None and self.current_stage == 0:
+            run_key = run_cache.make_key(self)
+
+            if run_cache.restore(self, key = run_key, link = link_cached):
+                self.current_stage = setup.num_stages
+                return
+
+        all_stages_passed = True
         while self.current_stage <= setup.num_stages-1:
             # Run the first stage
-            self.run_stage(print_output)
+            exit_code = self.run_stage(print_output, telemetry = telemetry, watchdog = watchdog,
+                                       scratch_dir = scratch_dir)
+            all_stages_passed = all_stages_passed and exit_code == 0
             print("----------------------------------------")
-            if setup.num_stages >= 2 and self.current_stage != setup.num_stages -1:
-                # Modify the CPS file
-                setup.modify_CPS(setup.benchmark_info["modify_cps_flags"], 
-                                 which_file="last")
 
-            # Increment the current stage
-            self.current_stage += 1
+            if watchdog is not None and watchdog.diverged:
+                # The stage isn't recorded as completed, so a resumed run starts it again
+                print(f"Stopped {self.model_name} at stage {self.current_stage + 1}: {watchdog.reason}")
+                return
+            self.finish_stage(exit_code)
+
+        if run_key is not None and all_stages_passed:
+            run_cache.store(self, run_key)
+
+    async def _open_scratch_async(self, scratch_dir):
+        """
+        Run _open_scratch in a thread so other jobs of the event loop run while the files are copied.
+
+        The thread keeps copying when the task is cancelled, so whichever of the two ends last deletes
+        the scratch folder.
+
+        Returns
+        -------
+        ScratchStage
+        """
+        lock = threading.Lock()
+        opened = {"scratch": None, "abandoned": False}
+
+        def open_scratch():
+            scratch = self._open_scratch(scratch_dir)
+
+            with lock:
+                if opened["abandoned"]:
+                    # Nothing waits for the scratch folder anymore
+                    scratch.remove()
+                    return None
+                opened["scratch"] = scratch
+
+            return scratch
+
+        try:
+            return await asyncio.to_thread(open_scratch)
+        except BaseException:
+            with lock:
+                opened["abandoned"] = True
+                scratch = opened["scratch"]
+
+            if scratch is not None:
+                # The copy ended at the same time as the task was cancelled
+                scratch.remove()
+            raise
+
+    def _open_scratch(self, scratch_dir):
+        """
+        Copy the model folder into a new ScratchStage in scratch_dir with a batch file that runs the
+        model there. The batch file of the model isn't copied in either direction
+
+        Returns
+        -------
+        ScratchStage
+        """
+        batch_file_name = os.path.basename(getattr(self.setup, "batch_script_path", "calculate.bat"))
+
+        scratch = ScratchStage(self.folder.folder_dir, scratch_dir, exclude_files = [batch_file_name])
+        scratch.open()
+
+        try:
+            generate_batch_script(scratch.scratch_dir, self.setup.exe_path,
+                                  os.path.join(scratch.scratch_dir, self.model_name), batch_file_name = batch_file_name)
+        except BaseException:
+            scratch.remove()
+            raise
+
+        return scratch
+
+    def get_num_stages(self):
+        """
+        Returns the number of stages of the model. Models that aren't benchmarks have a single stage
+        """
+        return self.setup.num_stages if self.benchmark else 1
+
+    def prepare_stages(self, resume = True):
+        """
+        Load the stage state file before the stages are run.
+
+        If the model is at the first stage and the state file records completed stages of a run with
+        the same inputs, the model continues after the last completed stage: CPS_ files written by a
+        stage that didn't complete are deleted, the rows it appended to the .PAR_ and .OUT files are
+        cut off, the CPS file is modified for the next stage if that
+        didn't happen yet and current_stage is set. Otherwise a new state is started.
+
+        Parameters
+        ----------
+        resume : bool (Optional)
+            If False, a new state is always started
+
+        Returns
+        -------
+        int
+            The current stage
+        """
+        if self.current_stage != 0:
+            # Already part way through the stages in memory
+            return self.current_stage
+
+        state = self.stage_state.load()
+        input_hashes = self._get_input_hashes()
+
+        if not resume or state.input_hashes != input_hashes:
+            state.reset(input_hashes, self._get_output_sizes())
+            return self.current_stage
+
+        completed = state.get_completed_stages()
+
+        # Delete the CPS_ files of a stage that was stopped part way, the stage is run again
+        last_cps_file = completed[-1]["cps_file"] if completed else None
+        self._delete_later_cps_files(last_cps_file)
+
+        # Its output would be repeated in the time series
+        self._truncate_outputs(state.get_output_sizes())
+
+        state.stages = completed
+        state.save()
+
+        if not completed:
+            return self.current_stage
+
+        num_stages = self.get_num_stages()
+        last_stage = completed[-1]["stage"]
+
+        if len(completed) < num_stages and not completed[-1]["modify_cps_applied"]:
+            # Modifying the CPS file sets fixed values, so it's safe to do again if it was interrupted
+            self._modify_CPS_for_next_stage()
+            state.set_modify_cps_applied(last_stage)
+
+        self.current_stage = len(completed)
+
+        if self.current_stage == num_stages:
+            print(f"Every stage of {self.model_name} was completed by an earlier run")
+        else:
+            print(f"Resuming {self.model_name} after stage {self.current_stage} of {num_stages}")
+
+        return self.current_stage
+
+    def finish_stage(self, exit_code = None):
+        """
+        Prepare the model for the next stage after a stage has run: record the stage in the stage
+        state file, modify the CPS file if there is another stage and increment the current stage
+
+        Parameters
+        ----------
+        exit_code : int (Optional)
+            Exit code of the stage. Stages with a non zero exit code aren't resumed from
+        """
+        state = self.stage_state
+
+        # Record the stage before the CPS file is modified, a crash in between modifies it again on resume
+        self.folder.get_file_index(refresh = True)
+        cps_file = self.folder.get_highest_numbered_file(".CPS_")
+        state.record_stage(self.current_stage, exit_code, cps_file, self._get_output_sizes())
+
+        if self.get_num_stages() >= 2 and self.current_stage != self.get_num_stages() -1:
+            # Modify the CPS file
+            self._modify_CPS_for_next_stage()
+            state.set_modify_cps_applied(self.current_stage)
+
+        # Increment the current stage
+        self.current_stage += 1
+
+    def _modify_CPS_for_next_stage(self):
+        setup = self.setup
+        setup.modify_CPS(setup.benchmark_info["modify_cps_flags"], which_file="last")
+
+    def _get_input_hashes(self):
+        """
+        Returns the hashes of the executable and of the input files that the stages don't write (the
+        first CPS file, the GOM file and dlls)
+        """
+        input_hashes = {"exe": hash_file(self.setup.exe_path)}
+
+        for file_name in get_model_input_files(self):
+            input_hashes[file_name] = hash_file(os.path.join(self.folder.folder_dir, file_name))
+
+        return input_hashes
+
+    def _get_output_sizes(self):
+        """
+        Returns file name -> size of the .PAR_ and .OUT files in the model folder
+        """
+        output_sizes = {}
+
+        with os.scandir(self.folder.folder_dir) as entries:
+            for entry in entries:
+                if (is_par_file(entry.name) or entry.name.upper().endswith(".OUT")) and entry.is_file():
+                    output_sizes[entry.name] = entry.stat().st_size
+
+        return output_sizes
+
+    def _truncate_outputs(self, output_sizes):
+        """
+        Cut the .PAR_ and .OUT files back to the sizes in output_sizes and delete the ones that aren't in
+        it. Does nothing if output_sizes is None (a state file written before the sizes were recorded)
+        """
+        if output_sizes is None:
+            return
+
+        for file_name, size in self._get_output_sizes().items():
+            file_dir = os.path.join(self.folder.folder_dir, file_name)
+
+            if file_name not in output_sizes:
+                os.remove(file_dir)
+                print(f"Deleted {file_name} of an unfinished stage")
+
+            elif size > output_sizes[file_name]:
+                with open(file_dir, "r+b") as f:
+                    f.truncate(output_sizes[file_name])
+                print(f"Removed the output of an unfinished stage from {file_name}")
+
+    def _delete_later_cps_files(self, last_cps_file = None):
+        """
+        Delete the CPS_ files numbered after last_cps_file, or after the first CPS file if it's None
+        """
+        cps_files = self.folder.get_file_index(refresh = True)["by_number"].get(".CPS_", {})
+
+        last_number = 1
+        for number, file_name in cps_files.items():
+            if file_name == last_cps_file:
+                last_number = number
+
+        for number, file_name in cps_files.items():
+            if number > last_number:
+                os.remove(os.path.join(self.folder.folder_dir, file_name))
+                print(f"Deleted {file_name} of an unfinished stage")
 
-         
     def get_copy(self):
         """
         Make a full copy of current model. This includes all the objects that it's holding
@@ -71,49 +484,57 @@ class AnuraModel:
 
         return copy.deepcopy(self)    
 
-    def get_new_deriv_model(self, new_model_dir, new_model_name=None, delete_files=True, overwrite_files = True):
+    def get_new_deriv_model(self, new_model_dir, new_model_name=None, delete_files=True, overwrite_files = True,
+                            link_files = True):
         """
         Create a derivative model, useful for parametric analysis.
         Copies the current model's files to a new directory, optionally renames core files, 
         and returns a new model object pointing to the copied model.
 
+        Only the input files are cloned. Large files that aren't modified (the GOM file, its mesh cache,
+        dlls and executables) are reflinked or hard linked instead of copied, see
+        general_functions.link_or_copy_file.
+
         Parameters:
         - new_model_dir (str): Directory where the new model will be created.
         - new_model_name (str, optional): New name for the model. If provided, renames CPS and GOM files.
-        - delete_files (bool): If True, deletes existing files in the new model directory before copying.
+        - delete_files (bool): If True, only the input files are cloned and other files in the new model directory are deleted.
+        - link_files (bool): If False, every file is copied.
 
         Returns:
         - AnuraModel: The new model object.
         """
-        # Copy all the files from the current model folder to the new model directory
-        self.folder.copy_files_2_folder(new_folder_dir=new_model_dir)
+        create_folder_if_not_exists(new_model_dir)
 
-        
         # Optionally delete files in the new directory
         if delete_files:
             # Clear the new folder of the all folder dat
-            delete_files_with_extensions(new_model_dir, ['.CPS_001', '.GOM', '.dll', '.out', '.exe', '.bat'])
+            delete_files_with_extensions(new_model_dir, self.input_extensions)
 
         elif not delete_files and new_model_name:
             raise NotImplementedError("Renaming files without resetting to CPS_001 and GOM is not yet supported.")
 
-        # Create a temporary model to rename files if needed
-        temp_model = AnuraModel(
-            exe_path=self.setup.exe_path,
-            model_folder_path=new_model_dir,
-            model_name=self.model_name,
-            benchmark=self.benchmark,
-            benchmark_name=self.benchmark_name
-        )
+        for file_name in os.listdir(self.folder.folder_dir):
+            file_path = os.path.join(self.folder.folder_dir, file_name)
+
+            # Only clone files (skip directories)
+            if not os.path.isfile(file_path):
+                continue
+
+            if delete_files and not file_name.endswith(tuple(self.input_extensions)):
+                continue
+
+            # Rename CPS and GOM files if a new model name is provided
+            new_file_name = file_name
+            if new_model_name and file_name in [self.model_name + extension for extension in self.rename_extensions]:
+                new_file_name = new_model_name + file_name[len(self.model_name):]
+
+            new_file_path = os.path.join(new_model_dir, new_file_name)
 
-        # Rename CPS and GOM files if a new model name is provided
-        if new_model_name:
-            cps = temp_model.setup.get_CPS_file(which_file=1)[0]
-            gom = temp_model.setup.get_GOM_file()
-            # Get the file dir for the renamed files
-            base_file_dir = os.path.join(new_model_dir, new_model_name)
-            cps.new_file_name(f"{base_file_dir}.CPS_001")
-            gom.new_file_name(f"{base_file_dir}.GOM")
+            if link_files and file_name.endswith(self.link_extensions):
+                link_or_copy_file(file_path, new_file_path)
+            else:
+                shutil.copy2(file_path, new_file_path)
 
         # Create the new model with updated information
         new_model = AnuraModel(
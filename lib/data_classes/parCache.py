@@ -0,0 +1,313 @@
+"""
+Class to manage binary sidecar copies of parsed .PAR_ files so that they don't have to be parsed again
+"""
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+class ParCache:
+    """
+    Persistent cache of parsed .PAR_ files.
+
+    Each cached .PAR_ file gets a binary sidecar next to it (``<name>.PAR_xxx.cache.<format>``) and a
+    small entry file (``<sidecar>.json``) that stores the key of the sidecar (path, size and modification
+    time of the .PAR_ file), the columns and the dtype it holds. A sidecar is only used if the key still
+    matches the .PAR_ file. Loading a sidecar touches its modification time, which is when it was last
+    used. When the total size of the sidecars is larger than ``max_bytes`` the least recently used
+    sidecars are deleted.
+
+    Every sidecar has its own entry file, so threads and processes that cache different files never
+    write to the same file and loading a file doesn't write anything but the time stamp.
+
+    Attributes
+    ----------
+    folder_dir : str
+        The folder that holds the .PAR_ files and the sidecars.
+    max_bytes : int
+        Size cap of all the sidecars in the folder.
+    cache_format : str
+        "npz", "parquet" or "feather". "parquet" and "feather" require pyarrow.
+    """
+
+    formats = ("npz", "parquet", "feather")
+    entry_suffix = ".json"
+
+    def __init__(self, folder_dir, max_bytes = 2 * 1024**3, cache_format = "npz"):
+        if cache_format not in self.formats:
+            raise ValueError(f"cache_format must be one of {self.formats}. Got {cache_format}")
+
+        self.folder_dir = folder_dir
+        self.max_bytes = max_bytes
+        self.cache_format = cache_format
+
+        # Size of the sidecars in the folder, None until the folder is scanned
+        self._total_bytes = None
+
+        # Guards the size when files are stored from several threads
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # The lock can't be pickled, e.g. when the cache is sent to a process pool
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        sidecars = self._get_sidecars()
+        return (f"Cache folder: {self.folder_dir}\n"
+                f"Number of cached files: {len(sidecars)}\n"
+                f"Cache size: {sum(nbytes for _, nbytes, _ in sidecars)} bytes\n")
+
+    def get_sidecar_path(self, par_file_dir):
+        """
+        Returns the path of the sidecar for a .PAR_ file
+        """
+        return f"{par_file_dir}.cache.{self.cache_format}"
+
+    def get_entry_path(self, par_file_dir):
+        """
+        Returns the path of the entry file that describes the sidecar of a .PAR_ file
+        """
+        return self.get_sidecar_path(par_file_dir) + self.entry_suffix
+
+    @classmethod
+    def is_cache_file(cls, file_name):
+        """
+        Returns True if the file name belongs to a sidecar or an entry file (including their temp files)
+        """
+        return any(f".cache.{cache_format}" in file_name for cache_format in cls.formats)
+
+    def get_size(self):
+        """
+        Returns the total size in bytes of the sidecars in the folder
+        """
+        return sum(nbytes for _, nbytes, _ in self._get_sidecars())
+
+    def load(self, par_file_dir, columns = None, dtype = None):
+        """
+        Load a .PAR_ file from its sidecar.
+
+        Parameters
+        ----------
+        par_file_dir : str
+            Path to the .PAR_ file
+        columns : list of str (Optional)
+            Columns that are needed. Defaults to every column in the file.
+        dtype : numpy dtype or tuple (Optional)
+            dtype the columns must have, or a tuple of the dtype names that are accepted ("mixed" for
+            columns with different dtypes). None accepts the dtype that was cached.
+
+        Returns
+        -------
+        tuple or None
+            (header, data) if the sidecar is valid and holds the requested columns, otherwise None.
+        """
+        entry = self._read_entry(self.get_entry_path(par_file_dir))
+
+        if entry is None or entry["key"] != self._make_key(par_file_dir):
+            return None
+
+        # The sidecar has to hold every requested column in the requested dtype
+        cached_cols = entry["columns"]
+        if columns is None and len(cached_cols) != len(entry["header"]):
+            return None
+        if columns is not None and not set(columns).issubset(cached_cols):
+            return None
+        if isinstance(dtype, tuple):
+            if entry["dtype"] not in dtype:
+                return None
+        elif dtype is not None and entry["dtype"] != np.dtype(dtype).name:
+            return None
+
+        # A sidecar of another size was written after the entry was read
+        sidecar_path = self.get_sidecar_path(par_file_dir)
+        try:
+            if os.path.getsize(sidecar_path) != entry["nbytes"]:
+                return None
+        except FileNotFoundError:
+            return None
+
+        data = self._read_sidecar(sidecar_path, cached_cols)
+
+        # Update when the sidecar was last used
+        try:
+            os.utime(sidecar_path)
+        except OSError:
+            pass
+
+        if columns is not None:
+            data = data[columns]
+
+        return entry["header"], data
+
+    def store(self, par_file_dir, header, data):
+        """
+        Write the sidecar for a .PAR_ file and evict old sidecars if the cache is too large.
+
+        Parameters
+        ----------
+        par_file_dir : str
+            Path to the .PAR_ file
+        header : list of str
+            Every column name in the .PAR_ file
+        data : pd.DataFrame
+            The loaded data
+        """
+        sidecar_path = self.get_sidecar_path(par_file_dir)
+        entry_path = self.get_entry_path(par_file_dir)
+
+        old_entry = self._read_entry(entry_path)
+        old_nbytes = old_entry["nbytes"] if old_entry is not None and os.path.exists(sidecar_path) else 0
+
+        self._write_sidecar(sidecar_path, data)
+
+        # Store the dtype if all of the columns share one
+        dtypes = set(dtype.name for dtype in data.dtypes)
+        if len(dtypes) == 1:
+            dtype_name = dtypes.pop()
+        else:
+            dtype_name = "mixed"
+
+        nbytes = os.path.getsize(sidecar_path)
+        self._write_entry(entry_path, {
+            "key" : self._make_key(par_file_dir),
+            "header" : list(header),
+            "columns" : [str(col) for col in data.columns],
+            "dtype" : dtype_name,
+            "nbytes" : nbytes,
+        })
+
+        with self._lock:
+            if self._total_bytes is None:
+                # The scan already counts the new sidecar
+                self._total_bytes = self.get_size()
+            else:
+                self._total_bytes += nbytes - old_nbytes
+
+            too_large = self._total_bytes > self.max_bytes
+
+        if too_large:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used sidecars until the cache fits inside of max_bytes.
+
+        store calls this when the sidecars it knows of are too large. Copies of the cache in other
+        processes (e.g. a process pool) only count the sidecars they wrote themselves, so call it once
+        after such a batch to bring the whole folder back inside of max_bytes.
+
+        Returns
+        -------
+        int
+            Size in bytes of the sidecars that are left
+        """
+        with self._lock:
+            sidecars = self._get_sidecars()
+            total_bytes = sum(nbytes for _, nbytes, _ in sidecars)
+
+            # Oldest first
+            for sidecar_path, nbytes, _ in sorted(sidecars, key=lambda sidecar: sidecar[2]):
+                if total_bytes <= self.max_bytes:
+                    break
+
+                # Remove the entry first so the sidecar is never used without it
+                for file_path in (sidecar_path + self.entry_suffix, sidecar_path):
+                    try:
+                        os.remove(file_path)
+                    except FileNotFoundError:
+                        # Evicted by another process
+                        pass
+
+                total_bytes -= nbytes
+
+            self._total_bytes = total_bytes
+
+        return total_bytes
+
+    def purge(self):
+        """
+        Delete every sidecar and entry file in the folder
+        """
+        with self._lock:
+            with os.scandir(self.folder_dir) as entries:
+                for entry in entries:
+                    if self.is_cache_file(entry.name) and entry.is_file():
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            pass
+
+            self._total_bytes = 0
+
+    def _get_sidecars(self):
+        """
+        Returns (path, size in bytes, last used) of each sidecar in the folder
+        """
+        sidecar_ends = tuple(f".cache.{cache_format}" for cache_format in self.formats)
+        sidecars = []
+
+        with os.scandir(self.folder_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(sidecar_ends):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    sidecars.append((entry.path, stat.st_size, stat.st_mtime))
+
+        return sidecars
+
+    def _make_key(self, par_file_dir):
+        """
+        Make the key that a sidecar has to match: path, size and modification time of the .PAR_ file
+        """
+        stat = os.stat(par_file_dir)
+        return [os.path.abspath(par_file_dir), stat.st_size, stat.st_mtime_ns]
+
+    def _read_entry(self, entry_path):
+        try:
+            with open(entry_path, "r") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError):
+            # A missing or broken entry only means the sidecar has to be (re)built
+            return None
+
+    def _write_entry(self, entry_path, entry):
+        # Write to a temp file first so a crash can't leave a half written entry
+        tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, entry_path)
+
+    def _write_sidecar(self, sidecar_path, data):
+        tmp_path = f"{sidecar_path}.{os.getpid()}.tmp"
+
+        if self.cache_format == "npz":
+            # Store each column as its own array so the dtypes are kept
+            arrays = {f"col_{i}": data.iloc[:, i].to_numpy() for i in range(data.shape[1])}
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+        elif self.cache_format == "parquet":
+            data.to_parquet(tmp_path)
+        elif self.cache_format == "feather":
+            data.reset_index(drop=True).to_feather(tmp_path)
+
+        os.replace(tmp_path, sidecar_path)
+
+    def _read_sidecar(self, sidecar_path, columns):
+        if self.cache_format == "npz":
+            with np.load(sidecar_path) as arrays:
+                data = pd.DataFrame({col: arrays[f"col_{i}"] for i, col in enumerate(columns)})
+        elif self.cache_format == "parquet":
+            data = pd.read_parquet(sidecar_path)
+        elif self.cache_format == "feather":
+            data = pd.read_feather(sidecar_path)
+
+        return data
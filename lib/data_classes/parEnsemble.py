@@ -0,0 +1,209 @@
+"""
+Class to hold the output of every material point in a results folder as one (point, step, component) array
+"""
+import numpy as np
+
+from lib.data_classes.parFile import ParFile
+from lib.general_functions.par_reader import get_material_point_id, get_stress_cols, get_strain_cols
+
+class ParEnsemble:
+    """
+    Consolidated view of the .PAR_ files of a model.
+
+    The data of every material point is copied once into a single contiguous array with the shape
+    (material_point, step, component). Material points with fewer steps than the longest file are
+    padded with NaN, the number of steps of each point is stored in ``num_steps``.
+
+    Attributes
+    ----------
+    values : np.ndarray
+        (num_points, max_steps, num_components) array
+    point_ids : list of int
+        Material point id of each entry along the first axis, parsed from the file names
+    components : list of str
+        Column name of each entry along the last axis
+    num_steps : np.ndarray
+        Number of steps that each material point has
+    flag_3D : bool
+        If the model is 3D. Controls which stress and strain components are used for the invariants
+    """
+
+    def __init__(self, par_files, components = None, dtype = None):
+        """
+        Parameters
+        ----------
+        par_files : list of ParFile
+            Par files that have their data loaded
+        components : list of str (Optional)
+            Columns to include. Defaults to the columns that every par file has
+        dtype : numpy dtype (Optional)
+            dtype of the array. Defaults to the dtype of the first par file
+        """
+        if len(par_files) == 0:
+            raise ValueError("At least one par file is needed to make an ensemble")
+
+        not_loaded = [par_file.file_name for par_file in par_files if not par_file.data_loaded]
+        if not_loaded:
+            raise AttributeError(f"Data must be loaded first for: {not_loaded}")
+
+        if components is None:
+            # Columns that are in every file, in the order of the first file
+            components = [col for col in par_files[0]._col_index
+                          if all(col in par_file._col_index for par_file in par_files)]
+
+        if dtype is None:
+            dtype = par_files[0].values.dtype
+
+        self.flag_3D = par_files[0].flag_3D
+        self.components = list(components)
+        self._component_index = {col: i for i, col in enumerate(self.components)}
+        self.file_names = [par_file.file_name for par_file in par_files]
+
+        # Use the position in the list if the file name doesn't have a material point id
+        self.point_ids = []
+        for i, par_file in enumerate(par_files):
+            point_id = get_material_point_id(par_file.file_name)
+            self.point_ids.append(i if point_id is None else point_id)
+
+        if len(set(self.point_ids)) != len(self.point_ids):
+            raise ValueError(f"Material point ids must be unique. Got {self.point_ids}")
+
+        self._point_index = {point_id: i for i, point_id in enumerate(self.point_ids)}
+
+        self.num_steps = np.array([len(par_file.values) for par_file in par_files])
+
+        # Copy each file into its slot of the array
+        self.values = np.full((len(par_files), self.num_steps.max(), len(self.components)), np.nan, dtype = dtype)
+        for i, par_file in enumerate(par_files):
+            self.values[i, :self.num_steps[i]] = par_file._get_block(self.components)
+
+        # Memoized invariants
+        self._invariants = {}
+
+    def __str__(self):
+        return (f"Number of material points: {len(self.point_ids)}\n"
+                f"Max number of steps: {self.values.shape[1]}\n"
+                f"Components: {self.components}\n"
+                f"Bytes held: {self.values.nbytes}\n")
+
+    @property
+    def shape(self):
+        """
+        (num_points, max_steps, num_components)
+        """
+        return self.values.shape
+
+    @classmethod
+    def from_results(cls, results, components = None, dtype = None):
+        """
+        Make the ensemble from the par files of a ModelResults object
+        """
+        return cls(results.par_files, components = components, dtype = dtype)
+
+    def sel(self, points = None, steps = None, components = None):
+        """
+        Select a part of the array. The result is a view when slices or single values are used.
+
+        Parameters
+        ----------
+        points : int or list of int (Optional)
+            Material point id(s). Defaults to every point
+        steps : int, slice or array_like (Optional)
+            Step index or indices. Defaults to every step
+        components : str or list of str (Optional)
+            Component name(s). Defaults to every component
+
+        Returns
+        -------
+        np.ndarray
+            The selected values. Axes that are selected with a single value are dropped
+        """
+        values = self.values
+
+        # Index the last axis first so that the positions of the other axes don't change
+        if components is not None:
+            if isinstance(components, str):
+                values = values[..., self._component_index[components]]
+            else:
+                values = values[..., self._get_component_ids(components)]
+
+        if steps is not None:
+            values = values[:, steps]
+
+        if points is not None:
+            if isinstance(points, (list, tuple, np.ndarray)):
+                values = values[[self._point_index[point_id] for point_id in points]]
+            else:
+                values = values[self._point_index[points]]
+
+        return values
+
+    def get_invariant(self, key):
+        """
+        Returns an invariant of every point and step, calculated over the whole array at once
+
+        Parameters
+        ----------
+        key : str
+            Any key of ParFile.invariant_funcs, e.g. "p", "q", "eps_p" or "eps_q"
+
+        Returns
+        -------
+        np.ndarray
+            (num_points, max_steps) array, (num_points, max_steps, 3) for the principal values.
+            Padded steps are NaN
+        """
+        if key not in ParFile.invariant_funcs:
+            raise KeyError(f"key must be one of {list(ParFile.invariant_funcs)}. Got {key}")
+
+        if key not in self._invariants:
+            invariant_func, col_set = ParFile.invariant_funcs[key]
+
+            if col_set == "stress":
+                cols = get_stress_cols(self.flag_3D)
+            else:
+                cols = get_strain_cols(self.flag_3D)
+
+            # Only the steps that each point has are evaluated, the padding is filled with NaN after
+            block = self.sel(components = cols)
+            valid_steps = np.arange(block.shape[1]) < self.num_steps[:, None]
+
+            valid_invariant = np.asarray(invariant_func(block[valid_steps]))
+
+            invariant = np.full(valid_steps.shape + valid_invariant.shape[1:], np.nan,
+                                dtype = np.result_type(valid_invariant.dtype, np.float32))
+            invariant[valid_steps] = valid_invariant
+            invariant.setflags(write = False)
+            self._invariants[key] = invariant
+
+        return self._invariants[key]
+
+    def get_point_spread(self, key):
+        """
+        Returns the min, mean and max of an invariant over all of the material points at each step
+
+        Returns
+        -------
+        dict
+            "min", "mean" and "max", each an array with one value per step
+        """
+        invariant = self.get_invariant(key)
+
+        return {"min": np.nanmin(invariant, axis = 0),
+                "mean": np.nanmean(invariant, axis = 0),
+                "max": np.nanmax(invariant, axis = 0)}
+
+    def _get_component_ids(self, components):
+        """
+        Returns a slice if the components are next to each other so that the array isn't copied
+        """
+        missing_cols = [col for col in components if col not in self._component_index]
+        if missing_cols:
+            raise KeyError(f"Components {missing_cols} aren't in the ensemble")
+
+        col_ids = [self._component_index[col] for col in components]
+
+        if col_ids == list(range(col_ids[0], col_ids[0] + len(col_ids))):
+            return slice(col_ids[0], col_ids[-1] + 1)
+
+        return col_ids
@@ -1,13 +1,21 @@
 import datetime
+import io
 import os
+import time
 import pandas as pd  # Import pandas for easy CSV parsing
 import matplotlib.pyplot as plt
 import numpy as np
 
 # Library imports
 from lib.data_classes.fileClass import File
-from lib.general_functions.invariant_functions import (calc_dev_strain_invariant, calc_mean_stress, calc_q_invariant, 
-                                                       calc_volumetric_strain_invariant)
+from lib.data_classes.parCache import ParCache
+from lib.data_classes.parMemmap import ParMemmap
+from lib.general_functions.invariant_functions import (calc_dev_strain_invariant_batch, calc_mean_stress_batch, 
+                                                       calc_q_invariant_batch, calc_volumetric_strain_invariant_batch)
+from lib.general_functions.principal_functions import (calc_J3_invariant, calc_lode_angle, calc_principal_strains,
+                                                       calc_principal_stresses)
+from lib.general_functions.par_reader import (get_stress_cols, get_strain_cols, make_read_stats, read_par_file,
+                                              resolve_par_columns)
 
 class ParFile(File):
     """
@@ -20,15 +28,40 @@ class ParFile(File):
     ----------
     header : list
         A list to store the header information from the .PAR_ file.
-    data : pd.DataFrame
-        A DataFrame to store the data from the .PAR_ file.
+    data : pd.DataFrame or ParMemmap
+        A DataFrame to store the data from the .PAR_ file. With the "memmap" reader this is a 
+        ParMemmap whose columns are views of a binary copy of the file.
+    values : np.ndarray
+        Column major array that holds the loaded data. data, stress_df and strain_df are views of it.
+    read_stats : dict
+        Number of rows, seconds and rows per second of the last read of the file.
 
     Methods
     -------
     load_data()
         Reads the .PAR_ file, extracts the header and data, and stores them.
+    refresh_data()
+        Reads only the rows that were appended to the .PAR_ file since the last call.
+    get_invariant(key, sign)
+        Returns a memoized invariant ("p", "q", "eps_p" or "eps_q").
+    get_nbytes()
+        Returns the number of bytes held in memory.
     """
 
+    # dtypes of the sidecars that the default reader may use. pandas gives float64 columns and int64
+    # for columns that only hold integers, a float32 sidecar of the fast reader isn't used
+    default_reader_dtypes = ("float64", "int64", "mixed")
+
+    # Function and stress/strain set used to calculate each invariant
+    invariant_funcs = {"p"    : (calc_mean_stress_batch, "stress"),
+                       "q"    : (calc_q_invariant_batch, "stress"),
+                       "eps_p": (calc_volumetric_strain_invariant_batch, "strain"),
+                       "eps_q": (calc_dev_strain_invariant_batch, "strain"),
+                       "sigma_principal": (calc_principal_stresses, "stress"),
+                       "J3"   : (calc_J3_invariant, "stress"),
+                       "lode" : (calc_lode_angle, "stress"),
+                       "eps_principal": (calc_principal_strains, "strain")}
+
     def __init__(self, file_dir, flag_3D):
         """
         Initialize a ParFile object with the file directory.
@@ -43,6 +76,25 @@ class ParFile(File):
         self.data = pd.DataFrame()  # DataFrame to store data
         self.data_loaded = False # Init flag to keep track when the data is loaded
         self.flag_3D = flag_3D
+        self.read_stats = None # Stores how fast the file was read
+
+        # Contiguous array that holds the data and the index of each column in it
+        self.values = None
+        self._col_index = {}
+
+        # Memoized invariants, signed invariants and the invariants that were added to the DataFrames
+        self._invariants = {}
+        self._signed_invariants = {}
+        self._df_invariants = set()
+
+        # Byte offset after the last complete line that was parsed by refresh_data
+        self.stream_offset = None
+        self._stream_columns = None
+        self._stream_dtype = None
+
+        # Arrays that refresh_data appends rows to: name -> buffer. The values and the memoized
+        # invariants are views of their first rows, see _append_to_buffer
+        self._buffers = {}
 
         # Variables to hold the results from the incremental driver run
         # self.time          = None
@@ -52,16 +104,45 @@ class ParFile(File):
         self.base_strain_cols = None
         self.base_stress_cols = None
 
-        self.invar_names = {"p":"p", "q":"q", "eps_p":"eps_p", "eps_q":"eps_q"} # Make a dict to hold the default invar names
+        self.invar_names = {"p":"p", "q":"q", "eps_p":"eps_p", "eps_q":"eps_q", # Make a dict to hold the default invar names
+                            "sigma_principal": ["sigma_1", "sigma_2", "sigma_3"], "J3": "J3", "lode": "lode",
+                            "eps_principal": ["eps_1", "eps_2", "eps_3"]}
+
+    def __getstate__(self):
+        # Only pickle the values once, the DataFrames that are views of them are rebuilt when unpickled
+        state = self.__dict__.copy()
+        state["stress_df"] = None
+        state["strain_df"] = None
+
+        # The views of the buffers are pickled without the unused rows
+        state["_buffers"] = {}
+
+        if self.is_memmap():
+            # The memmap is mapped again when unpickled
+            state["values"] = None
+        elif self.values is not None:
+            state["data"] = None
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        if self.is_memmap():
+            self._set_values(self.data.block(self.data.columns), self.data.columns, invalidate = False)
+        elif self.values is not None:
+            self._set_values(self.values, list(self._col_index), invalidate = False)
 
     def __str__(self):
         info = (
                 f"File Name: {self.file_name}\n"
                 f"Data Loaded: {self.data_loaded}\n"
+                f"Bytes held: {self.get_nbytes()['total']}\n"
         )
         return info
     
-    def load_data(self):
+    def load_data(self, reader = "default", columns = None, dtype = np.float64, print_speed = False, cache = None,
+                  rows = None):
         """
         Load the .PAR_ file, extracting the header and data.
 
@@ -69,6 +150,26 @@ class ParFile(File):
         and that the data is space-separated. It loads the header and data into 
         the `header` and `data` attributes, respectively.
 
+        Parameters
+        ----------
+        reader : str (Optional)
+            "default" reads every column as float64. "fast" uses the C tokenizer and only parses the 
+            requested columns with the requested dtype. "memmap" converts the file once into a column 
+            major binary file and maps it, so only the columns and rows that are used are read.
+        columns : str or list of str (Optional)
+            Only used by the "fast" reader. Column names to load, or "stress", "strain" or "invariants"
+            for the default stress and strain columns. Defaults to every column.
+        dtype : numpy dtype (Optional)
+            Only used by the "fast" and "memmap" readers. dtype the data is stored as, e.g. np.float32.
+        print_speed : bool (Optional)
+            Print the number of rows read per second.
+        cache : bool or ParCache (Optional)
+            Load the data from a binary sidecar if it matches the file, otherwise parse the file and 
+            write the sidecar. True uses a ParCache with the default settings in the folder of the file.
+            Defaults to None which doesn't use a cache.
+        rows : slice (Optional)
+            Only used by the "memmap" reader. Row range that is exposed, e.g. slice(0, 1000).
+
         Raises
         ------
         FileNotFoundError
@@ -78,11 +179,23 @@ class ParFile(File):
         """
 
         # Get the data and store it in the object
-        self.header, self.data = self.get_data()
+        self.header, data = self.get_data(reader = reader, columns = columns, dtype = dtype, cache = cache,
+                                          rows = rows)
+        self.data = data
+
+        # Store the data in one contiguous array
+        if self.is_memmap():
+            self._set_values(data.block(data.columns), data.columns)
+        else:
+            self._set_values(np.asfortranarray(data.to_numpy()), list(data.columns))
 
         # Set the flag since the data is loaded
         self.data_loaded = True
 
+        if print_speed:
+            print(f"Read {self.read_stats['rows']} rows from {self.file_name} in {self.read_stats['seconds']:.3f} s "
+                  f"({self.read_stats['rows_per_sec']:.0f} rows/s)")
+
     def get_header(self):
         """
         Returns the header of the .PAR_ file.
@@ -97,26 +210,66 @@ class ParFile(File):
         else:
             raise AttributeError("Data must be loaded first")
 
-    def get_data(self):
+    def get_data(self, reader = "default", columns = None, dtype = np.float64, cache = None, rows = None):
         """
         Returns the data from the .PAR_ file.
 
+        See :meth:`load_data` for the parameters.
+
         Returns
         -------
         pd.DataFrame
             The data contained in the .PAR_ file as a DataFrame.
         """
-        if not self.data_loaded:
+        if cache is True:
+            cache = ParCache(os.path.dirname(self.file_dir))
+
+        if not self.data_loaded and reader == "memmap":
+            if cache:
+                raise ValueError("The memmap reader already keeps a binary copy, it can't be used with the cache")
+
+            start_time = time.perf_counter()
+            data = ParMemmap(self.file_dir, dtype = dtype, rows = rows).open()
+            header = data.columns
+            self.read_stats = make_read_stats(len(data), time.perf_counter() - start_time)
+
+        elif not self.data_loaded and cache:
+            # Only the fast reader controls the columns and dtype
+            if reader == "fast":
+                cached = self._load_from_cache(cache, resolve_par_columns(columns, self.flag_3D), dtype)
+            else:
+                cached = self._load_from_cache(cache, None, self.default_reader_dtypes)
+
+            if cached is not None:
+                return cached
+
+            header, data = self.get_data(reader = reader, columns = columns, dtype = dtype)
+            cache.store(self.file_dir, header, data)
+
+        elif not self.data_loaded and reader == "fast":
+            col_names = resolve_par_columns(columns, self.flag_3D)
+            header, data, self.read_stats = read_par_file(self.file_dir, columns = col_names, dtype = dtype)
+
+        elif not self.data_loaded and reader == "default":
+            if columns is not None:
+                raise ValueError("Selecting columns is only supported by the fast reader")
+
             # Check if file exists
             if not os.path.exists(self.file_dir):
                 raise FileNotFoundError(f"The file {self.file_dir} does not exist.")
 
+            start_time = time.perf_counter()
             with open(self.file_dir, 'r') as f:
                 # Read header (assuming it is the first line)
                 header = f.readline().strip().split()  # Adjust if more header lines exist
 
             # Load data (assumes space-separated values)
             data = pd.read_csv(self.file_dir, sep=r'\s+', skiprows=1, names=header)
+            self.read_stats = make_read_stats(len(data), time.perf_counter() - start_time)
+
+        elif not self.data_loaded:
+            raise ValueError(f"reader must be 'default', 'fast' or 'memmap'. Got {reader}")
+
         elif self.data_loaded:
             # The data is already loaded
             header = self.header
@@ -126,6 +279,139 @@ class ParFile(File):
 
         return header, data
 
+    def refresh_data(self, columns = None, dtype = np.float64):
+        """
+        Read the rows that were appended to the .PAR_ file since the last call.
+
+        Used to follow a .PAR_ file while Anura3D is still writing it. The byte offset after the last 
+        complete line is stored, so each call only parses the new lines. A partially written last line
+        is left for the next call. If the stress or strain DataFrames are stored, the new rows are added 
+        to them and the invariants that are already loaded are only calculated for the new rows.
+
+        Parameters
+        ----------
+        columns : str or list of str (Optional)
+            Columns to load, see :meth:`load_data`. Only used by the first call.
+        dtype : numpy dtype (Optional)
+            dtype the data is stored as. Only used by the first call.
+
+        Returns
+        -------
+        int
+            The number of rows that were added.
+        """
+        if self.data_loaded and self.stream_offset is None:
+            raise ValueError("The data was loaded with load_data. Use refresh_data from the start to follow a file")
+
+        if not os.path.exists(self.file_dir):
+            raise FileNotFoundError(f"The file {self.file_dir} does not exist.")
+
+        start_time = time.perf_counter()
+
+        if self.stream_offset is not None and os.path.getsize(self.file_dir) < self.stream_offset:
+            # The file was rewritten (e.g. the stage was run again) so start over
+            self._reset_stream()
+
+        with open(self.file_dir, "rb") as f:
+            if self.stream_offset is None:
+                header_line = f.readline()
+
+                if not header_line.endswith(b"\n"):
+                    # The header hasn't been completely written yet
+                    return 0
+
+                self.header = header_line.decode().strip().split()
+                self._stream_columns = resolve_par_columns(columns, self.flag_3D)
+                self._stream_dtype = dtype
+                self.stream_offset = f.tell()
+
+                columns = self._stream_columns or self.header
+                self._set_values(np.empty((0, len(columns)), dtype = dtype, order = "F"), columns)
+                self.data_loaded = True
+            else:
+                f.seek(self.stream_offset)
+
+            new_bytes = f.read()
+
+        # Only parse up to the last complete line
+        end_index = new_bytes.rfind(b"\n") + 1
+        if end_index == 0:
+            return 0
+
+        new_data = pd.read_csv(io.BytesIO(new_bytes[:end_index]), sep=r'\s+', names=self.header, 
+                               usecols=self._stream_columns, dtype=self._stream_dtype, engine="c")
+        if self._stream_columns is not None:
+            new_data = new_data[self._stream_columns]
+
+        self.stream_offset += end_index
+        self._append_rows(new_data)
+
+        self.read_stats = make_read_stats(len(new_data), time.perf_counter() - start_time)
+
+        return len(new_data)
+
+    def _reset_stream(self):
+        """
+        Clear the data that was read by refresh_data
+        """
+        self.stream_offset = None
+        self.data_loaded = False
+        self.data = pd.DataFrame()
+        self.values = None
+        self._buffers = {}
+        self._clear_invariants()
+
+    def _append_rows(self, new_data):
+        """
+        Append new rows to the data and to the stored stress and strain DataFrames.
+        Invariants that are already memoized are only calculated for the new rows.
+        """
+        new_values = np.asfortranarray(new_data.to_numpy(dtype = self.values.dtype))
+
+        # Extend the memoized invariants with the new rows
+        for key, invariant in self._invariants.items():
+            new_invariant = self._append_to_buffer(key, invariant, self._calc_invariant(key, new_values))
+            new_invariant.setflags(write = False)
+            self._invariants[key] = new_invariant
+        self._signed_invariants = {}
+
+        values = self._append_to_buffer("values", self.values, new_values)
+        self._set_values(values, list(self._col_index), invalidate = False)
+
+    def _append_to_buffer(self, name, array, new_rows):
+        """
+        Returns a view of array with new_rows appended, without copying the rows that are already in it.
+
+        The view holds the first rows of a column major buffer that doubles its capacity when it's full,
+        so appending only costs the new rows. Rows after the view are never part of another view.
+        """
+        buffer = self._buffers.get(name)
+        num_rows = len(array) + len(new_rows)
+
+        if buffer is None or array.base is not buffer or len(buffer) < num_rows:
+            # Start a new buffer (the array wasn't made here) or grow the full one
+            capacity = max(num_rows, 2 * len(array))
+            new_buffer = np.empty((capacity,) + array.shape[1:], dtype = array.dtype, order = "F")
+            new_buffer[:len(array)] = array
+            buffer = new_buffer
+            self._buffers[name] = buffer
+
+        buffer[len(array):num_rows] = new_rows
+
+        return buffer[:num_rows]
+
+    def _load_from_cache(self, cache, columns, dtype):
+        """
+        Returns (header, data) from the cache or None if the cache doesn't match the file
+        """
+        start_time = time.perf_counter()
+        cached = cache.load(self.file_dir, columns = columns, dtype = dtype)
+
+        if cached is not None:
+            self.read_stats = make_read_stats(len(cached[1]), time.perf_counter() - start_time)
+
+        return cached
+
     # def store_times(self,
     #                 col_names = ["time(1)", "time(2)"]):
     #     """
@@ -146,11 +432,9 @@ class ParFile(File):
         """
         # full_col_names = ["SigmaXX", "SigmaYY", "SigmaXX", "SigmaYY", "SigmaZZ", "SigmaXY", "SigmaYZ", "SigmaZX"]
 
-        if self.flag_3D and col_names is None:
-            col_names = ["SigmaXX", "SigmaYY", "SigmaXX", "SigmaYY", "SigmaZZ", "SigmaXY", "SigmaYZ", "SigmaZX"]
-        elif not self.flag_3D and col_names is None:
-            # 2d model
-            col_names = ["SigmaXX", "SigmaYY", "SigmaZZ", "SigmaXY"] 
+        if col_names is None:
+            # Default columns for a 3D or 2D model
+            col_names = get_stress_cols(self.flag_3D)
         
         # # Get the stress df
         # self.stress_df = pd.DataFrame(columns=full_col_names)
@@ -162,105 +446,344 @@ class ParFile(File):
 
         # # Make a list of zeros
         self.base_stress_cols = col_names
-        self.stress_df = self.data[col_names].copy()
+        self._clear_invariants(["p", "q"])
+        self.stress_df = self._get_columns_df(col_names)
 
     def store_output_strains(self, col_names = None):
         # full_col_names = ["EpsilonXX", "EpsilonYY","EpsilonZZ","GammaXY","GammaYZ", "GammaZX"]
 
-        if self.flag_3D and col_names is None:
-            col_names = ["EpsilonXX", "EpsilonYY","EpsilonZZ","GammaXY","GammaYZ", "GammaZX"]
-
-        elif not self.flag_3D and col_names is None:
-            # 2d model
-            col_names = ["EpsilonXX", "EpsilonYY", "EpsilonZZ", "GammaXY"] 
+        if col_names is None:
+            # Default columns for a 3D or 2D model
+            col_names = get_strain_cols(self.flag_3D)
 
         self.base_strain_cols = col_names
-        self.strain_df = self.data[col_names].copy()
+        self._clear_invariants(["eps_p", "eps_q"])
+        self.strain_df = self._get_columns_df(col_names)
+
+    def is_memmap(self):
+        """
+        Returns True if the data is held by a memmap
+        """
+        return isinstance(self.data, ParMemmap)
+
+    def _set_values(self, values, columns, invalidate = True):
+        """
+        Store the contiguous array that holds the data and rebuild data, stress_df and strain_df as views of it.
+
+        Parameters
+        ----------
+        values : np.ndarray
+            (N, num_cols) array. Column major so that neighbouring columns can be sliced without a copy
+        columns : list of str
+            Name of each column
+        invalidate : bool (Optional)
+            Clear the memoized invariants because the data changed
+        """
+        self.values = values
+        self._col_index = {col: i for i, col in enumerate(columns)}
+
+        if not self.is_memmap():
+            self.data = pd.DataFrame(values, columns = columns, copy = False)
+
+        if invalidate:
+            self._clear_invariants()
+
+        # Rebuild the stored stress and strain views
+        if self.base_stress_cols is not None:
+            self.stress_df = self._get_columns_df(self.base_stress_cols)
+        if self.base_strain_cols is not None:
+            self.strain_df = self._get_columns_df(self.base_strain_cols)
+
+        # Add back the invariants that had been loaded into the DataFrames
+        for key in list(self._df_invariants):
+            self._load_invariant_column(key, self.invar_names[key])
+
+    def _get_columns_df(self, col_names):
+        """
+        Returns a DataFrame of the columns that is a view of the values when the columns are next to each other
+        """
+        return pd.DataFrame(self._get_block(col_names), columns = col_names, copy = False)
+
+    def _get_block(self, cols, values = None):
+        """
+        Returns the (N, num_cols) array of the columns. The array is a view if the columns are next to each other.
+        """
+        if values is None:
+            values = self.values
+
+        if values is None:
+            raise AttributeError("Data must be loaded first")
+
+        missing_cols = [col for col in cols if col not in self._col_index]
+        if missing_cols:
+            raise KeyError(f"Columns {missing_cols} aren't loaded")
+
+        col_ids = [self._col_index[col] for col in cols]
+
+        if col_ids == list(range(col_ids[0], col_ids[0] + len(col_ids))):
+            # Slice so that the values aren't copied
+            return values[:, col_ids[0]:col_ids[-1]+1]
+
+        return values[:, col_ids]
+
+    def _calc_invariant(self, key, values = None):
+        """
+        Calculate an invariant from the stored stress or strain columns of the values
+        """
+        invariant_func, col_set = self.invariant_funcs[key]
+
+        if col_set == "stress":
+            cols = self.base_stress_cols
+            store_func = "store_output_stress"
+        else:
+            cols = self.base_strain_cols
+            store_func = "store_output_strains"
+
+        if cols is None:
+            raise AttributeError(f"{store_func} must be called before calculating {key}")
+
+        return invariant_func(self._get_block(cols, values))
+
+    def _clear_invariants(self, keys = None):
+        """
+        Clear the memoized invariants. Defaults to clearing all of them
+        """
+        if keys is None:
+            keys = list(self.invariant_funcs)
+
+        for key in keys:
+            self._invariants.pop(key, None)
+            self._df_invariants.discard(key)
+
+        self._signed_invariants = {signed_key: value for signed_key, value in self._signed_invariants.items()
+                                   if signed_key[0] not in keys}
+
+    def get_invariant(self, key, sign = 1.0):
+        """
+        Returns an invariant. Each invariant is only calculated once until the data changes.
+
+        Parameters
+        ----------
+        key : str
+            "p", "q", "eps_p", "eps_q", "J3", "lode" (Lode angle), "sigma_principal" or "eps_principal"
+        sign : float (Optional)
+            Sign convention. -1.0 makes compression positive. Signed invariants are memoized as well
+
+        Returns
+        -------
+        np.ndarray
+            Read only array of the invariant. The principal values are (N, 3) from largest to smallest
+        """
+        if key not in self.invariant_funcs:
+            raise KeyError(f"key must be one of {list(self.invariant_funcs)}. Got {key}")
+
+        if key not in self._invariants:
+            invariant = np.asarray(self._calc_invariant(key))
+            invariant.setflags(write = False)
+            self._invariants[key] = invariant
+
+        if sign == 1.0:
+            return self._invariants[key]
+
+        if (key, sign) not in self._signed_invariants:
+            signed_invariant = sign * self._invariants[key]
+            signed_invariant.setflags(write = False)
+            self._signed_invariants[(key, sign)] = signed_invariant
+
+        return self._signed_invariants[(key, sign)]
 
     def get_mean_stress(self):
         """
         Returns the mean stress applied to a df
         """
-        cols = self.base_stress_cols
-        mean_stress = self.stress_df[cols].apply(calc_mean_stress, axis = 1).copy()
-
-        return np.array(mean_stress)
+        return self.get_invariant("p")
     
     def get_q_invariant(self):
         """
         Returns the deviatoric stress invariant
         """
-        cols = self.base_stress_cols
-        if self.flag_3D:
-            q = self.stress_df[cols].apply(calc_q_invariant, axis = 1).copy()
-        else:
-            raise NotImplementedError("Calcing q for 2d isn't impelemented")
-        
-        return np.array(q)
+        return self.get_invariant("q")
 
     def get_volumetric_strain(self):
         """
         Returns the volumetric strain using the strain df
         """
-        cols = self.base_strain_cols
-        if self.flag_3D:
-            eps_p = self.strain_df[cols].apply(calc_volumetric_strain_invariant, axis = 1).copy()
-        else:
-            raise NotImplementedError("Calcing epsV for 2d isn't impelemented")
-        return np.array(eps_p)
+        return self.get_invariant("eps_p")
     
     def get_deviatoric_strain(self):
         """
         Returns the deviatoric strain
         """
-        cols = self.base_strain_cols
-        if self.flag_3D:
-            eps_q = self.strain_df[cols].apply(lambda row: calc_dev_strain_invariant(row), axis = 1).copy()
+        return self.get_invariant("eps_q")
+
+    def get_principal_stresses(self):
+        """
+        Returns the (N, 3) principal stresses from largest to smallest
+        """
+        return self.get_invariant("sigma_principal")
+
+    def get_J3_invariant(self):
+        """
+        Returns the third invariant of the deviatoric stress
+        """
+        return self.get_invariant("J3")
+
+    def get_lode_angle(self):
+        """
+        Returns the Lode angle in radians
+        """
+        return self.get_invariant("lode")
+
+    def get_principal_strains(self):
+        """
+        Returns the (N, 3) principal strains from largest to smallest
+        """
+        return self.get_invariant("eps_principal")
+
+    def get_nbytes(self):
+        """
+        Returns the number of bytes held in memory. Views of the values are only counted once.
+
+        Returns
+        -------
+        dict
+            "values", "stress_df", "strain_df" (columns that aren't views of the values), "invariants", 
+            "total" and "mapped" (bytes of a memmap on disk that are only paged in when used)
+        """
+        def extra_bytes(df):
+            # Count the columns that aren't views of the values
+            if df is None:
+                return 0
+            total = 0
+            for col in df.columns:
+                arr = df[col].to_numpy()
+                if self.values is None or not np.may_share_memory(arr, self.values):
+                    total += arr.nbytes
+            return total
+
+        nbytes = {"values": 0, "mapped": 0}
+        if self.values is not None and self.is_memmap():
+            nbytes["mapped"] = self.values.nbytes
+        elif self.values is not None:
+            # Include the unused rows of the buffer that refresh_data appends to
+            buffer = self._buffers.get("values")
+            nbytes["values"] = buffer.nbytes if buffer is not None and self.values.base is buffer else self.values.nbytes
+
+        nbytes["stress_df"] = extra_bytes(self.stress_df)
+        nbytes["strain_df"] = extra_bytes(self.strain_df)
+        nbytes["invariants"] = (sum(arr.nbytes for arr in self._invariants.values()) + 
+                                sum(arr.nbytes for arr in self._signed_invariants.values()))
+        nbytes["total"] = nbytes["values"] + nbytes["stress_df"] + nbytes["strain_df"] + nbytes["invariants"]
+
+        return nbytes
+
+    def _load_invariant_column(self, key, name):
+        """
+        Add a memoized invariant to the stress or strain DataFrame. Principal values use a list of three names
+        """
+        if self.invariant_funcs[key][1] == "stress":
+            df = self.stress_df
         else:
-            raise NotImplementedError("Calculating epsq isn't implemented for 2D")
-        return np.array(eps_q)
-    
+            df = self.strain_df
+
+        invariant = self.get_invariant(key)
+
+        if invariant.ndim == 2:
+            for i, col_name in enumerate(name):
+                df.loc[:, col_name] = invariant[:, i]
+        else:
+            df.loc[:, name] = invariant
+
+        self.invar_names[key] = name
+        self._df_invariants.add(key)
+
     def load_mean_stress(self, name = "p", recalc = False):
         """
         Load the mean stress
         """
+        if recalc:
+            self._clear_invariants(["p"])
+
         if name not in self.stress_df.columns or recalc:
-            self.stress_df.loc[:, name] = self.get_mean_stress()
-            # Update the name of the invariant 
-            self.invar_names["p"] = name
+            self._load_invariant_column("p", name)
 
     def load_q_invariant(self, name = "q", recalc = False):
         """
         Load the equivalent stress (q)
         """
+        if recalc:
+            self._clear_invariants(["q"])
+
         if name not in self.stress_df.columns or recalc:
-            self.stress_df.loc[:, name] = self.get_q_invariant()
-            # Update the name of the invariant
-            self.invar_names["q"] = name
+            self._load_invariant_column("q", name)
 
     def load_volumetric_strain(self, name = "eps_p", recalc = False):
         """
         Load the volumetric strain
         """
+        if recalc:
+            self._clear_invariants(["eps_p"])
+
         if name not in self.strain_df.columns or recalc:
-            self.strain_df.loc[:, name] = self.get_volumetric_strain()
-            # Update the name of the invariant
-            self.invar_names["eps_p"] = name
+            self._load_invariant_column("eps_p", name)
 
     def load_deviatoric_strain(self, name = "eps_q", recalc = False):
         """
         Load eps_q into the data frame
         """
 
+        if recalc:
+            self._clear_invariants(["eps_q"])
+
         if name not in self.strain_df.columns or recalc:
-            self.strain_df.loc[:, name] = self.get_deviatoric_strain()
-            # Update the name of the invariant
-            self.invar_names["eps_q"] = name
+            self._load_invariant_column("eps_q", name)
+
+    def load_principal_stresses(self, names = ["sigma_1", "sigma_2", "sigma_3"], recalc = False):
+        """
+        Load the principal stresses
+        """
+        if recalc:
+            self._clear_invariants(["sigma_principal"])
+
+        if not all(name in self.stress_df.columns for name in names) or recalc:
+            self._load_invariant_column("sigma_principal", list(names))
+
+    def load_J3_invariant(self, name = "J3", recalc = False):
+        """
+        Load the third invariant of the deviatoric stress
+        """
+        if recalc:
+            self._clear_invariants(["J3"])
+
+        if name not in self.stress_df.columns or recalc:
+            self._load_invariant_column("J3", name)
+
+    def load_lode_angle(self, name = "lode", recalc = False):
+        """
+        Load the Lode angle
+        """
+        if recalc:
+            self._clear_invariants(["lode"])
+
+        if name not in self.stress_df.columns or recalc:
+            self._load_invariant_column("lode", name)
+
+    def load_principal_strains(self, names = ["eps_1", "eps_2", "eps_3"], recalc = False):
+        """
+        Load the principal strains
+        """
+        if recalc:
+            self._clear_invariants(["eps_principal"])
+
+        if not all(name in self.strain_df.columns for name in names) or recalc:
+            self._load_invariant_column("eps_principal", list(names))
 
     def quick_plot_stress(self, figsize = (8, 4), compression_pos = True, axs = None, 
-                          recalc = True, **kwargs):
+                          recalc = False, **kwargs):
         """
         Make the q vs. p plot
+
+        The invariants are memoized, recalc = True forces them to be calculated again
         """
 
         # Assumes that the stress variables are already loaded
@@ -277,8 +800,8 @@ class ParFile(File):
         self.load_mean_stress(recalc=recalc)
         self.load_q_invariant(recalc=recalc)
         # Calc the q invariant
-        mean_stress = sign * self.stress_df[self.invar_names["p"]]
-        q           = self.stress_df[self.invar_names["q"]]
+        mean_stress = self.get_invariant("p", sign)
+        q           = self.get_invariant("q")
 
         axs.plot(mean_stress, q, **kwargs)
 
@@ -287,9 +810,11 @@ class ParFile(File):
         axs.set_xlabel("Mean Stress")
         axs.set_ylabel("Deviatoric Stress")
 
-    def quick_plot_strain(self, figsize = (8, 4), compression_pos = True, recalc = True, axs = None, **kwargs):
+    def quick_plot_strain(self, figsize = (8, 4), compression_pos = True, recalc = False, axs = None, **kwargs):
         """
         Make the $eps_q$ vs. $eps_v$ plot
+
+        The invariants are memoized, recalc = True forces them to be calculated again
         """
 
         # Check if compression should be positive
@@ -304,8 +829,8 @@ class ParFile(File):
         self.load_volumetric_strain(recalc=recalc)
         self.load_deviatoric_strain(recalc=recalc)
 
-        eps_p = sign * self.strain_df[self.invar_names["eps_p"]]
-        eps_q = self.strain_df[self.invar_names["eps_q"]]
+        eps_p = self.get_invariant("eps_p", sign)
+        eps_q = self.get_invariant("eps_q")
 
         axs.plot(eps_p, eps_q, **kwargs)
 
@@ -314,11 +839,13 @@ class ParFile(File):
         axs.set_ylabel(r"Deviatoric strain invar, $\epsilon_{q}$")
 
     def quick_quad_plot(self, axs = None, figsize = (10,10), axial_strain_id = "EpsilonYY",
-                        stress_units = "kPa", strain_units = "-", recalc = True,
+                        stress_units = "kPa", strain_units = "-", recalc = False,
                         compression_pos = True, legend = [False], labels:list = [],
                           **kwargs):
         """
         Make the quad plot that is really helpful for visualizing soil
+
+        The invariants are memoized, recalc = True forces them to be calculated again
         """
 
         # Make the figure and axs if no axs is passed in
@@ -353,9 +880,9 @@ class ParFile(File):
 
         # Get the data
         axial_strain = sign * self.strain_df[axial_strain_id]
-        mean_stress  = sign * self.stress_df[self.invar_names["p"]]
-        q            = self.stress_df[self.invar_names["q"]]
-        vol_strain   = sign * self.strain_df[self.invar_names["eps_p"]]
+        mean_stress  = self.get_invariant("p", sign)
+        q            = self.get_invariant("q")
+        vol_strain   = self.get_invariant("eps_p", sign)
 
 
         # Make the q vs. axial strain \epsilon_{a}
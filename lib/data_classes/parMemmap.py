@@ -0,0 +1,251 @@
+"""
+Class to hold a .PAR_ file as a fixed width binary file on disk that is accessed through np.memmap
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from lib.general_functions.par_reader import read_par_header
+
+class ParMemmap:
+    """
+    Memory mapped, column major binary copy of a .PAR_ file.
+
+    The text file is converted once into ``<name>.PAR_xxx.mmap.bin`` where every column is stored
+    contiguously, and ``<name>.PAR_xxx.mmap.json`` which stores the header, dtype, number of rows and
+    the size and modification time of the .PAR_ file. The columns are exposed as np.memmap views, so
+    only the pages of the columns and rows that are used are read from disk.
+
+    Attributes
+    ----------
+    par_file_dir : str
+        Path to the .PAR_ file
+    dtype : np.dtype
+        dtype of the binary file
+    columns : list of str
+        The column names. Set by :meth:`open`
+    rows : slice
+        Row range that the object exposes. Defaults to every row
+    """
+
+    bin_suffix = ".mmap.bin"
+    meta_suffix = ".mmap.json"
+
+    def __init__(self, par_file_dir, dtype = np.float64, rows = None):
+        self.par_file_dir = par_file_dir
+        self.bin_path = par_file_dir + self.bin_suffix
+        self.meta_path = par_file_dir + self.meta_suffix
+        self.dtype = np.dtype(dtype)
+
+        if rows is None:
+            rows = slice(None)
+        self.rows = rows
+
+        self.columns = None
+        self._col_index = None
+        self._memmap = None
+
+    def __getstate__(self):
+        # Pickle the path instead of the mapped data, the file is mapped again when unpickled
+        state = self.__dict__.copy()
+        state["_memmap"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.columns is not None:
+            self.open()
+
+    def __str__(self):
+        return (f"Memmap file: {self.bin_path}\n"
+                f"Shape: {self.shape}\n"
+                f"dtype: {self.dtype}\n")
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, cols):
+        """
+        A single column name returns a 1D view. A list of column names returns an (N, num_cols) block.
+        """
+        if isinstance(cols, str):
+            return self._get_memmap()[self._col_index[cols], self.rows]
+
+        return self.block(cols)
+
+    @property
+    def shape(self):
+        """
+        (number of rows, number of columns) of the rows that are exposed
+        """
+        num_rows = len(range(*self.rows.indices(self._get_memmap().shape[1])))
+        return (num_rows, len(self.columns))
+
+    @property
+    def nbytes(self):
+        """
+        Size of the binary file on disk. Only the pages that are touched are held in memory
+        """
+        return self._get_memmap().nbytes
+
+    @classmethod
+    def is_memmap_file(cls, file_name):
+        """
+        Returns True if the file name belongs to the binary or meta file of a memmap
+        """
+        return cls.bin_suffix in file_name or cls.meta_suffix in file_name
+
+    def is_current(self):
+        """
+        Returns True if the binary file exists and was made from the current version of the .PAR_ file
+        """
+        if not (os.path.exists(self.bin_path) and os.path.exists(self.meta_path)):
+            return False
+
+        with open(self.meta_path, "r") as f:
+            meta = json.load(f)
+
+        return meta["key"] == self._make_key() and meta["dtype"] == self.dtype.name
+
+    def open(self, chunk_rows = 100000):
+        """
+        Convert the .PAR_ file if the binary file is missing or out of date and map it.
+
+        Parameters
+        ----------
+        chunk_rows : int (Optional)
+            Number of rows that are parsed at a time during the conversion.
+
+        Returns
+        -------
+        ParMemmap
+            The object, so that ParMemmap(path).open() can be chained.
+        """
+        if not self.is_current():
+            self.convert(chunk_rows = chunk_rows)
+
+        with open(self.meta_path, "r") as f:
+            meta = json.load(f)
+
+        self.columns = meta["header"]
+        self._col_index = {col: i for i, col in enumerate(self.columns)}
+        if meta["num_rows"] == 0:
+            self._memmap = np.empty((len(self.columns), 0), dtype = self.dtype)
+        else:
+            # Rows are allocated from a line count, so blank lines can leave unused rows at the end of each column
+            memmap = np.memmap(self.bin_path, dtype = self.dtype, mode = "r",
+                               shape = (len(self.columns), meta["allocated_rows"]))
+            self._memmap = memmap[:, :meta["num_rows"]]
+
+        return self
+
+    def convert(self, chunk_rows = 100000):
+        """
+        Convert the text .PAR_ file into the column major binary file.
+
+        The text is parsed in chunks so the whole file never has to be held in memory.
+        """
+        header = read_par_header(self.par_file_dir)
+        allocated_rows = self._count_lines()
+
+        tmp_path = f"{self.bin_path}.{os.getpid()}.tmp"
+        start_row = 0
+        # A zero length memmap can't be made so write an empty file for an empty .PAR_ file
+        if allocated_rows == 0:
+            open(tmp_path, "wb").close()
+        else:
+            out = np.memmap(tmp_path, dtype = self.dtype, mode = "w+", shape = (len(header), allocated_rows))
+
+            for chunk in pd.read_csv(self.par_file_dir, sep=r'\s+', skiprows=1, names=header,
+                                     dtype=self.dtype, engine="c", chunksize=chunk_rows):
+                end_row = start_row + len(chunk)
+                out[:, start_row:end_row] = chunk.to_numpy().T
+                start_row = end_row
+
+            out.flush()
+            del out
+
+        os.replace(tmp_path, self.bin_path)
+
+        meta = {"key": self._make_key(), "header": header, "dtype": self.dtype.name,
+                "num_rows": start_row, "allocated_rows": allocated_rows}
+        tmp_meta_path = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp_meta_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_meta_path, self.meta_path)
+
+    def block(self, cols, rows = None):
+        """
+        Returns the (N, num_cols) block for a list of column names.
+
+        If the columns are next to each other in the file the block is a view of the memmap,
+        otherwise only the requested columns are copied.
+
+        Parameters
+        ----------
+        cols : list of str
+            Column names
+        rows : slice (Optional)
+            Row range inside of the exposed rows. Defaults to every exposed row
+        """
+        memmap = self._get_memmap()[:, self.rows]
+        if rows is not None:
+            memmap = memmap[:, rows]
+
+        col_ids = [self._col_index[col] for col in cols]
+
+        if col_ids == list(range(col_ids[0], col_ids[0] + len(col_ids))):
+            # Contiguous columns, slice so the memmap isn't copied
+            return memmap[col_ids[0]:col_ids[-1]+1].T
+
+        return memmap[col_ids].T
+
+    def to_frame(self, cols = None):
+        """
+        Returns a DataFrame of the columns. The columns are views of the memmap where possible
+        """
+        if cols is None:
+            cols = self.columns
+
+        return pd.DataFrame(self.block(cols), columns = cols, copy = False)
+
+    def delete(self):
+        """
+        Delete the binary and meta files
+        """
+        self._memmap = None
+        for path in [self.bin_path, self.meta_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _get_memmap(self):
+        if self._memmap is None:
+            raise AttributeError("The memmap must be opened first")
+        return self._memmap
+
+    def _count_lines(self, block_size = 1024**2):
+        """
+        Count the lines after the header without parsing them. This is an upper bound on the number of rows
+        """
+        num_lines = 0
+        last_block = b""
+        with open(self.par_file_dir, "rb") as f:
+            # Skip the header
+            f.readline()
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                num_lines += block.count(b"\n")
+                last_block = block
+
+        # Count the last line if it doesn't end with a new line character
+        if last_block and not last_block.endswith(b"\n"):
+            num_lines += 1
+
+        return num_lines
+
+    def _make_key(self):
+        stat = os.stat(self.par_file_dir)
+        return [os.path.abspath(self.par_file_dir), stat.st_size, stat.st_mtime_ns]
@@ -0,0 +1,296 @@
+"""
+Class to make the models of a parametric sweep over CPS flags and ESM material properties
+"""
+import itertools
+import json
+import os
+import shutil
+import numpy as np
+
+from lib.data_classes.gomClass import GomFile
+from lib.data_classes.modelClass import AnuraModel
+from lib.general_functions.general_functions import link_or_copy_file
+
+class ParameterSweep:
+    """
+    Makes a variant of a base model for every point of a parameter grid.
+
+    A parameter is either a CPS flag (a name that starts with "$$", e.g. "$$TIME_PER_LOADSTEP") or
+    the name of a property of the ESM material ``esm_name``. The CPS_001 and GOM files are compiled
+    into FlagTemplates once, so making a variant only renders the files whose values change. The
+    other input files of the base model are linked (see AnuraModel.link_extensions) or copied.
+
+    The variants are listed in a manifest (``sweep_manifest.json`` in the sweep folder) that maps the
+    name of each variant to its folder and parameters::
+
+        {"model_name": ..., "exe_path": ..., "benchmark": ..., "benchmark_name": ...,
+         "variants": {"variant_0000": {"dir": ..., "params": {"$$TIME_PER_LOADSTEP": 0.1, "E": 1e4}}}}
+
+    Attributes
+    ----------
+    base_model : AnuraModel
+        The model that the variants are made from
+    sweep_dir : str
+        Folder that holds a folder for each variant
+    esm_name : str or None
+        Name of the ESM material whose properties are swept
+    esm_props : dict or None
+        The properties of the ESM material in order. The swept properties replace their values
+    """
+
+    manifest_name = "sweep_manifest.json"
+
+    def __init__(self, base_model, sweep_dir, esm_name = None, esm_props = None, variant_prefix = "variant"):
+        """
+        Parameters
+        ----------
+        base_model : AnuraModel
+            The model that the variants are made from
+        sweep_dir : str
+            Folder that holds a folder for each variant
+        esm_name : str (Optional)
+            Name of the ESM material in the GOM file. Needed to sweep ESM properties
+        esm_props : dict (Optional)
+            All of the properties of the ESM material in order, see GomFile.update_ESM_material_props.
+            Needed to sweep ESM properties
+        variant_prefix : str (Optional)
+            The variant folders are named <variant_prefix>_0000, <variant_prefix>_0001, ...
+        """
+        if (esm_name is None) != (esm_props is None):
+            raise ValueError("esm_name and esm_props have to be given together")
+
+        self.base_model = base_model
+        self.sweep_dir = sweep_dir
+        self.esm_name = esm_name
+        self.esm_props = esm_props
+        self.variant_prefix = variant_prefix
+        self.manifest_path = os.path.join(sweep_dir, self.manifest_name)
+
+    def __str__(self):
+        return (f"Base model: {self.base_model.model_name}\n"
+                f"Sweep folder: {self.sweep_dir}\n"
+                f"ESM material: {self.esm_name}\n")
+
+    @staticmethod
+    def make_cartesian_grid(parameters):
+        """
+        Returns every combination of the parameter values
+
+        Parameters
+        ----------
+        parameters : dict
+            parameter -> list of values
+
+        Returns
+        -------
+        list of dict
+            parameter -> value for each variant, the last parameter changes fastest
+        """
+        names = list(parameters)
+
+        return [dict(zip(names, values)) for values in itertools.product(*parameters.values())]
+
+    @staticmethod
+    def make_latin_hypercube(ranges, num_samples, seed = None):
+        """
+        Returns a Latin hypercube sample of the parameters. The range of every parameter is split into
+        num_samples intervals of equal width and each interval is sampled once.
+
+        Parameters
+        ----------
+        ranges : dict
+            parameter -> (low, high). If low and high are both ints the samples are rounded to ints
+        num_samples : int
+            Number of variants
+        seed : int (Optional)
+            Seed of the random number generator so the sample can be repeated
+
+        Returns
+        -------
+        list of dict
+            parameter -> value for each variant
+        """
+        rng = np.random.default_rng(seed)
+
+        columns = {}
+        for name, (low, high) in ranges.items():
+            # One random point inside of each interval, with the intervals shuffled per parameter
+            unit_samples = (rng.permutation(num_samples) + rng.random(num_samples)) / num_samples
+            samples = low + unit_samples * (high - low)
+
+            if isinstance(low, (int, np.integer)) and isinstance(high, (int, np.integer)):
+                samples = np.rint(samples).astype(int)
+
+            columns[name] = samples.tolist()
+
+        return [{name: columns[name][i] for name in ranges} for i in range(num_samples)]
+
+    def create(self, variants, overwrite = False):
+        """
+        Make the folder and input files of every variant and write the manifest
+
+        Parameters
+        ----------
+        variants : list of dict
+            parameter -> value for each variant, e.g. from make_cartesian_grid or make_latin_hypercube
+        overwrite : bool (Optional)
+            Delete variant folders that already exist. Otherwise an existing folder with files in it
+            raises an error, since old output would be mistaken for the output of the variant
+
+        Returns
+        -------
+        dict
+            The manifest
+        """
+        base_model = self.base_model
+        model_name = base_model.model_name
+        base_folder_dir = base_model.folder.folder_dir
+
+        cps_flags, esm_params = self._split_parameters(variants)
+
+        # Compile the files that change once for every variant
+        cps_name = model_name + ".CPS_001"
+        gom_name = model_name + ".GOM"
+        cps_template = None
+        gom_template = None
+
+        if cps_flags:
+            cps_template = base_model.setup.get_CPS_file(which_file = "first")[0].get_template(cps_flags)
+
+        if esm_params:
+            gom_template = GomFile(os.path.join(base_folder_dir, gom_name)).get_ESM_template(self.esm_name)
+
+        # Input files that are the same for every variant
+        shared_files = []
+        for file_name in sorted(os.listdir(base_folder_dir)):
+            if not os.path.isfile(os.path.join(base_folder_dir, file_name)):
+                continue
+
+            # The batch file runs the base model, every variant generates its own
+            if not file_name.endswith(tuple(base_model.input_extensions)) or file_name.endswith(".bat"):
+                continue
+
+            if (cps_template is not None and file_name == cps_name) or \
+               (gom_template is not None and file_name == gom_name):
+                continue
+
+            shared_files.append(file_name)
+
+        os.makedirs(self.sweep_dir, exist_ok = True)
+
+        manifest = {
+            "base_folder": os.path.abspath(base_folder_dir),
+            "model_name": model_name,
+            "exe_path": base_model.setup.exe_path,
+            "benchmark": base_model.benchmark,
+            "benchmark_name": base_model.benchmark_name,
+            "esm_name": self.esm_name,
+            "variants": {},
+        }
+
+        for variant_id, params in enumerate(variants):
+            params = {name: self._to_builtin(value) for name, value in params.items()}
+
+            variant_name = f"{self.variant_prefix}_{variant_id:04d}"
+            variant_dir = os.path.abspath(os.path.join(self.sweep_dir, variant_name))
+            self._make_variant_folder(variant_dir, overwrite)
+
+            for file_name in shared_files:
+                src = os.path.join(base_folder_dir, file_name)
+                dst = os.path.join(variant_dir, file_name)
+
+                if file_name.endswith(base_model.link_extensions):
+                    link_or_copy_file(src, dst)
+                else:
+                    shutil.copy2(src, dst)
+
+            if cps_template is not None:
+                cps_values = {flag: params[flag] for flag in cps_flags if flag in params}
+                cps_template.write(os.path.join(variant_dir, cps_name), cps_values)
+
+            if gom_template is not None:
+                props_dict = dict(self.esm_props)
+                props_dict.update({name: params[name] for name in esm_params if name in params})
+
+                gom_template.write(os.path.join(variant_dir, gom_name),
+                                   {self.esm_name: GomFile.make_ESM_material_value(props_dict)})
+
+            manifest["variants"][variant_name] = {"dir": variant_dir, "params": params}
+
+        self._write_manifest(manifest)
+
+        print(f"Created {len(variants)} variants of {model_name} in {self.sweep_dir}")
+
+        return manifest
+
+    def load_manifest(self):
+        """
+        Returns the manifest written by create
+        """
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+
+    def get_models(self, manifest = None):
+        """
+        Returns an AnuraModel for each variant, in the order of the manifest. They can be run with a RunScheduler
+
+        Parameters
+        ----------
+        manifest : dict (Optional)
+            Defaults to the manifest in the sweep folder
+        """
+        if manifest is None:
+            manifest = self.load_manifest()
+
+        return [AnuraModel(exe_path = manifest["exe_path"], model_folder_path = variant["dir"],
+                           model_name = manifest["model_name"], benchmark = manifest["benchmark"],
+                           benchmark_name = manifest["benchmark_name"])
+                for variant in manifest["variants"].values()]
+
+    def _split_parameters(self, variants):
+        """
+        Returns the CPS flags and the ESM properties that are swept, each in the order they are first given
+        """
+        names = list(dict.fromkeys(name for params in variants for name in params))
+
+        cps_flags = [name for name in names if name.startswith("$$")]
+        esm_params = [name for name in names if not name.startswith("$$")]
+
+        if esm_params:
+            if self.esm_props is None:
+                raise ValueError(f"{esm_params} aren't CPS flags. esm_name and esm_props are needed to sweep ESM properties")
+
+            unknown_params = [name for name in esm_params if name not in self.esm_props]
+            if unknown_params:
+                raise KeyError(f"{unknown_params} aren't properties of the ESM material {self.esm_name}. "
+                               f"Properties: {list(self.esm_props)}")
+
+        return cps_flags, esm_params
+
+    @staticmethod
+    def _make_variant_folder(variant_dir, overwrite):
+        if os.path.isdir(variant_dir) and os.listdir(variant_dir):
+            if not overwrite:
+                raise FileExistsError(f"{variant_dir} already has files in it, use overwrite = True to replace them")
+
+            shutil.rmtree(variant_dir)
+
+        os.makedirs(variant_dir, exist_ok = True)
+
+    @staticmethod
+    def _to_builtin(value):
+        # NumPy values aren't JSON serializable
+        if isinstance(value, np.generic):
+            return value.item()
+
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return [ParameterSweep._to_builtin(item) for item in value]
+
+        return value
+
+    def _write_manifest(self, manifest):
+        # Write to a temp file first so a crash can't leave a half written manifest
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent = 4)
+        os.replace(tmp_path, self.manifest_path)
@@ -1,11 +1,16 @@
 # Standard imports
+import concurrent.futures
 import os
+import time
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
 # Lib imports
 from lib.data_classes.parFile import ParFile
 from lib.data_classes.outFile import OutFile
+from lib.data_classes.parCache import ParCache
+from lib.data_classes.parEnsemble import ParEnsemble
 
 from lib.general_functions.invariant_functions import (
      calc_mean_stress, calc_q_invariant, calc_dev_strain_invariant, calc_volumetric_strain_invariant
@@ -35,7 +40,8 @@ class ModelResults:
 
         return return_string
 
-    def load_par_files(self, load_all_data: bool, flag_3D):
+    def load_par_files(self, load_all_data: bool, flag_3D, reader = "default", columns = None, dtype = np.float64,
+                       use_cache = False, num_workers = None, pool_type = "thread"):
         """
         Load the .PAR_ files in the results folder and create par file objects.
 
@@ -43,12 +49,20 @@ class ModelResults:
         This method iterates through the results folder to find all files with the
         `.PAR_` extension. For each file found, it creates a par file object, and if
         `load_all_data` is True, it loads the data using the appropriate method.
+        The par files are stored in material point order.
 
         Parameters:
         load_all_data (bool): If True, calls the par file method to load the data.
+        reader, columns, dtype: Passed to ParFile.load_data. Use reader = "fast" with columns = "stress"
+                                and dtype = np.float32 to only load the stresses as float32.
+        use_cache (bool or ParCache): Load the files from their binary sidecars when they are up to date
+                                      and write the sidecars when they aren't.
+        num_workers (int): Number of files that are loaded at the same time. None loads them one after another
+        pool_type (str): "thread" or "process". Only used if num_workers is set
 
         Returns:
-        None
+        dict: File name -> seconds it took to load the file. Files that failed to load are stored in 
+              self.load_errors (file name -> exception) instead of stopping the other files from loading
         """
 
         # Get the path to the results folder (assumes self.results_folder is defined)
@@ -56,27 +70,106 @@ class ModelResults:
 
         # List to store par file objects
         self.par_files = []
+        self.load_errors = {}
+        load_times = {}
 
-        # Traverse through the results folder to find .PAR_ files
-        for filename in os.listdir(results_folder):
-            if '.PAR_' in filename:
-                # Create a par file object (assuming a ParFile class exists)
-                par_file_path = os.path.join(results_folder, filename)
-                par_file_obj = ParFile(par_file_path, flag_3D)  # Adjust based on actual class
+        # Share one cache object so that all of the files count the same sidecars
+        if use_cache is True:
+            use_cache = ParCache(results_folder)
 
-                # Add to par file list
-                self.par_files.append(par_file_obj)
+        if use_cache and load_all_data:
+            # Scan the sidecars once, the copies sent to worker processes start from this size
+            use_cache.evict()
+
+        # Get the .PAR_ files sorted by material point from the folder index
+        par_file_names = self.folder.get_par_file_names()
+        par_file_paths = [os.path.join(results_folder, filename) for filename in par_file_names]
+
+        load_kwargs = {"reader": reader, "columns": columns, "dtype": dtype, "cache": use_cache}
+
+        if not load_all_data:
+            self.par_files = [ParFile(path, flag_3D) for path in par_file_paths]
+
+        elif num_workers is None:
+            for path in par_file_paths:
+                par_file_obj, seconds, error = _load_par_file(path, flag_3D, load_kwargs)
+                self._store_loaded_par_file(par_file_obj, seconds, error, load_times)
+
+        else:
+            if pool_type == "thread":
+                executor_class = concurrent.futures.ThreadPoolExecutor
+            elif pool_type == "process":
+                executor_class = concurrent.futures.ProcessPoolExecutor
+            else:
+                raise ValueError(f"pool_type must be 'thread' or 'process'. Got {pool_type}")
+
+            with executor_class(max_workers = num_workers) as executor:
+                futures = [executor.submit(_load_par_file, path, flag_3D, load_kwargs) for path in par_file_paths]
 
-                # Load data if load_all_data is True
-                if load_all_data:
-                    par_file_obj.load_data()  # Adjust based on actual load method
+                # Collect the results in material point order
+                for path, future in zip(par_file_paths, futures):
+                    try:
+                        par_file_obj, seconds, error = future.result()
+                    except Exception as e:
+                        # e.g. the worker process died
+                        par_file_obj, seconds, error = ParFile(path, flag_3D), 0.0, e
+
+                    self._store_loaded_par_file(par_file_obj, seconds, error, load_times)
+
+            if use_cache and pool_type == "process":
+                # Each worker process only counted the sidecars it wrote itself
+                use_cache.evict()
 
         # Log completion
-        print(f"Loaded {len(self.par_files) - self.num_par_files} par files from {results_folder}")
+        print(f"Loaded {len(self.par_files)} par files from {results_folder}")
+
+        if self.load_errors:
+            print(f"Failed to load {len(self.load_errors)} par files:")
+            for filename, error in self.load_errors.items():
+                print(f"{filename}: {error!r}")
         
         # Update the number of par files
         self.num_par_files = len(self.par_files)
+
+        return load_times
+
+    def _store_loaded_par_file(self, par_file_obj, seconds, error, load_times):
+        """
+        Store a par file that was loaded, or the error if it failed
+        """
+        if error is None:
+            self.par_files.append(par_file_obj)
+            load_times[par_file_obj.file_name] = seconds
+        else:
+            self.load_errors[par_file_obj.file_name] = error
     
+    def get_ensemble(self, components = None, dtype = None):
+        """
+        Returns a ParEnsemble that holds the loaded par files as one (material point, step, component) array
+
+        Parameters
+        ----------
+        components : list of str (Optional)
+            Columns to include. Defaults to the columns that every par file has
+        dtype : numpy dtype (Optional)
+            dtype of the array. Defaults to the dtype of the first par file
+        """
+        return ParEnsemble.from_results(self, components = components, dtype = dtype)
+
+    def get_nbytes(self):
+        """
+        Returns the number of bytes held in memory by each par file and the total
+
+        Returns
+        -------
+        dict
+            File name -> bytes held by that par file, plus "total"
+        """
+        nbytes = {par_file.file_name: par_file.get_nbytes()["total"] for par_file in self.par_files}
+        nbytes["total"] = sum(nbytes.values())
+
+        return nbytes
+
     def load_out_file(self):
         """
         Load the out file. This is the file that stores the terminal output of the Anura3D model
@@ -85,7 +178,7 @@ class ModelResults:
         # Get the path to the results folder (assumes self.results_folder is defined)
         results_folder = self.folder.folder_dir
 
-        for filename in os.listdir(results_folder):
+        for filename in self.folder.get_file_names():
             if '.OUT' in filename:
                 # Create a par file object (assuming a ParFile class exists)
                 out_file_path = os.path.join(results_folder, filename)
@@ -95,4 +188,24 @@ class ModelResults:
                 out_file_obj.load_data()
 
                 # Add to par file list
-                self.out_file = out_file_obj
\ No newline at end of file
+                self.out_file = out_file_obj
+
+def _load_par_file(par_file_path, flag_3D, load_kwargs):
+    """
+    Make a par file object and load its data. Defined at the module level so that it can be sent to a process pool.
+
+    Returns
+    -------
+    tuple
+        (par file object, seconds it took to load, exception or None)
+    """
+    start_time = time.perf_counter()
+    par_file_obj = ParFile(par_file_path, flag_3D)
+
+    try:
+        par_file_obj.load_data(**load_kwargs)
+        error = None
+    except Exception as e:
+        error = e
+
+    return par_file_obj, time.perf_counter() - start_time, error
@@ -0,0 +1,268 @@
+"""
+Class to store the output of completed runs so that a run with identical inputs doesn't have to be run again
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+from lib.data_classes.parCache import ParCache
+from lib.data_classes.parMemmap import ParMemmap
+from lib.general_functions.hash_functions import hash_model_inputs, strip_model_name, add_model_name
+
+class RunCache:
+    """
+    Content addressed cache of completed benchmark runs.
+
+    A run is keyed by the hash of the executable, the CPS_, GOM and dll files of the model and the stage
+    information of the benchmark (see hash_functions.hash_model_inputs). The output of a completed run
+    (.PAR_, .OUT and the CPS_ files that were written or modified) is copied into
+    ``<cache_dir>/<key>/``. A later run with the same key restores those files instead of running the
+    solver. An index file stores the files, size and last use of each entry. When the total size is
+    larger than ``max_bytes`` the least recently used entries are deleted.
+
+    Attributes
+    ----------
+    cache_dir : str
+        Folder that holds the cached runs
+    max_bytes : int
+        Size cap of all of the cached runs
+    """
+
+    index_name = ".run_cache_index.json"
+
+    # Parts of the file names that are stored as the output of a run
+    output_markers = (".PAR_", ".OUT", ".CPS_")
+
+    def __init__(self, cache_dir, max_bytes = 20 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, self.index_name)
+
+        os.makedirs(cache_dir, exist_ok = True)
+
+        # Guards the index when several jobs of a scheduler use the cache
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        index = self._read_index()
+        return (f"Run cache folder: {self.cache_dir}\n"
+                f"Number of cached runs: {len(index)}\n"
+                f"Cache size: {self.get_size()} bytes\n")
+
+    def make_key(self, model):
+        """
+        Returns the key of the current inputs of a model
+        """
+        return hash_model_inputs(model)
+
+    def get_size(self):
+        """
+        Returns the total size in bytes of the cached runs
+        """
+        return sum(entry["nbytes"] for entry in self._read_index().values())
+
+    def contains(self, key):
+        """
+        Returns True if a completed run is stored under the key
+        """
+        return key in self._read_index() and os.path.isdir(self._get_entry_dir(key))
+
+    def is_output_file(self, file_name):
+        """
+        Returns True if the file is stored as the output of a run
+        """
+        if ParCache.is_cache_file(file_name) or ParMemmap.is_memmap_file(file_name) or file_name.endswith(".tmp"):
+            return False
+
+        return any(marker in file_name for marker in self.output_markers)
+
+    def restore(self, model, key = None, link = False):
+        """
+        Copy the output of a cached run into the folder of the model
+
+        Parameters
+        ----------
+        model : AnuraModel
+            The model to restore the output of
+        key : str (Optional)
+            Key of the run. Defaults to the key of the current inputs of the model
+        link : bool (Optional)
+            Hard link the files instead of copying them. Linked files share their data with the cache,
+            so they must not be modified in place. Files that can't be linked (e.g. on another file
+            system) are copied
+
+        Returns
+        -------
+        bool
+            True if a cached run was restored
+        """
+        if key is None:
+            key = self.make_key(model)
+
+        with self._lock:
+            index = self._read_index()
+            entry = index.get(key)
+            entry_dir = self._get_entry_dir(key)
+
+            if entry is None or not os.path.isdir(entry_dir):
+                return False
+
+            entry["last_used"] = time.time()
+            self._write_index(index)
+
+        for stored_name in entry["files"]:
+            src = os.path.join(entry_dir, stored_name.lstrip("/"))
+            dst = os.path.join(model.folder.folder_dir, add_model_name(stored_name, model.model_name))
+
+            if os.path.exists(dst):
+                os.remove(dst)
+
+            if link:
+                try:
+                    os.link(src, dst)
+                    continue
+                except OSError:
+                    pass
+
+            shutil.copy2(src, dst)
+
+        print(f"Restored {len(entry['files'])} output files of {model.model_name} from the run cache")
+
+        return True
+
+    def store(self, model, key):
+        """
+        Store the output of a completed run of the model and evict old runs if the cache is too large.
+
+        Parameters
+        ----------
+        model : AnuraModel
+            The model whose run completed
+        key : str
+            Key of the inputs from before the run (see make_key)
+        """
+        folder_dir = model.folder.folder_dir
+        file_names = [file_name for file_name in model.folder.get_file_index(refresh = True)["files"]
+                      if self.is_output_file(file_name)]
+
+        # Copy into a temp folder that replaces the entry, so an entry is never half written
+        entry_dir = self._get_entry_dir(key)
+        tmp_dir = f"{entry_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(tmp_dir)
+
+        stored_names = []
+        nbytes = 0
+        for file_name in file_names:
+            stored_name = strip_model_name(file_name, model.model_name)
+            dst = os.path.join(tmp_dir, stored_name.lstrip("/"))
+            shutil.copy2(os.path.join(folder_dir, file_name), dst)
+
+            stored_names.append(stored_name)
+            nbytes += os.path.getsize(dst)
+
+        with self._lock:
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.replace(tmp_dir, entry_dir)
+
+            index = self._read_index()
+            index[key] = {
+                "files": stored_names,
+                "nbytes": nbytes,
+                "model_name": model.model_name,
+                "exe_path": model.setup.exe_path,
+                "created": time.time(),
+                "last_used": time.time(),
+            }
+            self._evict(index)
+            self._write_index(index)
+
+    def invalidate(self, model = None, key = None):
+        """
+        Delete a cached run, either of the current inputs of a model or by its key
+
+        Returns
+        -------
+        bool
+            True if a cached run was deleted
+        """
+        if key is None:
+            if model is None:
+                raise ValueError("Either a model or a key has to be given")
+            key = self.make_key(model)
+
+        with self._lock:
+            index = self._read_index()
+            found = index.pop(key, None) is not None
+
+            entry_dir = self._get_entry_dir(key)
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir)
+                found = True
+
+            self._write_index(index)
+
+        return found
+
+    def purge(self):
+        """
+        Delete every cached run
+        """
+        with self._lock:
+            for key in self._read_index():
+                entry_dir = self._get_entry_dir(key)
+                if os.path.isdir(entry_dir):
+                    shutil.rmtree(entry_dir)
+
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+
+    def _get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _evict(self, index):
+        """
+        Delete the least recently used runs until the cache fits inside of max_bytes
+        """
+        total_bytes = sum(entry["nbytes"] for entry in index.values())
+
+        # Oldest first
+        for key, entry in sorted(index.items(), key = lambda item: item[1]["last_used"]):
+            if total_bytes <= self.max_bytes:
+                break
+
+            entry_dir = self._get_entry_dir(key)
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir)
+
+            total_bytes -= entry["nbytes"]
+            del index[key]
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+
+        try:
+            with open(self.index_path, "r") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError):
+            # A broken index only means the runs have to be run again
+            return {}
+
+    def _write_index(self, index):
+        # Write to a temp file first so a crash can't leave a half written index
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
@@ -0,0 +1,420 @@
+"""
+Classes to run the stages of several models at the same time
+"""
+import os
+import time
+import asyncio
+import concurrent.futures
+
+from lib.data_classes.cpuBudget import CpuBudget
+from lib.data_classes.divergenceWatchdog import DivergenceWatchdog
+
+class RunJob:
+    """
+    Status of the run of one model.
+
+    Attributes
+    ----------
+    job_id : int
+        Position of the model in the list given to the scheduler
+    model : AnuraModel
+        The model that is run
+    status : str
+        "pending", "running", "finished" (every stage ran with exit code 0), "failed" (a stage had a
+        non zero exit code), "cached" (the output was restored from a RunCache), "timed_out" (a stage
+        hit its wall clock limit, only with run_async), "diverged" (the watchdog stopped a stage, see
+        ``reason``), "cancelled" (only with run_async) or "error" (an exception was raised, see ``error``)
+    exit_code : int or None
+        Exit code of the last stage that ran
+    wall_time : float or None
+        Seconds from the start of the first stage to the end of the last stage
+    stages_run : int
+        Number of stages that ran
+    error : str or None
+        The exception that stopped the job
+    reason : str or None
+        Why the job diverged
+    """
+
+    def __init__(self, job_id, model):
+        self.job_id = job_id
+        self.model = model
+        self.status = "pending"
+        self.exit_code = None
+        self.wall_time = None
+        self.stages_run = 0
+        self.error = None
+        self.reason = None
+
+    def __str__(self):
+        return_string = (f"Job {self.job_id} ({self.model.model_name}): {self.status}, "
+                         f"exit code: {self.exit_code}, stages run: {self.stages_run}")
+
+        if self.wall_time is not None:
+            return_string += f", wall time: {self.wall_time:.2f} s"
+
+        if self.error is not None:
+            return_string += f"\nError: {self.error}"
+
+        if self.reason is not None:
+            return_string += f"\nDiverged: {self.reason}"
+
+        return return_string
+
+class RunScheduler:
+    """
+    Runs several models at the same time.
+
+    Each model is a job that runs its stages in order, including the modify_CPS step between the
+    stages of a benchmark (see AnuraModel.finish_stage). A job stops at the first stage that returns
+    a non zero exit code or that diverged, so the cpus go to the next job. Up to ``max_jobs`` jobs run at once, each in a thread that waits on the solver
+    process.
+
+    With a cpu budget every job takes ``threads_per_job`` cpus from the budget while its stages run and
+    the solver is limited to that many OpenMP threads, so the solvers that run at the same time don't
+    use more cores than the budget. Jobs wait for free cpus, and a job that fits into the free cpus
+    starts before an earlier job that doesn't (see CpuBudget).
+
+    Attributes
+    ----------
+    jobs : list of RunJob
+        One job per model, in the order the models were given
+    max_jobs : int
+        Maximum number of jobs that run at once
+    cpu_budget : CpuBudget or None
+        The cpus that the jobs share
+    """
+
+    def __init__(self, models, max_jobs = None, print_output = False, stage_runner = None, on_job_done = None,
+                 run_cache = None, link_cached = False, resume = True, threads_per_job = None,
+                 cpu_budget = None, pin_cpus = False, telemetry = None, watchdog = None, scratch_dir = None):
+        """
+        Parameters
+        ----------
+        models : list of AnuraModel
+            The models to run. Every model must have its own folder
+        max_jobs : int (Optional)
+            Maximum number of jobs that run at once. Defaults to the number of cpus (of the budget if there is one)
+        print_output : bool (Optional)
+            Passed to AnuraModel.run_stage
+        stage_runner : callable (Optional)
+            Function that runs the current stage of a model and returns the exit code. If there is a
+            watchdog it's passed as the watchdog keyword. Defaults to AnuraModel.run_stage
+        on_job_done : callable (Optional)
+            Called with the RunJob when a job ends
+        run_cache : RunCache (Optional)
+            Jobs whose inputs match a completed run restore its output instead of running. The output
+            of jobs that finish is stored
+        link_cached : bool (Optional)
+            Hard link restored files instead of copying them, see RunCache.restore
+        resume : bool (Optional)
+            Jobs continue after the last completed stage of an earlier run, see AnuraModel.prepare_stages
+        threads_per_job : int or callable (Optional)
+            Number of cpus and OpenMP threads of each job, or a function that returns it for a model.
+            Defaults to 1 if there is a cpu budget. Only used by the default stage runner
+        cpu_budget : int or CpuBudget (Optional)
+            Number of cpus that the jobs may use together, or a CpuBudget that can be shared with
+            other schedulers. Defaults to every cpu if threads_per_job is given
+        pin_cpus : bool (Optional)
+            Pin the solver of each job to the cpus it was given (linux only)
+        telemetry : RunTelemetry (Optional)
+            Store the time and resources of every stage that runs. Only used by the default stage runner
+        watchdog : dict (Optional)
+            Arguments of a DivergenceWatchdog (e.g. {"max_q": 1e6, "stall_time": 600}). Every job gets
+            its own watchdog that stops a stage when the run diverges
+        scratch_dir : str (Optional)
+            Run every stage in a copy of its model folder on a local disk or tmpfs and copy the results
+            back when it ends, see ScratchStage. Only used by the default stage runner and run_async
+        """
+        folder_dirs = [os.path.abspath(model.folder.folder_dir) for model in models]
+        if len(set(folder_dirs)) != len(folder_dirs):
+            raise ValueError("Every model must have its own folder, the runs would overwrite each other's output")
+
+        self.jobs = [RunJob(job_id, model) for job_id, model in enumerate(models)]
+
+        if isinstance(cpu_budget, int):
+            cpu_budget = CpuBudget(num_cpus = cpu_budget)
+        elif cpu_budget is None and threads_per_job is not None:
+            cpu_budget = CpuBudget()
+
+        if cpu_budget is not None and threads_per_job is None:
+            threads_per_job = 1
+
+        self.cpu_budget = cpu_budget
+        self.threads_per_job = threads_per_job
+        self.pin_cpus = pin_cpus
+        self.telemetry = telemetry
+        self.watchdog = watchdog
+        self.scratch_dir = scratch_dir
+
+        if max_jobs is None:
+            # Every job takes at least one cpu of the budget
+            max_jobs = cpu_budget.num_cpus if cpu_budget is not None else os.cpu_count() or 1
+        self.max_jobs = max_jobs
+
+        self.print_output = print_output
+        self.stage_runner = stage_runner
+        self.on_job_done = on_job_done
+        self.run_cache = run_cache
+        self.link_cached = link_cached
+        self.resume = resume
+
+    def __str__(self):
+        return "\n".join(str(job) for job in self.jobs)
+
+    def run(self):
+        """
+        Run every job and report each one as it finishes
+
+        Returns
+        -------
+        list of RunJob
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers = self.max_jobs) as executor:
+            futures = [executor.submit(self._run_job, job) for job in self.jobs]
+
+            for future in concurrent.futures.as_completed(futures):
+                job = future.result()
+
+                print(job)
+
+                if self.on_job_done is not None:
+                    self.on_job_done(job)
+
+        return self.jobs
+
+    async def run_async(self, log_file_name = None, **stage_kwargs):
+        """
+        Run every job from one event loop with AnuraModel.run_stage_async, so the solver is launched
+        without a shell and no thread is used per process. Each job is reported as it finishes.
+
+        Cancelling the task that awaits this terminates the running processes and marks their jobs
+        as cancelled.
+
+        Parameters
+        ----------
+        log_file_name : str (Optional)
+            Name of a log file in each model folder that the output of the stages is appended to
+        stage_kwargs
+            Passed to AnuraModel.run_stage_async, e.g. timeout (per stage wall clock limit) or on_stdout
+
+        Returns
+        -------
+        list of RunJob
+        """
+        semaphore = asyncio.Semaphore(self.max_jobs)
+
+        async def run_job(job):
+            async with semaphore:
+                await self._run_job_async(job, log_file_name, stage_kwargs)
+
+            print(job)
+
+            if self.on_job_done is not None:
+                self.on_job_done(job)
+
+        tasks = [asyncio.ensure_future(run_job(job)) for job in self.jobs]
+
+        try:
+            await asyncio.gather(*tasks)
+
+        except asyncio.CancelledError:
+            # gather raises as soon as one task is cancelled, wait until every process is terminated
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions = True)
+
+            for job in self.jobs:
+                if job.status == "pending":
+                    job.status = "cancelled"
+            raise
+
+        return self.jobs
+
+    def get_jobs(self, status):
+        """
+        Returns the jobs that have the status
+        """
+        return [job for job in self.jobs if job.status == status]
+
+    def _run_stage(self, model, cpus = None, watchdog = None):
+        watchdog_kwargs = {"watchdog": watchdog} if watchdog is not None else {}
+
+        if self.stage_runner is None:
+            num_threads = len(cpus) if cpus is not None else None
+            cpu_ids = cpus if self.pin_cpus else None
+
+            return model.run_stage(self.print_output, num_threads = num_threads, cpu_ids = cpu_ids,
+                                   telemetry = self.telemetry, scratch_dir = self.scratch_dir, **watchdog_kwargs)
+
+        return self.stage_runner(model, **watchdog_kwargs)
+
+    def _make_watchdog(self, model):
+        """
+        Returns a new DivergenceWatchdog for the model, None if the scheduler has no watchdog
+        """
+        if self.watchdog is None:
+            return None
+
+        return DivergenceWatchdog(model.folder.folder_dir, **self.watchdog)
+
+    def _get_threads_per_job(self, model):
+        if callable(self.threads_per_job):
+            return self.threads_per_job(model)
+
+        return self.threads_per_job
+
+    def _run_job(self, job):
+        model = job.model
+        setup = model.setup
+
+        start_time = time.perf_counter()
+        job.status = "running"
+        cpus = None
+        watchdog = self._make_watchdog(model)
+
+        try:
+            if not hasattr(setup, "batch_script_path"):
+                setup.generate_batch_file()
+
+            model.prepare_stages(resume = self.resume)
+            run_key = self._restore_from_cache(job)
+
+            if self.cpu_budget is not None and job.status == "running":
+                cpus = self.cpu_budget.acquire(self._get_threads_per_job(model))
+
+            while job.status == "running" and model.current_stage <= self._get_num_stages(model) - 1:
+                job.exit_code = self._run_stage(model, cpus, watchdog)
+                job.stages_run += 1
+
+                if watchdog is not None and watchdog.diverged:
+                    job.status = "diverged"
+                    job.reason = watchdog.reason
+                    break
+
+                if job.exit_code != 0:
+                    job.status = "failed"
+                    break
+
+                self._advance_stage(model)
+
+            if job.status == "running":
+                job.status = "finished"
+                self._store_in_cache(job, run_key)
+
+        except Exception as e:
+            job.status = "error"
+            job.error = repr(e)
+
+        finally:
+            if cpus is not None:
+                self.cpu_budget.release(cpus)
+            job.wall_time = time.perf_counter() - start_time
+
+        return job
+
+    async def _run_job_async(self, job, log_file_name, stage_kwargs):
+        model = job.model
+
+        start_time = time.perf_counter()
+        job.status = "running"
+
+        cpus = None
+
+        if log_file_name is not None:
+            stage_kwargs = dict(stage_kwargs, log_file = os.path.join(model.folder.folder_dir, log_file_name))
+
+        if self.telemetry is not None:
+            stage_kwargs.setdefault("telemetry", self.telemetry)
+
+        if self.watchdog is not None:
+            stage_kwargs = dict(stage_kwargs, watchdog = self._make_watchdog(model))
+
+        if self.scratch_dir is not None:
+            stage_kwargs.setdefault("scratch_dir", self.scratch_dir)
+
+        try:
+            model.prepare_stages(resume = self.resume)
+            run_key = self._restore_from_cache(job)
+
+            if self.cpu_budget is not None and job.status == "running":
+                cpus = await self.cpu_budget.acquire_async(self._get_threads_per_job(model))
+
+                stage_kwargs = dict(stage_kwargs, num_threads = len(cpus))
+                if self.pin_cpus:
+                    stage_kwargs["cpu_ids"] = cpus
+
+            while job.status == "running" and model.current_stage <= self._get_num_stages(model) - 1:
+                result = await model.run_stage_async(**stage_kwargs)
+                job.exit_code = result["exit_code"]
+                job.stages_run += 1
+
+                if result["diverged"] is not None:
+                    job.status = "diverged"
+                    job.reason = result["diverged"]
+                    break
+
+                if result["timed_out"]:
+                    job.status = "timed_out"
+                    break
+
+                if job.exit_code != 0:
+                    job.status = "failed"
+                    break
+
+                self._advance_stage(model)
+
+            if job.status == "running":
+                job.status = "finished"
+                self._store_in_cache(job, run_key)
+
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+
+        except Exception as e:
+            job.status = "error"
+            job.error = repr(e)
+
+        finally:
+            if cpus is not None:
+                self.cpu_budget.release(cpus)
+            job.wall_time = time.perf_counter() - start_time
+
+    def _restore_from_cache(self, job):
+        """
+        Restore the output of the job from the run cache if its inputs match a completed run
+
+        Returns
+        -------
+        str or None
+            The key of the inputs, None if there is no run cache or the model is part way through its stages
+        """
+        model = job.model
+
+        if self.run_cache is None or model.current_stage != 0:
+            return None
+
+        run_key = self.run_cache.make_key(model)
+
+        if self.run_cache.restore(model, key = run_key, link = self.link_cached):
+            model.current_stage = self._get_num_stages(model)
+            job.status = "cached"
+            job.exit_code = 0
+
+        return run_key
+
+    def _store_in_cache(self, job, run_key):
+        if run_key is not None:
+            self.run_cache.store(job.model, run_key)
+
+    @staticmethod
+    def _get_num_stages(model):
+        return model.get_num_stages()
+
+    @staticmethod
+    def _advance_stage(model):
+        """
+        Record the stage, modify the CPS file for the next stage of a benchmark and move to the next stage
+        """
+        model.finish_stage(exit_code = 0)
@@ -0,0 +1,264 @@
+"""
+Class to store the wall time, cpu time and memory of every stage that is run in an SQLite database
+"""
+import contextlib
+import os
+import socket
+import sqlite3
+import pandas as pd
+
+from lib.general_functions.hash_functions import hash_file, hash_model_inputs
+
+class RunTelemetry:
+    """
+    A local SQLite database with one row per stage run.
+
+    Each row holds the model, the stage, the executable (path and hash, so builds at the same path
+    can be told apart), the hash of the inputs (see hash_functions.hash_model_inputs), the start and
+    end time, the cpu time and peak resident memory of the solver, the exit code and status and the
+    size of the files the stage wrote.
+
+    Give the object to AnuraModel.run_stage, run_benchmark or a RunScheduler to record the stages
+    they run. Keep the database on a local disk, SQLite locking isn't reliable on network file systems.
+
+    Attributes
+    ----------
+    db_path : str
+        Path of the database file
+    """
+
+    columns = ("id", "model_name", "folder_dir", "benchmark_name", "stage", "exe_path", "exe_hash",
+               "input_hash", "host", "num_threads", "start_time", "end_time", "wall_time", "cpu_time",
+               "max_rss", "exit_code", "status", "output_bytes")
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+        with self._connect() as connection:
+            # Write ahead logging lets the jobs of a scheduler write while the database is read
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS stages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    model_name TEXT,
+                    folder_dir TEXT,
+                    benchmark_name TEXT,
+                    stage INTEGER,
+                    exe_path TEXT,
+                    exe_hash TEXT,
+                    input_hash TEXT,
+                    host TEXT,
+                    num_threads INTEGER,
+                    start_time REAL,
+                    end_time REAL,
+                    wall_time REAL,
+                    cpu_time REAL,
+                    max_rss INTEGER,
+                    exit_code INTEGER,
+                    status TEXT,
+                    output_bytes INTEGER
+                )""")
+
+            for column in ("model_name", "exe_hash", "input_hash", "start_time"):
+                connection.execute(f"CREATE INDEX IF NOT EXISTS stages_{column} ON stages ({column})")
+
+    def __str__(self):
+        with self._connect() as connection:
+            num_rows = connection.execute("SELECT COUNT(*) FROM stages").fetchone()[0]
+
+        return (f"Run telemetry: {self.db_path}\n"
+                f"Number of stages recorded: {num_rows}\n")
+
+    def start_stage(self, model):
+        """
+        Returns the information of a stage that is known before it runs, to be given to record_stage
+        """
+        return {"stage": model.current_stage, "input_hash": hash_model_inputs(model)}
+
+    def record_stage(self, model, stage_info, usage, exit_code, status = None, num_threads = None):
+        """
+        Store a stage that ran
+
+        Parameters
+        ----------
+        model : AnuraModel
+            The model whose stage ran
+        stage_info : dict
+            Returned by start_stage before the stage ran
+        usage : dict
+            "start_time", "end_time", "cpu_time" and "max_rss" of the stage, e.g. from
+            executing_runs.run_batch_script or run_solver_async
+        exit_code : int
+            Exit code of the solver
+        status : str (Optional)
+            Defaults to "finished" for exit code 0 and "failed" otherwise
+        num_threads : int (Optional)
+            Number of OpenMP threads of the solver
+
+        Returns
+        -------
+        int
+            Id of the row
+        """
+        if status is None:
+            status = "finished" if exit_code == 0 else "failed"
+
+        exe_path = model.setup.exe_path
+        start_time = usage["start_time"]
+        end_time = usage["end_time"]
+
+        row = {
+            "model_name": model.model_name,
+            "folder_dir": os.path.abspath(model.folder.folder_dir),
+            "benchmark_name": model.benchmark_name,
+            "stage": stage_info["stage"],
+            "exe_path": exe_path,
+            "exe_hash": hash_file(exe_path) if os.path.isfile(exe_path) else None,
+            "input_hash": stage_info["input_hash"],
+            "host": socket.gethostname(),
+            "num_threads": num_threads,
+            "start_time": start_time,
+            "end_time": end_time,
+            "wall_time": end_time - start_time,
+            "cpu_time": usage.get("cpu_time"),
+            "max_rss": usage.get("max_rss"),
+            "exit_code": exit_code,
+            "status": status,
+            "output_bytes": self.get_output_bytes(model.folder.folder_dir, start_time),
+        }
+
+        names = ", ".join(row)
+        slots = ", ".join("?" * len(row))
+
+        with self._connect() as connection:
+            cursor = connection.execute(f"INSERT INTO stages ({names}) VALUES ({slots})", list(row.values()))
+
+        return cursor.lastrowid
+
+    def query(self, model_name = None, folder_dir = None, benchmark_name = None, exe_path = None, exe_hash = None,
+              input_hash = None, host = None, status = None, since = None, until = None, limit = None):
+        """
+        Returns the recorded stages that match every filter that is given, oldest first
+
+        Parameters
+        ----------
+        since, until : float (Optional)
+            Only stages that started in this range of epoch seconds
+        limit : int (Optional)
+            Only the newest limit stages
+
+        Returns
+        -------
+        list of dict
+        """
+        where, params = self._make_where(model_name = model_name, benchmark_name = benchmark_name,
+                                         exe_path = exe_path, exe_hash = exe_hash, input_hash = input_hash,
+                                         host = host, status = status, since = since, until = until,
+                                         folder_dir = None if folder_dir is None else os.path.abspath(folder_dir))
+
+        sql = f"SELECT {', '.join(self.columns)} FROM stages{where} ORDER BY start_time DESC, id DESC"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+
+        with self._connect() as connection:
+            rows = connection.execute(sql, params).fetchall()
+
+        return [dict(zip(self.columns, row)) for row in reversed(rows)]
+
+    def to_dataframe(self, **filters):
+        """
+        Returns the recorded stages as a DataFrame. filters are passed to query
+        """
+        return pd.DataFrame(self.query(**filters), columns = list(self.columns))
+
+    def summarize(self, by = "exe_hash", **filters):
+        """
+        Returns statistics of the recorded stages grouped by a column, e.g. per build of the executable
+        (exe_hash) to spot performance regressions or per benchmark_name and stage to size jobs
+
+        Parameters
+        ----------
+        by : str or list of str (Optional)
+            The column(s) to group by
+        filters
+            Passed to query
+
+        Returns
+        -------
+        list of dict
+            The group, "num_runs", "num_failed", "mean_wall_time", "max_wall_time", "mean_cpu_time",
+            "max_rss" and "first_run" for each group
+        """
+        if isinstance(by, str):
+            by = [by]
+
+        unknown_columns = [column for column in by if column not in self.columns]
+        if unknown_columns:
+            raise KeyError(f"{unknown_columns} aren't columns. Columns: {list(self.columns)}")
+
+        where, params = self._make_where(**filters)
+        group = ", ".join(by)
+
+        sql = (f"SELECT {group}, COUNT(*), SUM(status != 'finished'), AVG(wall_time), MAX(wall_time), "
+               f"AVG(cpu_time), MAX(max_rss), MIN(start_time) FROM stages{where} "
+               f"GROUP BY {group} ORDER BY MIN(start_time)")
+
+        with self._connect() as connection:
+            rows = connection.execute(sql, params).fetchall()
+
+        names = list(by) + ["num_runs", "num_failed", "mean_wall_time", "max_wall_time", "mean_cpu_time",
+                            "max_rss", "first_run"]
+
+        return [dict(zip(names, row)) for row in rows]
+
+    @staticmethod
+    def get_output_bytes(folder_dir, since):
+        """
+        Returns the total size of the files in the folder that were written after since (epoch seconds)
+        """
+        output_bytes = 0
+
+        with os.scandir(folder_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    if stat.st_mtime >= since:
+                        output_bytes += stat.st_size
+
+        return output_bytes
+
+    def _make_where(self, since = None, until = None, **filters):
+        unknown_columns = [column for column in filters if column not in self.columns]
+        if unknown_columns:
+            raise KeyError(f"{unknown_columns} aren't columns. Columns: {list(self.columns)}")
+
+        conditions = []
+        params = []
+
+        for column, value in filters.items():
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+
+        if since is not None:
+            conditions.append("start_time >= ?")
+            params.append(since)
+
+        if until is not None:
+            conditions.append("start_time < ?")
+            params.append(until)
+
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+        return where, params
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # A connection per call so the database can be used from the threads of a scheduler
+        connection = sqlite3.connect(self.db_path, timeout = 30)
+        try:
+            # Commits at the end of the block or rolls back on an error
+            with connection:
+                yield connection
+        finally:
+            connection.close()
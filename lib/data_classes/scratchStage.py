@@ -0,0 +1,160 @@
+"""
+Class to run a stage in a local scratch folder and copy only its results back to the model folder
+"""
+import os
+import shutil
+import tempfile
+
+from lib.data_classes.folder import Folder
+from lib.general_functions.par_reader import is_par_file
+
+class ScratchStage:
+    """
+    A temporary copy of a model folder on a local disk or tmpfs (e.g. /dev/shm) that a stage runs in.
+
+    Anura3D writes many small updates to the .PAR_, .OUT and CPS_ files, which is slow on a network
+    file system. The files of the model folder are copied to the scratch folder with
+    Folder.copy_files_2_folder, the stage runs there and when it ends only the files that the stage
+    created or changed are copied back. Each file is copied to a temp file that is renamed, so the
+    model folder never holds a half written file. The scratch folder is deleted when the stage ends,
+    also when it failed. It's only kept (and its path printed) if the results couldn't be copied back.
+
+    Use it as a context manager::
+
+        with ScratchStage(model.folder.folder_dir, "/dev/shm") as scratch:
+            ... run the solver in scratch.scratch_dir ...
+
+    Attributes
+    ----------
+    folder_dir : str
+        The model folder
+    scratch_root : str
+        Folder the scratch folder is made in
+    scratch_dir : str or None
+        The scratch folder while it exists
+    exclude_files : set of str
+        Names of files that aren't copied in either direction, e.g. a batch file written for the scratch folder
+    """
+
+    def __init__(self, folder_dir, scratch_root = None, exclude_files = ()):
+        """
+        Parameters
+        ----------
+        folder_dir : str
+            The model folder
+        scratch_root : str (Optional)
+            A folder on a local disk or tmpfs. Defaults to the temp folder of the system (TMPDIR)
+        exclude_files : iterable of str (Optional)
+            Names of files that aren't copied in either direction
+        """
+        self.folder_dir = folder_dir
+        self.scratch_root = scratch_root if scratch_root is not None else tempfile.gettempdir()
+        self.exclude_files = set(exclude_files)
+        self.scratch_dir = None
+
+        # file name -> (size, mtime) of the files copied into the scratch folder
+        self._copied_files = {}
+
+    def __str__(self):
+        return (f"Model folder: {self.folder_dir}\n"
+                f"Scratch folder: {self.scratch_dir}\n")
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """
+        Make the scratch folder and copy the files of the model folder into it
+
+        Returns
+        -------
+        str
+            The scratch folder
+        """
+        os.makedirs(self.scratch_root, exist_ok = True)
+        self.scratch_dir = tempfile.mkdtemp(prefix = "anura_stage_", dir = self.scratch_root)
+
+        try:
+            # Binary copies next to the .PAR_ files aren't read by the solver
+            Folder(self.folder_dir).copy_files_2_folder(self.scratch_dir, file_filter = self._is_stage_file)
+        except BaseException:
+            self.remove()
+            raise
+
+        self._copied_files = self._get_file_stats(self.scratch_dir)
+
+        return self.scratch_dir
+
+    def get_changed_files(self):
+        """
+        Returns the names of the files in the scratch folder that were created or changed since open
+        """
+        return [file_name for file_name, file_stat in self._get_file_stats(self.scratch_dir).items()
+                if self._copied_files.get(file_name) != file_stat]
+
+    def sync_back(self):
+        """
+        Copy the files that were created or changed in the scratch folder to the model folder
+
+        Returns
+        -------
+        list of str
+            Names of the files that were copied
+        """
+        changed_files = self.get_changed_files()
+
+        for file_name in changed_files:
+            dst_dir = os.path.join(self.folder_dir, file_name)
+
+            # Rename a temp file over the old file so it's never half written
+            tmp_path = f"{dst_dir}.{os.getpid()}.tmp"
+            shutil.copy2(os.path.join(self.scratch_dir, file_name), tmp_path)
+            os.replace(tmp_path, dst_dir)
+
+        return changed_files
+
+    def close(self):
+        """
+        Copy the results back and delete the scratch folder. If copying fails the scratch folder is kept
+        """
+        if self.scratch_dir is None:
+            return
+
+        try:
+            self.sync_back()
+        except BaseException:
+            print(f"Warning: the results couldn't be copied back to {self.folder_dir}, "
+                  f"they are kept in {self.scratch_dir}")
+            self.scratch_dir = None
+            raise
+
+        self.remove()
+
+    def remove(self):
+        """
+        Delete the scratch folder without copying anything back
+        """
+        if self.scratch_dir is not None:
+            shutil.rmtree(self.scratch_dir, ignore_errors = True)
+            self.scratch_dir = None
+
+    def _is_stage_file(self, file_name):
+        if file_name in self.exclude_files:
+            return False
+
+        return not ('.PAR_' in file_name and not is_par_file(file_name))
+
+    def _get_file_stats(self, folder_dir):
+        file_stats = {}
+
+        with os.scandir(folder_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name not in self.exclude_files:
+                    stat = entry.stat()
+                    file_stats[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+        return file_stats
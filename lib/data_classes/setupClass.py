@@ -1,5 +1,4 @@
-from lib.general_functions.general_functions import (get_highest_file, pad_integer_to_string,
-                                                      )
+from lib.general_functions.general_functions import pad_integer_to_string
 
 from lib.general_functions.executing_runs import generate_batch_script
 from lib.benchmark_info.run_benchmarks_info import benchmark_info_dict # Dictionary that contains information about the benchmarks.
@@ -68,7 +67,8 @@ class ModelSetup:
         # Returns a list so get the first element in the list
         cps_file_obj = self.get_CPS_file(which_file=which_file)[0]
         
-        cps_file_obj.modify_single_value_flags(modify_dict.keys(), modify_dict.values())
+        # All of the flags are written in one edit session
+        cps_file_obj.modify_flags(modify_dict)
         
         print(f"Modified {cps_file_obj.get_file_name()}")
 
@@ -121,8 +121,11 @@ class ModelSetup:
 
             # Make the file path
         elif which_file == "last":
-            # Get the last CPS file
-            file_name = get_highest_file(model_folder_dir, file_extension)
+            # Get the last CPS file from the folder index
+            file_name = self.folder.get_highest_numbered_file(file_extension)
+
+            if file_name is None:
+                raise FileNotFoundError(f"No {file_extension} files in {model_folder_dir}")
             
             cps_file_paths.append(self._make_file_path(file_name))
 
@@ -0,0 +1,175 @@
+"""
+Class to find points inside of a box, inside of a sphere or nearest to a coordinate
+"""
+import numpy as np
+
+class SpatialIndex:
+    """
+    Uniform grid over a set of points.
+
+    The points are sorted by the grid cell they fall in so the points of a cell are one contiguous
+    slice. Queries only look at the points in the cells that overlap the query region.
+
+    Attributes
+    ----------
+    points : np.ndarray
+        (num_points, dim) coordinates that are indexed
+    cell_size : np.ndarray
+        Size of a grid cell along each axis
+    num_cells : np.ndarray
+        Number of grid cells along each axis
+    """
+
+    # Axes whose extent is at most this fraction of the largest extent are flat
+    flat_tolerance = 1e-6
+
+    def __init__(self, points, points_per_cell = 8):
+        """
+        Parameters
+        ----------
+        points : array_like
+            (num_points, dim) coordinates, e.g. the element centroids
+        points_per_cell : int (Optional)
+            Average number of points per cell that the grid is sized for
+        """
+        self.points = np.asarray(points, dtype = np.float64)
+
+        if self.points.ndim != 2 or len(self.points) == 0:
+            raise ValueError(f"points must be a non empty (num_points, dim) array. Got shape {self.points.shape}")
+        if not np.all(np.isfinite(self.points)):
+            raise ValueError("points must be finite. Got NaN or infinite coordinates")
+
+        num_points, dim = self.points.shape
+
+        self.min_coords = self.points.min(axis = 0)
+        extent = self.points.max(axis = 0) - self.min_coords
+
+        # Size the cells so that the points are spread over num_points / points_per_cell cells.
+        # Flat axes (e.g. every point on a plane, also with some jitter) get one cell
+        num_target_cells = max(num_points / points_per_cell, 1.0)
+        flat = extent <= self.flat_tolerance * np.max(extent)
+
+        # An axis that is shorter than a cell only gets one cell, which would leave too many cells
+        # on the other axes. Size the cells again without it until every axis left is a cell or longer,
+        # then there are at most 2**dim * num_target_cells cells
+        cell_length = 1.0
+        while not np.all(flat):
+            cell_length = (np.prod(extent[~flat]) / num_target_cells) ** (1.0 / np.count_nonzero(~flat))
+
+            short = ~flat & (extent < cell_length)
+            if not np.any(short):
+                break
+            flat |= short
+
+        self.cell_size = np.full(dim, cell_length)
+        self.num_cells = np.where(flat, 1, np.floor(extent / cell_length).astype(np.int64) + 1)
+
+        # Sort the points by cell so each cell is a contiguous slice of self._order
+        cell_ids = self._get_flat_cell_ids(self._get_cell_coords(self.points))
+        self._order = np.argsort(cell_ids, kind = "stable")
+        self._cell_start = np.searchsorted(cell_ids[self._order], np.arange(np.prod(self.num_cells) + 1))
+
+    def __str__(self):
+        return (f"Number of points: {len(self.points)}\n"
+                f"Number of cells: {self.num_cells}\n"
+                f"Cell size: {self.cell_size}\n")
+
+    @property
+    def dim(self):
+        return self.points.shape[1]
+
+    def query_box(self, min_coords, max_coords):
+        """
+        Returns the ids of the points inside of the axis aligned box (boundaries included), sorted
+        """
+        min_coords = self._as_coord(min_coords)
+        max_coords = self._as_coord(max_coords)
+
+        ids = self._get_candidates(min_coords, max_coords)
+        points = self.points[ids]
+        inside = np.all((points >= min_coords) & (points <= max_coords), axis = 1)
+
+        return np.sort(ids[inside])
+
+    def query_sphere(self, center, radius):
+        """
+        Returns the ids of the points within radius of the center (boundary included), sorted
+        """
+        center = self._as_coord(center)
+
+        if not np.isfinite(radius) or radius < 0:
+            raise ValueError(f"radius must be finite and not negative. Got {radius}")
+
+        ids = self._get_candidates(center - radius, center + radius)
+        dist_sq = np.sum((self.points[ids] - center)**2, axis = 1)
+
+        return np.sort(ids[dist_sq <= radius**2])
+
+    def query_nearest(self, coord, k = 1):
+        """
+        Returns the ids of the k points that are nearest to the coordinate, nearest first
+
+        The search radius starts at one cell and is doubled until k points are inside of it. Every point
+        closer than the k-th point is then inside of the searched sphere, so the result is exact.
+        """
+        coord = self._as_coord(coord)
+        k = min(int(k), len(self.points))
+
+        radius = np.max(self.cell_size)
+        while True:
+            ids = self._get_candidates(coord - radius, coord + radius)
+            dist_sq = np.sum((self.points[ids] - coord)**2, axis = 1)
+            in_sphere = dist_sq <= radius**2
+
+            if np.count_nonzero(in_sphere) >= k:
+                ids = ids[in_sphere]
+                dist_sq = dist_sq[in_sphere]
+                nearest = np.argsort(dist_sq, kind = "stable")[:k]
+                return ids[nearest]
+
+            radius *= 2.0
+
+    def _as_coord(self, coord):
+        coord = np.asarray(coord, dtype = np.float64)
+
+        if coord.shape != (self.dim,):
+            raise ValueError(f"Coordinates must have {self.dim} values. Got {coord.tolist()}")
+        if not np.all(np.isfinite(coord)):
+            # The search radius of query_nearest would grow forever
+            raise ValueError(f"Coordinates must be finite. Got {coord.tolist()}")
+
+        return coord
+
+    def _get_cell_coords(self, points):
+        """
+        Integer grid coordinates of the cell that each point is in, clipped to the grid
+        """
+        cell_coords = np.floor((points - self.min_coords) / self.cell_size).astype(np.int64)
+        return np.clip(cell_coords, 0, self.num_cells - 1)
+
+    def _get_flat_cell_ids(self, cell_coords):
+        return np.ravel_multi_index(tuple(cell_coords.T), tuple(self.num_cells))
+
+    def _get_candidates(self, min_coords, max_coords):
+        """
+        Returns the ids of the points in the cells that overlap the box
+        """
+        low, high = self._get_cell_coords(np.array([min_coords, max_coords]))
+
+        # Every cell of the box, then the slice of the sorted points that each cell holds
+        axes = [np.arange(low[i], high[i] + 1) for i in range(self.dim)]
+        cell_coords = np.stack([grid.ravel() for grid in np.meshgrid(*axes, indexing = "ij")], axis = 1)
+        cell_ids = self._get_flat_cell_ids(cell_coords)
+
+        starts = self._cell_start[cell_ids]
+        counts = self._cell_start[cell_ids + 1] - starts
+
+        # Concatenate the ranges start:start+count without a python loop
+        total = counts.sum()
+        if total == 0:
+            return np.empty(0, dtype = np.int64)
+
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        positions = np.arange(total) + offsets
+
+        return self._order[positions]
@@ -0,0 +1,164 @@
+"""
+Class to record the stages of a model that have been run so a run can be resumed
+"""
+import json
+import os
+import time
+
+class StageState:
+    """
+    The stages of a model that have been run, stored in ``<model_name>.stage_state.json`` in the model folder.
+
+    The file is written after every stage, so a run that is stopped part way (e.g. the kernel dies
+    during stage 2) can resume from the last completed stage instead of starting over. For each stage
+    it records the exit code, the CPS_ file that the stage produced, the sizes of the .PAR_ and .OUT
+    files after the stage and whether the CPS file was modified for the next stage (see
+    AnuraModel.finish_stage). The rows that a stage which didn't complete appended to the .PAR_ and
+    .OUT files are cut off with those sizes when the run is resumed. The hashes of the input files from
+    before the first stage are stored too, so a state file is ignored once the inputs are changed.
+
+    Attributes
+    ----------
+    state_dir : str
+        Path of the state file
+    input_hashes : dict or None
+        file name -> sha256 of the input files, and "exe" -> sha256 of the executable
+    start_output_sizes : dict or None
+        file name -> size of the .PAR_ and .OUT files before the first stage
+    stages : list of dict
+        One entry per stage that ran: "stage", "exit_code", "cps_file", "output_sizes",
+        "modify_cps_applied" and "finished"
+    """
+
+    state_suffix = ".stage_state.json"
+
+    def __init__(self, folder_dir, model_name):
+        self.state_dir = os.path.join(folder_dir, model_name + self.state_suffix)
+        self.input_hashes = None
+        self.start_output_sizes = None
+        self.stages = []
+
+    def __str__(self):
+        return (f"Stage state: {self.state_dir}\n"
+                f"Completed stages: {self.get_num_completed()}\n")
+
+    def exists(self):
+        return os.path.exists(self.state_dir)
+
+    def load(self):
+        """
+        Read the state file. A missing or broken file gives an empty state
+
+        Returns
+        -------
+        StageState
+            The object, so StageState(...).load() can be chained
+        """
+        self.input_hashes = None
+        self.start_output_sizes = None
+        self.stages = []
+
+        if not self.exists():
+            return self
+
+        try:
+            with open(self.state_dir, "r") as f:
+                state = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            # A broken state file only means the stages have to be run again
+            return self
+
+        self.input_hashes = state.get("input_hashes")
+        self.start_output_sizes = state.get("start_output_sizes")
+        self.stages = state.get("stages", [])
+
+        return self
+
+    def save(self):
+        # Write to a temp file first so a crash can't leave a half written state
+        tmp_path = f"{self.state_dir}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"input_hashes": self.input_hashes, "start_output_sizes": self.start_output_sizes,
+                       "stages": self.stages}, f, indent = 4)
+        os.replace(tmp_path, self.state_dir)
+
+    def reset(self, input_hashes = None, output_sizes = None):
+        """
+        Start a new state for a run from the first stage. output_sizes are the sizes of the .PAR_ and
+        .OUT files before the first stage
+        """
+        self.input_hashes = input_hashes
+        self.start_output_sizes = output_sizes
+        self.stages = []
+        self.save()
+
+    def delete(self):
+        self.input_hashes = None
+        self.start_output_sizes = None
+        self.stages = []
+
+        if self.exists():
+            os.remove(self.state_dir)
+
+    def record_stage(self, stage, exit_code, cps_file, output_sizes = None):
+        """
+        Record that a stage ran. Entries of the stage and of later stages from an earlier run are replaced
+
+        Parameters
+        ----------
+        stage : int
+            0 based id of the stage
+        exit_code : int or None
+            Exit code of the solver, None if it isn't known
+        cps_file : str or None
+            Name of the last CPS_ file after the stage ran
+        output_sizes : dict (Optional)
+            file name -> size of the .PAR_ and .OUT files after the stage ran
+        """
+        self.stages = [entry for entry in self.stages if entry["stage"] < stage]
+        self.stages.append({
+            "stage": stage,
+            "exit_code": exit_code,
+            "cps_file": cps_file,
+            "output_sizes": output_sizes,
+            "modify_cps_applied": False,
+            "finished": time.time(),
+        })
+        self.save()
+
+    def set_modify_cps_applied(self, stage):
+        """
+        Record that the CPS file of the stage was modified for the next stage
+        """
+        for entry in self.stages:
+            if entry["stage"] == stage:
+                entry["modify_cps_applied"] = True
+        self.save()
+
+    def get_completed_stages(self):
+        """
+        Returns the entries of the stages that completed in order from the first stage. A stage is
+        completed if it didn't end with a non zero exit code
+        """
+        completed = []
+        for stage, entry in enumerate(self.stages):
+            if entry["stage"] != stage or entry["exit_code"] not in (0, None):
+                break
+            completed.append(entry)
+
+        return completed
+
+    def get_output_sizes(self):
+        """
+        Returns file name -> size of the .PAR_ and .OUT files after the last completed stage (before the
+        first stage if none completed), None if they weren't recorded
+        """
+        completed = self.get_completed_stages()
+
+        if completed:
+            return completed[-1].get("output_sizes")
+
+        return self.start_output_sizes
+
+    def get_num_completed(self):
+        return len(self.get_completed_stages())
@@ -0,0 +1,456 @@
+"""
+Class to share the runs of models between worker processes on machines with a shared file system
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from lib.data_classes.modelClass import AnuraModel
+from lib.data_classes.runScheduler import RunScheduler
+
+class WorkQueue:
+    """
+    A queue of model runs kept in a folder on a shared file system.
+
+    Every job is a JSON file with the arguments of the AnuraModel to run. The state of a job is the
+    folder its file is in::
+
+        <queue_dir>/pending/   waiting to be run
+        <queue_dir>/running/   claimed by a worker
+        <queue_dir>/done/      every stage finished (or the output was restored from a run cache)
+        <queue_dir>/failed/    a stage failed or diverged, an error was raised or the job was abandoned too often
+
+    Jobs move between the folders with os.rename, which is atomic on a single file system (including
+    NFS), so a job is only ever claimed by one worker and no lock server is needed. A claimed job is
+    renamed to ``running/<job_id>.<claim>.json`` with a name that is new for every claim, so a worker
+    only ever touches its own claim: once its claim is gone (the job was put back in the queue) its
+    heartbeats fail, its solver is stopped and it can't complete the job. A worker updates the file of
+    its claim every ``heartbeat_interval`` seconds. A claim whose file hasn't been updated for
+    ``stale_after`` seconds belongs to a worker that died, it's moved back to pending by the next
+    worker that looks for a job.
+
+    Start workers with ``python -m lib worker <queue_dir>`` on any machine that can see the folder.
+
+    Attributes
+    ----------
+    queue_dir : str
+        Folder of the queue
+    stale_after : float
+        Seconds without a heartbeat after which a running job is put back in the queue
+    max_attempts : int
+        Number of times a job is claimed before it's failed instead of put back in the queue
+    """
+
+    states = ("pending", "running", "done", "failed")
+
+    def __init__(self, queue_dir, stale_after = 600.0, max_attempts = 3):
+        self.queue_dir = queue_dir
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+
+        for state in self.states + ("claims",):
+            os.makedirs(os.path.join(queue_dir, state), exist_ok = True)
+
+    def __str__(self):
+        counts = self.get_counts()
+        return (f"Work queue: {self.queue_dir}\n" +
+                "".join(f"{state}: {count}\n" for state, count in counts.items()))
+
+    @property
+    def heartbeat_interval(self):
+        return self.stale_after / 10
+
+    def enqueue(self, model, num_threads = None):
+        """
+        Add a run of a model to the queue
+
+        Parameters
+        ----------
+        model : AnuraModel
+            The model to run. Its folder must be on the shared file system
+        num_threads : int (Optional)
+            Number of OpenMP threads of the solver
+
+        Returns
+        -------
+        str
+            Id of the job. Jobs are claimed in the order they were added
+        """
+        spec = {
+            "exe_path": model.setup.exe_path,
+            "model_folder_path": os.path.abspath(model.folder.folder_dir),
+            "model_name": model.model_name,
+            "benchmark": model.benchmark,
+            "benchmark_name": model.benchmark_name,
+            "num_threads": num_threads,
+            "enqueued": time.time(),
+        }
+
+        job_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+
+        self._write_json(self._get_job_path("pending", job_id), spec)
+
+        return job_id
+
+    def claim(self, worker_id):
+        """
+        Take the oldest pending job
+
+        Returns
+        -------
+        tuple or None
+            (job id, claim, spec) or None if there is no pending job. The claim is given to heartbeat,
+            complete and release
+        """
+        for job_id in self.get_job_ids("pending"):
+            claim = uuid.uuid4().hex[:12]
+            running_path = self._get_claim_path(job_id, claim)
+
+            try:
+                os.rename(self._get_job_path("pending", job_id), running_path)
+            except FileNotFoundError:
+                # Another worker claimed it first
+                continue
+
+            # The heartbeat starts from the claim, not from when the job was added
+            os.utime(running_path)
+
+            spec = self._read_json(running_path)
+            attempt = self._add_claim(job_id)
+
+            if attempt > self.max_attempts:
+                self._finish(job_id, claim, "failed", {"status": "abandoned",
+                                                       "error": f"The job was abandoned by {attempt - 1} workers"})
+                continue
+
+            self._write_json(self._get_owner_path(job_id, claim), {"worker_id": worker_id, "attempt": attempt,
+                                                                   "claimed": time.time()})
+
+            return job_id, claim, spec
+
+        return None
+
+    def heartbeat(self, job_id, claim):
+        """
+        Mark a claim of a running job as alive
+
+        Returns
+        -------
+        bool
+            False if the claim isn't running anymore, e.g. it was put back in the queue as abandoned
+        """
+        try:
+            os.utime(self._get_claim_path(job_id, claim))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, job_id, claim, result):
+        """
+        Move a claimed job to done (result["status"] is "finished" or "cached") or failed and store its result
+
+        Returns
+        -------
+        bool
+            False if the claim wasn't running anymore
+        """
+        state = "done" if result.get("status") in ("finished", "cached") else "failed"
+
+        return self._finish(job_id, claim, state, result)
+
+    def release(self, job_id, claim):
+        """
+        Put a claimed job back in the queue, e.g. when the worker is stopped
+
+        Returns
+        -------
+        bool
+            False if the claim wasn't running anymore
+        """
+        try:
+            os.rename(self._get_claim_path(job_id, claim), self._get_job_path("pending", job_id))
+        except FileNotFoundError:
+            return False
+
+        self._remove(self._get_owner_path(job_id, claim))
+
+        return True
+
+    def requeue_abandoned(self):
+        """
+        Put the running jobs whose worker stopped sending heartbeats back in the queue
+
+        Returns
+        -------
+        list of str
+            Ids of the jobs that were put back
+        """
+        requeued = []
+        now = time.time()
+
+        # A claim that is made after the listing has a new name, so it can't be moved by mistake
+        for job_id, claim in self._get_claims():
+            try:
+                stat = os.stat(self._get_claim_path(job_id, claim))
+            except FileNotFoundError:
+                continue
+
+            # A rename updates the ctime and a heartbeat the mtime
+            if now - max(stat.st_mtime, stat.st_ctime) < self.stale_after:
+                continue
+
+            if self.release(job_id, claim):
+                print(f"Put abandoned job {job_id} back in the queue")
+                requeued.append(job_id)
+
+        return requeued
+
+    def get_job_ids(self, state):
+        """
+        Returns the ids of the jobs in a state, oldest first
+        """
+        if state == "running":
+            return sorted(set(job_id for job_id, _ in self._get_claims()))
+
+        folder_dir = os.path.join(self.queue_dir, state)
+
+        return sorted(file_name[:-len(".json")] for file_name in os.listdir(folder_dir)
+                      if file_name.endswith(".json") and "." not in file_name[:-len(".json")])
+
+    def get_counts(self):
+        """
+        Returns the number of jobs in each state
+        """
+        return {state: len(self.get_job_ids(state)) for state in self.states}
+
+    def get_status(self, job_id):
+        """
+        Returns the state of a job or None if it isn't in the queue
+        """
+        for state in self.states:
+            if state == "running":
+                if job_id in self.get_job_ids("running"):
+                    return state
+            elif os.path.exists(self._get_job_path(state, job_id)):
+                return state
+
+        return None
+
+    def get_result(self, job_id):
+        """
+        Returns the result stored when the job completed, None if it didn't complete
+        """
+        for state in ("done", "failed"):
+            result_path = self._get_result_path(state, job_id)
+            if os.path.exists(result_path):
+                return self._read_json(result_path)
+
+        return None
+
+    def get_results(self):
+        """
+        Returns job id -> result of every completed job
+        """
+        return {job_id: self.get_result(job_id)
+                for state in ("done", "failed") for job_id in self.get_job_ids(state)}
+
+    def run_worker(self, worker_id = None, poll_interval = 5.0, exit_when_empty = False, max_runs = None,
+                   print_output = False, telemetry = None, watchdog = None, scratch_dir = None):
+        """
+        Claim and run jobs until stopped
+
+        Each job is run with a RunScheduler, so a job continues after the last completed stage of an
+        earlier attempt (see AnuraModel.prepare_stages). If the worker is interrupted its job is put
+        back in the queue. If the job is put back in the queue while it runs (e.g. the worker was
+        suspended for longer than stale_after) the solver is stopped and the result isn't recorded.
+
+        Parameters
+        ----------
+        worker_id : str (Optional)
+            Name of the worker. Defaults to <host>-<pid>
+        poll_interval : float (Optional)
+            Seconds to wait before looking again when the queue is empty
+        exit_when_empty : bool (Optional)
+            Return when there are no pending or running jobs instead of waiting for new ones
+        max_runs : int (Optional)
+            Return after this many jobs
+        print_output : bool (Optional)
+            Print the output of the solver
+        telemetry : RunTelemetry (Optional)
+            Store the time and resources of every stage that the worker runs
+        watchdog : dict (Optional)
+            Arguments of a DivergenceWatchdog. A job whose run diverges is stopped and failed with
+            the reason, and the worker moves on to the next job
+        scratch_dir : str (Optional)
+            A folder on a local disk or tmpfs of the worker. Each stage runs in a copy of the model
+            folder there and only the results are written to the shared file system, see ScratchStage
+
+        Returns
+        -------
+        int
+            Number of jobs that were run
+        """
+        if worker_id is None:
+            worker_id = f"{socket.gethostname()}-{os.getpid()}"
+
+        print(f"Worker {worker_id} started on {self.queue_dir}")
+
+        num_runs = 0
+        while max_runs is None or num_runs < max_runs:
+            self.requeue_abandoned()
+
+            claimed = self.claim(worker_id)
+
+            if claimed is None:
+                if exit_when_empty and not self.get_job_ids("running"):
+                    break
+
+                time.sleep(poll_interval)
+                continue
+
+            job_id, claim, spec = claimed
+            print(f"Worker {worker_id} claimed job {job_id}: {spec['model_folder_path']}")
+
+            try:
+                result = self._run_job(job_id, claim, spec, print_output, telemetry, watchdog, scratch_dir)
+            except BaseException:
+                self.release(job_id, claim)
+                raise
+
+            result["worker_id"] = worker_id
+
+            if not self.complete(job_id, claim, result):
+                print(f"Job {job_id} was put back in the queue while it ran, its result isn't recorded")
+
+            num_runs += 1
+
+        print(f"Worker {worker_id} stopped after {num_runs} jobs")
+
+        return num_runs
+
+    def _run_job(self, job_id, claim, spec, print_output, telemetry = None, watchdog = None, scratch_dir = None):
+        """
+        Run the stages of the model of a job while sending heartbeats. The solver is stopped when the
+        claim is lost
+
+        Returns
+        -------
+        dict
+            The status, exit code, stages run, wall time, error and divergence reason of the job
+        """
+        stop_heartbeat = threading.Event()
+        claim_lost = threading.Event()
+
+        def send_heartbeats():
+            while not stop_heartbeat.wait(self.heartbeat_interval):
+                if not self.heartbeat(job_id, claim):
+                    print(f"Warning: job {job_id} isn't claimed by this worker anymore, its solver is stopped")
+                    claim_lost.set()
+                    return
+
+        def run_stage(model, **kwargs):
+            if claim_lost.is_set():
+                raise RuntimeError(f"Job {job_id} isn't claimed by this worker anymore")
+
+            exit_code = model.run_stage(print_output, num_threads = spec.get("num_threads"), telemetry = telemetry,
+                                        scratch_dir = scratch_dir, stop_event = claim_lost, **kwargs)
+
+            if claim_lost.is_set():
+                # Another worker may already run the job, the next stages mustn't start
+                raise RuntimeError(f"Job {job_id} isn't claimed by this worker anymore")
+
+            return exit_code
+
+        heartbeat_thread = threading.Thread(target = send_heartbeats, daemon = True)
+        heartbeat_thread.start()
+
+        try:
+            model = AnuraModel(exe_path = spec["exe_path"], model_folder_path = spec["model_folder_path"],
+                               model_name = spec["model_name"], benchmark = spec["benchmark"],
+                               benchmark_name = spec["benchmark_name"])
+
+            # A worker runs one job at a time, so the job only sets the number of threads of its solver
+            scheduler = RunScheduler([model], max_jobs = 1, watchdog = watchdog, stage_runner = run_stage)
+            job = scheduler.run()[0]
+
+        finally:
+            stop_heartbeat.set()
+            heartbeat_thread.join()
+
+        return {"status": job.status, "exit_code": job.exit_code, "stages_run": job.stages_run,
+                "wall_time": job.wall_time, "error": job.error, "reason": job.reason, "finished": time.time()}
+
+    def _finish(self, job_id, claim, state, result):
+        try:
+            os.rename(self._get_claim_path(job_id, claim), self._get_job_path(state, job_id))
+        except FileNotFoundError:
+            return False
+
+        self._write_json(self._get_result_path(state, job_id), result)
+        self._remove(self._get_owner_path(job_id, claim))
+
+        return True
+
+    def _get_claims(self):
+        """
+        Returns (job id, claim) of every running claim
+        """
+        claims = []
+
+        for file_name in os.listdir(os.path.join(self.queue_dir, "running")):
+            parts = file_name.split(".")
+
+            # <job_id>.<claim>.json, not the owner or temp files
+            if len(parts) == 3 and parts[2] == "json":
+                claims.append((parts[0], parts[1]))
+
+        return claims
+
+    def _add_claim(self, job_id):
+        """
+        Record a claim of a job and return the number of times it was claimed. Each claim is a file
+        made with O_EXCL, which is atomic on a shared file system
+        """
+        attempt = 1
+        while True:
+            claim_path = os.path.join(self.queue_dir, "claims", f"{job_id}.{attempt}")
+            try:
+                os.close(os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return attempt
+            except FileExistsError:
+                attempt += 1
+
+    def _get_job_path(self, state, job_id):
+        return os.path.join(self.queue_dir, state, f"{job_id}.json")
+
+    def _get_result_path(self, state, job_id):
+        return os.path.join(self.queue_dir, state, f"{job_id}.result.json")
+
+    def _get_claim_path(self, job_id, claim):
+        return os.path.join(self.queue_dir, "running", f"{job_id}.{claim}.json")
+
+    def _get_owner_path(self, job_id, claim):
+        return os.path.join(self.queue_dir, "running", f"{job_id}.{claim}.owner.json")
+
+    @staticmethod
+    def _remove(file_dir):
+        try:
+            os.remove(file_dir)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _read_json(file_dir):
+        with open(file_dir, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_json(file_dir, data):
+        # Write to a temp file that is renamed so other machines never read a half written file
+        tmp_path = f"{file_dir}.{socket.gethostname()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent = 4)
+        os.replace(tmp_path, file_dir)
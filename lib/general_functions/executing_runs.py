@@ -1,5 +1,9 @@
 import subprocess
 import os
+import time
+import signal
+import asyncio
+import threading
 
 def generate_batch_script(model_folder, exe_path, args = "", batch_file_name = "run_model.bat", include_cd = False, batch_file_folder = None):
     """
@@ -69,7 +73,9 @@ def generate_batch_script(model_folder, exe_path, args = "", batch_file_name = "
         # Change the permissons of the batch script
         os.chmod(batch_script_path, 0o755)
 
-def run_batch_script(batch_script_path, flag_print_Blog = False):
+def run_batch_script(batch_script_path, flag_print_Blog = False, num_threads = None, cpu_ids = None, env = None,
+                     return_usage = False, usage_interval = 0.5, watchdog = None, terminate_grace = 5.0,
+                     stop_event = None):
     """
     Run a batch script given a path
     
@@ -77,10 +83,34 @@ def run_batch_script(batch_script_path, flag_print_Blog = False):
     ----------
     batch_script_path : string
         The path to a batch script that the user wants to run. This will cause the script to be run inside of the python script
+    num_threads : int (Optional)
+        Number of OpenMP threads of the solver (OMP_NUM_THREADS). Defaults to the environment of this process
+    cpu_ids : list of int (Optional)
+        Pin the script and the solver it starts to these cpus (linux only)
+    env : dict (Optional)
+        Environment of the script. Defaults to the environment of this process
+    return_usage : bool (Optional)
+        Also return the resources that the script and the solver used
+    usage_interval : float (Optional)
+        Seconds between the samples of the memory of the script and the solver
+    watchdog : DivergenceWatchdog (Optional)
+        Checks the output while the script runs. The script and the solver are terminated when the
+        run diverges, the reason is in watchdog.reason
+    terminate_grace : float (Optional)
+        Seconds to wait after terminating a diverged or stopped run before it's killed
+    stop_event : threading.Event (Optional)
+        The script and the solver are terminated when it's set, e.g. when a worker lost its claim on a job
 
     Returns
     -------
-    None.
+    int
+        The exit code of the batch script. 0 if it ran successfully.
+    dict
+        Only if return_usage. "start_time", "end_time", "cpu_time" (user + system seconds of the
+        script and the processes it waited for), "max_rss" (peak resident memory in bytes of the
+        largest process, sampled from /proc right after the start and every usage_interval seconds)
+        and "diverged" (the reason the watchdog stopped the run or None). cpu_time is None on
+        windows and max_rss is None if /proc couldn't be read
 
     '''
     """
@@ -88,18 +118,504 @@ def run_batch_script(batch_script_path, flag_print_Blog = False):
     # Set the working directory to where the batch file is located
     working_directory = os.path.dirname(batch_script_path)
 
+    if watchdog is not None:
+        # Skip the output of earlier stages
+        watchdog.start()
+
+    start_time = time.time()
+
+    # Execute the batch file, capturing both stdout and stderr. If the script can be stopped it gets its
+    # own process group on posix, so the solver it starts is terminated with it
+    pipe = subprocess.PIPE if flag_print_Blog else None
+    watched = watchdog is not None or stop_event is not None
+    process_group = watched and os.name == "posix"
+    process = subprocess.Popen(batch_script_path, shell=True, cwd=working_directory, stdout=pipe, stderr=pipe, text=True,
+                               env=make_solver_env(num_threads, env), start_new_session=process_group)
+
+    if cpu_ids is not None:
+        try:
+            pin_process_tree(process.pid, cpu_ids)
+        except BaseException:
+            # e.g. a cpu id that doesn't exist, don't leave the script running unpinned
+            process.kill()
+            process.wait()
+            raise
+
+    # ru_maxrss of a child includes the memory of this process when it was forked, so the memory is
+    # only sampled from /proc
+    max_rss = []
+    stop_sampling = threading.Event()
+    sampler = threading.Thread(target = _sample_tree_max_rss, args = (process.pid, max_rss, stop_sampling, usage_interval),
+                               daemon = True)
+    sampler.start()
+
+    if watched:
+        watcher = threading.Thread(target = _watch_process,
+                                   args = (process, watchdog, stop_event, stop_sampling, terminate_grace), daemon = True)
+        watcher.start()
+
     try:
-        # Execute the batch file, capturing both stdout and stderr
-        result = subprocess.run(batch_script_path, check=True, shell=True, cwd=working_directory, capture_output=flag_print_Blog, text=True)
-        
+        stdout, stderr, rusage = _wait_with_rusage(process, process_group)
+    finally:
+        stop_sampling.set()
+        sampler.join()
+        if watched:
+            watcher.join()
+
+    usage = {"start_time": start_time, "end_time": time.time(), "diverged": None}
+    usage.update(_get_rusage_dict(rusage))
+    usage["max_rss"] = max(max_rss) if max_rss else None
+
+    if watchdog is not None:
+        # The output written after the last check
+        usage["diverged"] = watchdog.check(check_stall = False)
+
+    if usage["diverged"] is not None:
+        print(f"The run of '{batch_script_path}' diverged: {usage['diverged']}")
+
+    elif process.returncode == 0:
         # Print success message and output
         print(f"Batch file '{batch_script_path}' executed successfully.")
 
         if flag_print_Blog:
             print("Output:")
-            print(result.stdout)
-    except subprocess.CalledProcessError as e:
+            print(stdout)
+    else:
         # Print error message and captured stderr
-        print(f"An error occurred while executing the batch file: {e}")
+        print(f"An error occurred while executing the batch file: Command '{batch_script_path}' "
+              f"returned non-zero exit status {process.returncode}.")
         print("Error output:")
-        print(e.stderr)
\ No newline at end of file
+        print(stderr)
+
+    if return_usage:
+        return process.returncode, usage
+
+    return process.returncode
+
+def _wait_with_rusage(process, process_group = False):
+    """
+    Wait for a process started with subprocess.Popen. If process_group, the process leads its own
+    process group, which is killed if the wait is interrupted
+
+    Returns
+    -------
+    tuple
+        (stdout, stderr, rusage). rusage holds the resources used by the process and the processes it
+        waited for (os.wait4), it's None on platforms without os.wait4
+    """
+    if not hasattr(os, "wait4"):
+        stdout, stderr = process.communicate()
+        return stdout, stderr, None
+
+    # Read the pipes in threads so the process can't block on a full pipe while it's waited for
+    outputs = {}
+    readers = []
+    for name, stream in (("stdout", process.stdout), ("stderr", process.stderr)):
+        if stream is not None:
+            reader = threading.Thread(target = lambda name = name, stream = stream: outputs.update({name: stream.read()}))
+            reader.start()
+            readers.append(reader)
+
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except BaseException:
+        # Don't leave the solver running if this is interrupted
+        if process_group:
+            _signal_process(process, signal.SIGKILL)
+        else:
+            process.kill()
+        process.wait()
+        raise
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    for reader in readers:
+        reader.join()
+
+    for stream in (process.stdout, process.stderr):
+        if stream is not None:
+            stream.close()
+
+    return outputs.get("stdout"), outputs.get("stderr"), rusage
+
+def _watch_process(process, watchdog, stop_event, stop, terminate_grace):
+    """
+    Check the output of a process started by run_batch_script every watchdog.interval seconds (and
+    stop_event every half second without a watchdog) until stop is set, and terminate the process and
+    the processes it started when the run diverges or stop_event is set
+    """
+    interval = watchdog.interval if watchdog is not None else 0.5
+
+    while not stop.wait(interval):
+        stopped = stop_event is not None and stop_event.is_set()
+        if not stopped and (watchdog is None or watchdog.check() is None):
+            continue
+
+        if os.name == "nt":
+            # The solver is a child of the shell, taskkill ends the whole tree
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output = True)
+            return
+
+        # The process is waited for by the thread that started it, so only signals are sent from here
+        _signal_process(process, signal.SIGTERM)
+        if not stop.wait(terminate_grace):
+            _signal_process(process, signal.SIGKILL)
+        return
+
+def _get_rusage_dict(rusage):
+    """
+    Returns the cpu time in seconds of a resource usage. ru_maxrss isn't used, it counts the memory
+    that the parent had when it forked
+    """
+    if rusage is None:
+        return {"cpu_time": None}
+
+    return {"cpu_time": rusage.ru_utime + rusage.ru_stime}
+
+def _sample_tree_max_rss(pid, max_rss, stop, interval):
+    """
+    Append the largest peak resident memory of the process and its descendants to max_rss every
+    interval seconds until stop is set
+    """
+    # Popen only returns once the process has called exec, so the first sample doesn't hold the
+    # memory of this process
+    while True:
+        sample = None
+        for tree_pid in [pid] + get_descendant_pids(pid):
+            usage = read_proc_usage(tree_pid)
+            if usage is not None and usage["max_rss"] is not None:
+                sample = max(sample or 0, usage["max_rss"])
+
+        if sample is not None:
+            max_rss.append(sample)
+
+        if stop.wait(interval):
+            return
+
+def get_descendant_pids(pid):
+    """
+    Returns the ids of the running descendants of a process from /proc, an empty list if /proc can't be read
+    """
+    # parent id -> child ids of every process
+    children = {}
+    try:
+        proc_ids = [int(name) for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return []
+
+    for proc_id in proc_ids:
+        try:
+            with open(f"/proc/{proc_id}/stat", "r") as f:
+                # The parent id is the second field after the command name, which is in brackets
+                parent_id = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+
+        children.setdefault(parent_id, []).append(proc_id)
+
+    descendants = []
+    parents = [pid]
+    while parents:
+        for child in children.get(parents.pop(), []):
+            descendants.append(child)
+            parents.append(child)
+
+    return descendants
+
+def read_proc_usage(pid):
+    """
+    Returns the cpu time in seconds (including the children it waited for) and the peak resident
+    memory in bytes of a running process from /proc. Returns None if /proc can't be read (e.g. the
+    process ended or the platform isn't linux)
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # The fields after the command name, which is in brackets and may hold spaces
+            stat_fields = f.read().rsplit(")", 1)[1].split()
+
+        with open(f"/proc/{pid}/status", "r") as f:
+            status_lines = f.readlines()
+
+    except OSError:
+        return None
+
+    # utime, stime, cutime and cstime are fields 14 to 17 of the stat file, in clock ticks
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    cpu_time = sum(int(value) for value in stat_fields[11:15]) / clock_ticks
+
+    max_rss = None
+    for line in status_lines:
+        if line.startswith("VmHWM:"):
+            max_rss = int(line.split()[1]) * 1024
+            break
+
+    return {"cpu_time": cpu_time, "max_rss": max_rss}
+
+async def run_solver_async(cmd, cwd = None, env = None, timeout = None, on_stdout = None, on_stderr = None,
+                           log_file = None, terminate_grace = 5.0, num_threads = None, cpu_ids = None,
+                           usage_interval = 0.5, watchdog = None):
+    """
+    Run the solver without a shell and stream its output line by line.
+
+    The process is supervised by the event loop, so many runs can be awaited together (e.g. with
+    asyncio.gather) without a thread per process. In a notebook await this directly, run_solver can't be
+    used inside of a running event loop.
+
+    Parameters
+    ----------
+    cmd : list of str
+        The executable followed by its arguments, e.g. [exe_path, model_path]
+    cwd : str (Optional)
+        Working directory of the process
+    env : dict (Optional)
+        Environment of the process. Defaults to the environment of this process
+    timeout : float (Optional)
+        Wall clock limit in seconds. The process is terminated when it's reached
+    on_stdout, on_stderr : callable (Optional)
+        Called with each line of the output (without the new line character) as it's written
+    log_file : str (Optional)
+        Path of a file that every line of stdout and stderr is appended to
+    terminate_grace : float (Optional)
+        Seconds to wait after terminating the process before it's killed
+    num_threads : int (Optional)
+        Number of OpenMP threads of the solver (OMP_NUM_THREADS)
+    cpu_ids : list of int (Optional)
+        Pin the process and the processes it starts to these cpus (linux only)
+    usage_interval : float (Optional)
+        Seconds between the samples of the cpu time and memory of the process
+    watchdog : DivergenceWatchdog (Optional)
+        Checks the output every watchdog.interval seconds. The process is terminated when the run diverges
+
+    Returns
+    -------
+    dict
+        "exit_code" (negative signal number if the process was terminated on posix), "timed_out",
+        "cancelled", "diverged" (the reason the watchdog stopped the run or None), "wall_time", "pid", "start_time" and "end_time" (epoch seconds) and "cpu_time"
+        and "max_rss" (bytes) of the process. cpu_time and max_rss are sampled from /proc every
+        usage_interval seconds, so they miss the last moments of the run, and are None if /proc can't
+        be read
+
+    Raises
+    ------
+    asyncio.CancelledError
+        If the task is cancelled. The process is terminated before the error is raised again
+    """
+    start_time = time.perf_counter()
+    start_epoch = time.time()
+
+    if watchdog is not None:
+        # Skip the output of earlier stages
+        watchdog.start()
+
+    log = open(log_file, "a") if log_file is not None else None
+
+    try:
+        # On posix the process gets its own process group so that terminating it also ends any
+        # processes it started, which would otherwise keep the output pipes open
+        process = await asyncio.create_subprocess_exec(*cmd, cwd = cwd, env = make_solver_env(num_threads, env),
+                                                       stdout = asyncio.subprocess.PIPE,
+                                                       stderr = asyncio.subprocess.PIPE,
+                                                       limit = 2**20,
+                                                       start_new_session = os.name == "posix")
+    except BaseException:
+        if log is not None:
+            log.close()
+        raise
+
+    result = {"exit_code": None, "timed_out": False, "cancelled": False, "diverged": None, "wall_time": None,
+              "pid": process.pid, "start_time": start_epoch, "end_time": None, "cpu_time": None, "max_rss": None}
+
+    communicate = asyncio.gather(_stream_lines(process.stdout, on_stdout, log),
+                                 _stream_lines(process.stderr, on_stderr, log),
+                                 process.wait())
+
+    sampler = asyncio.ensure_future(_sample_usage(process, result, usage_interval))
+
+    watcher = None
+    if watchdog is not None:
+        watcher = asyncio.ensure_future(_watch_divergence_async(process, watchdog, result, terminate_grace))
+
+    try:
+        if cpu_ids is not None:
+            pin_process_tree(process.pid, cpu_ids)
+
+        await asyncio.wait_for(communicate, timeout)
+
+    except asyncio.TimeoutError:
+        result["timed_out"] = True
+        await terminate_process_async(process, terminate_grace)
+
+    except asyncio.CancelledError:
+        result["cancelled"] = True
+        await _terminate_uncancellable(process, terminate_grace)
+        raise
+
+    except BaseException:
+        # e.g. a callback raised or a line was longer than the stream limit. The solver runs in its
+        # own session, so it would keep running after the error
+        communicate.cancel()
+        # Mark the cancellation of the output readers as retrieved so it isn't reported
+        communicate.add_done_callback(lambda future: future.cancelled() or future.exception())
+        await _terminate_uncancellable(process, terminate_grace)
+        raise
+
+    finally:
+        sampler.cancel()
+
+        if watcher is not None:
+            watcher.cancel()
+
+        if log is not None:
+            log.close()
+
+        result["wall_time"] = time.perf_counter() - start_time
+        result["end_time"] = time.time()
+
+    result["exit_code"] = process.returncode
+
+    if watchdog is not None and result["diverged"] is None:
+        # The output written after the last check
+        result["diverged"] = await asyncio.to_thread(watchdog.check, False)
+
+    return result
+
+def make_solver_env(num_threads = None, env = None):
+    """
+    Returns the environment of a solver process with the number of OpenMP threads set.
+
+    Anura3D uses every core by default, so solvers that run at the same time have to be given a
+    share of the cores or they slow each other down. Returns env unchanged if num_threads is None
+    """
+    if num_threads is None:
+        return env
+
+    env = dict(os.environ if env is None else env)
+    env["OMP_NUM_THREADS"] = str(num_threads)
+
+    return env
+
+def pin_process_tree(pid, cpu_ids):
+    """
+    Pin a process, its threads and the processes it started to cpu_ids. The processes and threads
+    that they start later inherit the affinity. Only linux can set the affinity, elsewhere a warning
+    is printed.
+
+    The affinity is set right after the process was started instead of in preexec_fn, which isn't
+    safe when this process has other threads (e.g. the threads of a RunScheduler)
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        print("Warning: The cpu affinity can only be set on linux, the process isn't pinned")
+        return
+
+    cpu_ids = set(cpu_ids)
+
+    # The process first, so the processes it starts from now on inherit the affinity, then the ones
+    # it already started
+    for tree_pid in [pid] + get_descendant_pids(pid):
+        try:
+            thread_ids = [int(name) for name in os.listdir(f"/proc/{tree_pid}/task")]
+        except OSError:
+            thread_ids = [tree_pid]
+
+        for thread_id in thread_ids:
+            try:
+                os.sched_setaffinity(thread_id, cpu_ids)
+            except ProcessLookupError:
+                # The process or thread ended in the mean time
+                pass
+
+def run_solver(cmd, **kwargs):
+    """
+    Blocking version of run_solver_async. kwargs are passed to run_solver_async
+    """
+    return asyncio.run(run_solver_async(cmd, **kwargs))
+
+async def terminate_process_async(process, terminate_grace = 5.0):
+    """
+    Terminate a process started by run_solver_async and kill it if it hasn't ended after terminate_grace
+    seconds. On posix the signals are sent to the process group of the process
+    """
+    if process.returncode is not None:
+        return
+
+    try:
+        _signal_process(process, signal.SIGTERM)
+        await asyncio.wait_for(process.wait(), terminate_grace)
+
+    except asyncio.TimeoutError:
+        _signal_process(process, signal.SIGKILL if os.name == "posix" else signal.SIGTERM)
+        await process.wait()
+
+async def _terminate_uncancellable(process, terminate_grace):
+    """
+    Terminate a process with terminate_process_async and finish even if the task is cancelled again while waiting
+    """
+    terminate = asyncio.ensure_future(terminate_process_async(process, terminate_grace))
+    while not terminate.done():
+        try:
+            await asyncio.shield(terminate)
+        except asyncio.CancelledError:
+            pass
+
+def _signal_process(process, sig):
+    """
+    Send a signal to the process group of a process on posix and to the process on windows
+    """
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, sig)
+        elif sig == signal.SIGTERM:
+            process.terminate()
+        else:
+            process.send_signal(sig)
+
+    except ProcessLookupError:
+        # The process ended in the mean time
+        pass
+
+async def _watch_divergence_async(process, watchdog, result, terminate_grace):
+    """
+    Check the output of the process every watchdog.interval seconds and terminate the process when
+    the run diverges. The files are read in a thread so the event loop isn't blocked
+    """
+    while process.returncode is None:
+        await asyncio.sleep(watchdog.interval)
+
+        reason = await asyncio.to_thread(watchdog.check)
+        if reason is not None and process.returncode is None:
+            result["diverged"] = reason
+            await terminate_process_async(process, terminate_grace)
+            return
+
+async def _sample_usage(process, result, interval):
+    """
+    Store the cpu time and peak memory of the process in result until the process ends. The counters
+    only grow, so the last sample is the closest to the final value
+    """
+    while process.returncode is None:
+        usage = read_proc_usage(process.pid)
+
+        # The memory isn't reported anymore once the process has ended
+        if usage is not None:
+            result.update({key: value for key, value in usage.items() if value is not None})
+
+        await asyncio.sleep(interval)
+
+async def _stream_lines(stream, callback, log):
+    """
+    Pass each line of the stream to the callback and the log file until the stream ends
+    """
+    while True:
+        line = await stream.readline()
+
+        if not line:
+            break
+
+        text = line.decode(errors = "replace").rstrip("\r\n")
+
+        if callback is not None:
+            callback(text)
+
+        if log is not None:
+            log.write(text + "\n")
+            log.flush()
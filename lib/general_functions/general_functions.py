@@ -1,5 +1,16 @@
 import subprocess
 import os
+import shutil
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on windows, files are hard linked or copied instead of reflinked
+    fcntl = None
+
+# ioctl request that clones the data of a file on copy on write file systems (Btrfs, XFS)
+FICLONE = 0x40049409
 
 # def run_executable(executable_path, argument):
 #     try:
@@ -128,6 +139,26 @@ def sort_dict_by_range(d):
     sorted_dict = dict(sorted_items)
     return sorted_dict
 
+def format_flag_value(new_values):
+    """
+    Returns the lines that are written after a flag for a value
+
+    Parameters
+    ----------
+    new_values : str, number or list
+        A single value or a list of values that are each written on their own line
+
+    Returns
+    -------
+    list of str
+        The lines with new line characters. Values that hold several lines are split so that every
+        entry of the list is a single line of the file
+    """
+    if not isinstance(new_values, list):
+        new_values = [new_values]
+
+    return [value_line + "\n" for value in new_values for value_line in str(value).split("\n")]
+
 def pad_integer_to_string(integer, pad_char, max_str_length):
     """
     Returns an integer inset into a string with length max_str_length that is padded with the pad
@@ -146,4 +177,63 @@ def pad_integer_to_string(integer, pad_char, max_str_length):
     return padded_integer
 
 def create_folder_if_not_exists(folder_path):
-    os.makedirs(folder_path, exist_ok=True)
\ No newline at end of file
+    os.makedirs(folder_path, exist_ok=True)
+
+
+def link_or_copy_file(src_dir, dst_dir, allow_hardlink = True):
+    """
+    Make dst_dir a copy of src_dir as cheaply as the file system allows. In order of preference:
+    a reflink (a copy on write clone, e.g. on Btrfs or XFS), a hard link or a full copy.
+
+    A hard link shares its data with src_dir, so it must not be written in place. FlagFile and
+    FlagTemplate write to a temp file that replaces the file, which breaks the link.
+
+    Parameters
+    ----------
+    src_dir : str
+        Path of the file to copy
+    dst_dir : str
+        Path of the copy. An existing file is replaced
+    allow_hardlink : bool (Optional)
+        Copy the file if it can't be reflinked instead of hard linking it
+
+    Returns
+    -------
+    str
+        "reflink", "hardlink" or "copy"
+    """
+    if os.path.lexists(dst_dir):
+        os.remove(dst_dir)
+
+    if _reflink_file(src_dir, dst_dir):
+        # Keep the modification time so caches keyed by it (e.g. the GOM mesh cache) stay valid
+        shutil.copystat(src_dir, dst_dir)
+        return "reflink"
+
+    if allow_hardlink:
+        try:
+            os.link(src_dir, dst_dir)
+            return "hardlink"
+        except OSError:
+            # e.g. the files are on different file systems
+            pass
+
+    shutil.copy2(src_dir, dst_dir)
+    return "copy"
+
+def _reflink_file(src_dir, dst_dir):
+    """
+    Returns True if dst_dir was made as a reflink of src_dir
+    """
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+
+    with open(src_dir, "rb") as src, open(dst_dir, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return True
+        except OSError:
+            pass
+
+    os.remove(dst_dir)
+    return False
@@ -0,0 +1,121 @@
+"""
+Functions to hash the files that define a run so that identical inputs can be recognised
+"""
+
+# Standard imports
+import hashlib
+import json
+import os
+import re
+import threading
+
+# Input files of a model: the first CPS file, the GOM file and material model dlls. The later CPS_ files
+# are written by the solver and edited between stages, so they'd change the hash of a model that ran.
+# Files derived from the inputs (e.g. the .GOM.mesh.npz mesh cache or temp files) don't match either
+INPUT_FILE_PATTERN = re.compile(r".*(\.CPS_001|\.GOM|\.dll)", flags = re.IGNORECASE)
+
+# Hashes of files that were already read: path -> ((size, mtime), hash)
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+def hash_file(file_dir, block_size = 1024**2):
+    """
+    Returns the sha256 hex digest of a file.
+
+    The hash is kept in memory with the size and modification time of the file, so a large file
+    (e.g. the executable) is only read again if it changed.
+    """
+    stat = os.stat(file_dir)
+    file_key = (stat.st_size, stat.st_mtime_ns)
+    abs_path = os.path.abspath(file_dir)
+
+    with _file_hashes_lock:
+        cached = _file_hashes.get(abs_path)
+    if cached is not None and cached[0] == file_key:
+        return cached[1]
+
+    sha = hashlib.sha256()
+    with open(file_dir, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            sha.update(block)
+
+    digest = sha.hexdigest()
+
+    with _file_hashes_lock:
+        _file_hashes[abs_path] = (file_key, digest)
+
+    return digest
+
+def is_input_file(file_name):
+    """
+    Returns True for the first CPS file, the GOM file and the dll files of a model
+    """
+    return INPUT_FILE_PATTERN.fullmatch(file_name) is not None
+
+def get_model_input_files(model):
+    """
+    Returns the names of the input files in the folder of a model, sorted
+    """
+    # Rescan the folder, the solver may have written files since the last scan
+    file_names = model.folder.get_file_index(refresh = True)["files"]
+
+    return [file_name for file_name in file_names if is_input_file(file_name)]
+
+def hash_model_inputs(model):
+    """
+    Hash everything that defines the result of a benchmark run of a model: the executable, the
+    contents of the first CPS file, the GOM file and the dlls in the folder and the stage information of
+    the benchmark. The files the stages write don't change the hash, so a model that already ran has
+    the same hash as before its run.
+
+    The model name is left out of the hash (files are keyed by the part of their name after the
+    model name), so a copy of a model under another name has the same hash.
+
+    Returns
+    -------
+    str
+        sha256 hex digest
+    """
+    setup = model.setup
+
+    files = {}
+    for file_name in get_model_input_files(model):
+        files[strip_model_name(file_name, model.model_name)] = hash_file(os.path.join(model.folder.folder_dir, file_name))
+
+    if model.benchmark:
+        stage_info = {"num_stages": setup.num_stages,
+                      "modify_cps_flags": setup.benchmark_info["modify_cps_flags"]}
+    else:
+        stage_info = None
+
+    key_dict = {
+        "exe": hash_file(setup.exe_path),
+        "files": files,
+        "stages": stage_info,
+    }
+
+    key_str = json.dumps(key_dict, sort_keys = True, default = str)
+
+    return hashlib.sha256(key_str.encode()).hexdigest()
+
+def strip_model_name(file_name, model_name):
+    """
+    Returns the part of the file name after the model name, e.g. ".CPS_001". Names that don't start
+    with the model name are returned with a "/" in front so they can't be mistaken for a suffix
+    """
+    if file_name.startswith(model_name + "."):
+        return file_name[len(model_name):]
+
+    return "/" + file_name
+
+def add_model_name(stored_name, model_name):
+    """
+    Inverse of strip_model_name
+    """
+    if stored_name.startswith("/"):
+        return stored_name[1:]
+
+    return model_name + stored_name
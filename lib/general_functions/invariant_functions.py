@@ -71,6 +71,114 @@ def calc_volumetric_strain_invariant(stran):
     eps_p = np.sum( stran[0:3] )
     return eps_p
 
+def _as_voigt_block(values):
+    """
+    Return the input as a floating point array where the last axis holds the Voigt components.
+
+    The leading axes are arbitrary, so a single load step (6,), a block of load steps (N, 6) 
+    or blocks stacked from several files (num_files, N, 6) are all accepted. Both the 3D layout
+    (xx, yy, zz, xy, yz, zx) and the 2D layout (xx, yy, zz, xy) are supported.
+    """
+    if isinstance(values, (pd.DataFrame, pd.Series)):
+        values = values.to_numpy()
+
+    values = np.asarray(values)
+
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(np.float64)
+
+    if values.ndim == 0 or values.shape[-1] not in (4, 6):
+        raise ValueError("The last axis must hold 4 (2D) or 6 (3D) Voigt components.\n"
+                         f"Input shape: {values.shape}")
+    return values
+
+def calc_mean_stress_batch(stress):
+    """
+    Calc the mean stress for every row of a block of stresses
+
+    Parameters
+    ----------
+    stress : array_like, shape (..., 6) or (..., 4)
+        Stress components in Voigt order
+
+    Returns
+    -------
+    np.ndarray, shape (...)
+        The mean stress of each row
+    """
+    stress = _as_voigt_block(stress)
+
+    return stress[..., 0:3].sum(axis = -1) / 3.0
+
+def calc_q_invariant_batch(stress):
+    """
+    Calc the q invariant for every row of a block of stresses
+
+    Parameters
+    ----------
+    stress : array_like, shape (..., 6) or (..., 4)
+        Stress components in Voigt order
+
+    Returns
+    -------
+    np.ndarray, shape (...)
+        The q invariant of each row
+    """
+    stress = _as_voigt_block(stress)
+
+    # Calc the deviatoric normal stresses
+    mean_stress = calc_mean_stress_batch(stress)
+    dev_normal  = stress[..., 0:3] - mean_stress[..., np.newaxis]
+
+    # Sum the squared deviatoric normal stresses and the doubled squared shear stresses
+    normal_term = np.sum(dev_normal**2, axis = -1)
+    shear_term  = 2.0 * np.sum(stress[..., 3:]**2, axis = -1)
+
+    return np.sqrt(3.0 * (normal_term + shear_term) / 2.0)
+
+def calc_dev_strain_invariant_batch(strain):
+    """
+    Calc the deviatoric strain invariant for every row of a block of strains
+
+    Parameters
+    ----------
+    strain : array_like, shape (..., 6) or (..., 4)
+        Strain components in Voigt order with engineering shear strains
+
+    Returns
+    -------
+    np.ndarray, shape (...)
+        The deviatoric strain invariant of each row
+    """
+    strain = _as_voigt_block(strain)
+
+    eps_xx = strain[..., 0]
+    eps_yy = strain[..., 1]
+    eps_zz = strain[..., 2]
+
+    normal_term = (eps_yy - eps_zz)**2 + (eps_zz - eps_xx)**2 + (eps_xx - eps_yy)**2
+    shear_term  = np.sum(strain[..., 3:]**2, axis = -1)
+
+    return 1.0/3.0 * np.sqrt(2.0 * normal_term + 3.0 * shear_term)
+
+def calc_volumetric_strain_invariant_batch(strain):
+    """
+    Calc the volumetric strain invariant for every row of a block of strains
+
+    Parameters
+    ----------
+    strain : array_like, shape (..., 6) or (..., 4)
+        Strain components in Voigt order
+
+    Returns
+    -------
+    np.ndarray, shape (...)
+        The volumetric strain of each row
+    """
+    strain = _as_voigt_block(strain)
+
+    return strain[..., 0:3].sum(axis = -1)
+
 
 if __name__ == "__main__":
 
@@ -84,3 +192,10 @@ if __name__ == "__main__":
     strain = np.array([1,2, 3, 4, 5, 6])
     print(f"Eps_q: {calc_dev_strain_invariant(strain)}")
     print(f"Eps_p: {calc_volumetric_strain_invariant(strain)}")
+
+    # Stack the vectors to check the batch versions
+    block = np.vstack([stress, 2 * stress])
+    print(f"Batch mean stress: {calc_mean_stress_batch(block)}")
+    print(f"Batch q invariant: {calc_q_invariant_batch(block)}")
+    print(f"Batch Eps_q: {calc_dev_strain_invariant_batch(block)}")
+    print(f"Batch Eps_p: {calc_volumetric_strain_invariant_batch(block)}")
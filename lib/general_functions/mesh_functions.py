@@ -0,0 +1,174 @@
+"""
+Vectorized geometry of the elements of a mesh
+
+All functions take the node coordinates as an (num_nodes, dim) array and the connectivity as an
+(num_elements, nodes_per_element) array of 0 based node ids, and work on every element at once.
+Higher order elements (10 noded tetrahedra, 6 noded triangles) are treated as straight sided, only
+their corner nodes are used.
+"""
+
+# Standard imports
+import numpy as np
+
+# Number of corner nodes for the element types used by Anura3D
+CORNER_NODES = {
+    (2, 3): 3,   # Linear triangle
+    (2, 6): 3,   # Quadratic triangle
+    (2, 4): 4,   # Linear quadrilateral
+    (3, 4): 4,   # Linear tetrahedron
+    (3, 10): 4,  # Quadratic tetrahedron
+    (3, 8): 8,   # Linear hexahedron
+}
+
+# Split of a hexahedron into tetrahedra that all share the 0-6 diagonal
+HEX_TETS = [(0, 1, 2, 6), (0, 2, 3, 6), (0, 3, 7, 6), (0, 7, 4, 6), (0, 4, 5, 6), (0, 5, 1, 6)]
+
+def parse_numeric_block(lines, dtype = np.float64):
+    """
+    Parse lines of whitespace separated numbers into a 2D array with numpy's C parser
+
+    Parameters
+    ----------
+    lines : list of str
+        The lines of the block. Every line must have the same number of values
+    dtype : numpy dtype (Optional)
+        dtype of the array
+
+    Returns
+    -------
+    np.ndarray, shape (num_lines, values_per_line)
+    """
+    # Number of values per line from the first line that isn't blank
+    first_line = next((line for line in lines if line.strip()), None)
+
+    if first_line is None:
+        return np.empty((0, 0), dtype = dtype)
+
+    num_cols = len(first_line.split())
+
+    # Parse the whole block in one call. Line ends are whitespace to the parser
+    values = np.fromstring("".join(lines), dtype = dtype, sep = " ")
+
+    if values.size % num_cols != 0 or len(lines[-1].split()) not in (0, num_cols):
+        raise ValueError(f"Parsed {values.size} values which can't be split into lines of {num_cols} values.\n"
+                         "The lines must all have the same number of numeric values")
+
+    return values.reshape(-1, num_cols)
+
+def get_corner_nodes(nodes, elements):
+    """
+    Returns the corner node coordinates of every element
+
+    Returns
+    -------
+    np.ndarray, shape (num_elements, num_corners, dim)
+    """
+    dim = nodes.shape[1]
+    key = (dim, elements.shape[1])
+
+    if key not in CORNER_NODES:
+        raise NotImplementedError(f"Elements with {elements.shape[1]} nodes in {dim}D aren't supported.\n"
+                                  f"Supported (dim, nodes per element): {list(CORNER_NODES)}")
+
+    return nodes[elements[:, :CORNER_NODES[key]]]
+
+def calc_element_centroids(nodes, elements):
+    """
+    Calc the centroid of the corner nodes of every element
+    """
+    return get_corner_nodes(nodes, elements).mean(axis = 1)
+
+def calc_element_bounding_boxes(nodes, elements):
+    """
+    Calc the axis aligned bounding box of every element
+
+    Returns
+    -------
+    min_coords, max_coords : np.ndarray, shape (num_elements, dim)
+    """
+    corners = get_corner_nodes(nodes, elements)
+
+    return corners.min(axis = 1), corners.max(axis = 1)
+
+def calc_tet_volumes(p0, p1, p2, p3):
+    """
+    Calc the signed volume of the tetrahedra with the corners p0, p1, p2 and p3, each (..., 3)
+    """
+    return np.einsum("...i,...i->...", p1 - p0, np.cross(p2 - p0, p3 - p0)) / 6.0
+
+def calc_element_volumes(nodes, elements):
+    """
+    Calc the volume of every element. For 2D meshes this is the area of the element.
+
+    Returns
+    -------
+    np.ndarray, shape (num_elements,)
+    """
+    corners = get_corner_nodes(nodes, elements)
+    num_corners = corners.shape[1]
+
+    if nodes.shape[1] == 2:
+        # Shoelace formula over the corners, works for triangles and quadrilaterals
+        x = corners[..., 0]
+        y = corners[..., 1]
+        return 0.5 * np.abs(np.sum(x * np.roll(y, -1, axis = 1) - np.roll(x, -1, axis = 1) * y, axis = 1))
+
+    if num_corners == 4:
+        return np.abs(calc_tet_volumes(corners[:, 0], corners[:, 1], corners[:, 2], corners[:, 3]))
+
+    # Hexahedra
+    volumes = np.zeros(len(corners), dtype = corners.dtype)
+    for tet in HEX_TETS:
+        volumes += calc_tet_volumes(*(corners[:, i] for i in tet))
+
+    return np.abs(volumes)
+
+def get_material_point_ids(element_ids, mps_per_element = 1):
+    """
+    Convert 0 based element ids into the 1 based ids of the material points inside of the elements
+
+    Anura3D numbers the material points element by element when they are generated, so the ids are
+    only correct for the initial distribution of the material points, i.e. before material points move
+    between elements.
+
+    Parameters
+    ----------
+    element_ids : array_like of int
+        0 based element ids
+    mps_per_element : int or array_like of int (Optional)
+        Number of material points in every element, or the number in each element of the mesh when
+        it isn't the same for every element (e.g. 0 for elements that have no material)
+
+    Returns
+    -------
+    list of int
+        Material point ids that can be passed to CPSFile.update_output_mat_points
+    """
+    element_ids = np.asarray(element_ids, dtype = np.int64)
+
+    if np.ndim(mps_per_element) == 0:
+        counts = np.full(len(element_ids), int(mps_per_element), dtype = np.int64)
+        first_ids = element_ids * int(mps_per_element) + 1
+    else:
+        mps_per_element = np.asarray(mps_per_element, dtype = np.int64)
+        # 1 based id of the first material point of each element
+        first_mp_ids = np.cumsum(mps_per_element) - mps_per_element + 1
+        counts = mps_per_element[element_ids]
+        first_ids = first_mp_ids[element_ids]
+
+    # Every id from the first id of each element to the first id plus the count
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    mp_ids = np.repeat(first_ids, counts) + offsets
+
+    return mp_ids.tolist()
+
+
+if __name__ == "__main__":
+
+    # Unit cube split into a hexahedron and the same cube as a tetrahedron corner
+    nodes = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+                      [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]], dtype = float)
+
+    print(f"Hexahedron volume: {calc_element_volumes(nodes, np.array([[0, 1, 2, 3, 4, 5, 6, 7]]))}")
+    print(f"Tetrahedron volume: {calc_element_volumes(nodes, np.array([[0, 1, 3, 4]]))}")
+    print(f"Centroids: {calc_element_centroids(nodes, np.array([[0, 1, 3, 4]]))}")
@@ -0,0 +1,177 @@
+"""
+Functions for reading the .PAR_ files that Anura3D writes for each output material point
+"""
+
+# Standard imports
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# Default column sets for the stress and strain components
+STRESS_COLS_3D = ["SigmaXX", "SigmaYY", "SigmaZZ", "SigmaXY", "SigmaYZ", "SigmaZX"]
+STRESS_COLS_2D = ["SigmaXX", "SigmaYY", "SigmaZZ", "SigmaXY"]
+STRAIN_COLS_3D = ["EpsilonXX", "EpsilonYY", "EpsilonZZ", "GammaXY", "GammaYZ", "GammaZX"]
+STRAIN_COLS_2D = ["EpsilonXX", "EpsilonYY", "EpsilonZZ", "GammaXY"]
+
+def get_stress_cols(flag_3D):
+    """
+    Returns the default stress columns for a 3D or 2D model
+    """
+    if flag_3D:
+        return list(STRESS_COLS_3D)
+    return list(STRESS_COLS_2D)
+
+def get_strain_cols(flag_3D):
+    """
+    Returns the default strain columns for a 3D or 2D model
+    """
+    if flag_3D:
+        return list(STRAIN_COLS_3D)
+    return list(STRAIN_COLS_2D)
+
+def resolve_par_columns(columns, flag_3D):
+    """
+    Convert a column selection into a list of column names
+
+    Parameters
+    ----------
+    columns : None, str or list of str
+        None selects every column. "stress" and "strain" select the default stress or strain columns
+        and "invariants" selects both. Anything else is treated as a column name or a list of them.
+    flag_3D : bool
+        If the model is 3D. Controls which default stress and strain columns are used.
+
+    Returns
+    -------
+    list of str or None
+        The selected column names, or None if every column should be read.
+    """
+    if columns is None:
+        return None
+
+    if not isinstance(columns, list):
+        columns = [columns]
+
+    col_names = []
+    for col in columns:
+        if col == "stress":
+            col_names.extend(get_stress_cols(flag_3D))
+        elif col == "strain":
+            col_names.extend(get_strain_cols(flag_3D))
+        elif col == "invariants":
+            col_names.extend(get_stress_cols(flag_3D) + get_strain_cols(flag_3D))
+        else:
+            col_names.append(col)
+
+    # Drop duplicates but keep the order
+    return list(dict.fromkeys(col_names))
+
+def is_par_file(file_name):
+    """
+    Returns True if the file name is a .PAR_ file and not one of the binary copies that are written next to it
+    """
+    derived_markers = (".cache.", ".mmap.")
+
+    return '.PAR_' in file_name and not any(marker in file_name for marker in derived_markers)
+
+def get_material_point_id(file_name):
+    """
+    Returns the material point id from the number after .PAR_ in the file name, or None if there isn't one
+    """
+    if '.PAR_' not in file_name:
+        return None
+
+    id_str = file_name.rsplit('.PAR_', 1)[1]
+
+    if not id_str.isdigit():
+        return None
+
+    return int(id_str)
+
+def par_file_sort_key(file_name):
+    """
+    Key that sorts .PAR_ file names by material point id. Names without an id are put at the end
+    """
+    mat_point_id = get_material_point_id(file_name)
+
+    if mat_point_id is None:
+        return (1, 0, file_name)
+
+    return (0, mat_point_id, file_name)
+
+def read_par_header(file_dir):
+    """
+    Read the header (first line) of a .PAR_ file
+
+    Returns
+    -------
+    list of str
+        The column names
+    """
+    if not os.path.exists(file_dir):
+        raise FileNotFoundError(f"The file {file_dir} does not exist.")
+
+    with open(file_dir, 'r') as f:
+        header = f.readline().strip().split()
+
+    return header
+
+def read_par_file(file_dir, columns = None, dtype = np.float64, header = None):
+    """
+    Read a .PAR_ file with the pandas C tokenizer, only parsing the requested columns.
+
+    Parameters
+    ----------
+    file_dir : str
+        Path to the .PAR_ file
+    columns : list of str (Optional)
+        Column names to load. Defaults to every column in the header
+    dtype : numpy dtype (Optional)
+        dtype the columns are stored as. np.float32 halves the memory of the default np.float64
+    header : list of str (Optional)
+        The header of the file if it has already been read
+
+    Returns
+    -------
+    header : list of str
+        All of the column names in the file
+    data : pd.DataFrame
+        The loaded columns
+    stats : dict
+        Read statistics: "rows", "seconds" and "rows_per_sec"
+    """
+    start_time = time.perf_counter()
+
+    if header is None:
+        header = read_par_header(file_dir)
+
+    if columns is not None:
+        missing_cols = [col for col in columns if col not in header]
+        if missing_cols:
+            raise ValueError(f"Columns {missing_cols} aren't in {os.path.basename(file_dir)}\n"
+                             f"Available columns: {header}")
+
+    # "\s+" is handled by the C engine as whitespace splitting. Set it explicitly so that
+    # a change in the separator can't silently fall back to the python engine
+    data = pd.read_csv(file_dir, sep=r'\s+', skiprows=1, names=header, usecols=columns,
+                       dtype=dtype, engine="c")
+
+    if columns is not None:
+        # usecols returns the columns in file order so put them in the requested order
+        data = data[columns]
+
+    stats = make_read_stats(len(data), time.perf_counter() - start_time)
+
+    return header, data, stats
+
+def make_read_stats(num_rows, seconds):
+    """
+    Make the dictionary used to report how fast a file was read
+    """
+    if seconds > 0:
+        rows_per_sec = num_rows / seconds
+    else:
+        rows_per_sec = float("inf")
+
+    return {"rows": num_rows, "seconds": seconds, "rows_per_sec": rows_per_sec}
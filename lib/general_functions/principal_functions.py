@@ -0,0 +1,164 @@
+"""
+Batched principal values, third invariant and Lode angle of stress and strain blocks
+
+All functions take Voigt blocks with the components on the last axis, either the 3D layout
+(xx, yy, zz, xy, yz, zx) or the 2D layout (xx, yy, zz, xy), and work on every row at once.
+"""
+
+# Standard imports
+import numpy as np
+
+# Lib imports
+from lib.general_functions.invariant_functions import _as_voigt_block
+
+# Position of the Voigt shear components in the tensor
+SHEAR_INDICES = [(0, 1), (1, 2), (2, 0)]
+
+def voigt_to_tensor(voigt, engineering_shear = False):
+    """
+    Build the stacked symmetric tensors from Voigt components
+
+    Parameters
+    ----------
+    voigt : array_like, shape (..., 6) or (..., 4)
+        Components in Voigt order. The 2D layout has zero yz and zx components
+    engineering_shear : bool (Optional)
+        If the shear components are engineering shear strains (gamma = 2 * eps). They are halved
+
+    Returns
+    -------
+    np.ndarray, shape (..., 3, 3)
+        The tensor of each row
+    """
+    voigt = _as_voigt_block(voigt)
+
+    tensor = np.zeros(voigt.shape[:-1] + (3, 3), dtype = voigt.dtype)
+
+    # Normal components on the diagonal
+    for i in range(3):
+        tensor[..., i, i] = voigt[..., i]
+
+    shear_scale = 0.5 if engineering_shear else 1.0
+
+    # Shear components. The 2D layout only has xy
+    for voigt_id, (i, j) in zip(range(3, voigt.shape[-1]), SHEAR_INDICES):
+        tensor[..., i, j] = shear_scale * voigt[..., voigt_id]
+        tensor[..., j, i] = tensor[..., i, j]
+
+    return tensor
+
+def calc_principal_values(voigt, engineering_shear = False):
+    """
+    Calc the principal values of every row with one vectorized eigenvalue solve
+
+    Returns
+    -------
+    np.ndarray, shape (..., 3)
+        Principal values sorted from largest to smallest. Rows with a NaN or infinite component
+        (e.g. from a diverged run or padding) are NaN
+    """
+    tensor = voigt_to_tensor(voigt, engineering_shear = engineering_shear)
+
+    # eigvalsh doesn't converge on non finite values, so only the finite rows are solved
+    finite_rows = np.isfinite(tensor).all(axis = (-2, -1))
+
+    principal_values = np.full(tensor.shape[:-1], np.nan, dtype = np.result_type(tensor.dtype, np.float32))
+
+    # eigvalsh returns the values in ascending order
+    principal_values[finite_rows] = np.linalg.eigvalsh(tensor[finite_rows])[..., ::-1]
+
+    return principal_values
+
+def calc_principal_stresses(stress):
+    """
+    Calc the principal stresses (sigma_1 >= sigma_2 >= sigma_3) of every row
+    """
+    return calc_principal_values(stress)
+
+def calc_principal_strains(strain):
+    """
+    Calc the principal strains (eps_1 >= eps_2 >= eps_3) of every row. The shear strains are
+    assumed to be engineering shear strains as output by Anura3D
+    """
+    return calc_principal_values(strain, engineering_shear = True)
+
+def calc_deviatoric_tensor(stress):
+    """
+    Calc the deviatoric stress tensor of every row
+
+    Returns
+    -------
+    np.ndarray, shape (..., 3, 3)
+    """
+    tensor = voigt_to_tensor(stress)
+
+    mean_stress = np.trace(tensor, axis1 = -2, axis2 = -1) / 3.0
+
+    for i in range(3):
+        tensor[..., i, i] -= mean_stress
+
+    return tensor
+
+def calc_J2_invariant(stress):
+    """
+    Calc the second invariant of the deviatoric stress, J2 = 1/2 s:s, of every row
+    """
+    dev_tensor = calc_deviatoric_tensor(stress)
+
+    return 0.5 * np.sum(dev_tensor**2, axis = (-2, -1))
+
+def calc_J3_invariant(stress):
+    """
+    Calc the third invariant of the deviatoric stress, J3 = det(s), of every row
+    """
+    return np.linalg.det(calc_deviatoric_tensor(stress))
+
+def calc_lode_angle(stress):
+    """
+    Calc the Lode angle of every row
+
+    Uses cos(3 theta) = (3 sqrt(3) / 2) J3 / J2^(3/2) so theta is between 0 and pi/3. With the tension
+    positive stresses that Anura3D outputs, triaxial compression is pi/3 and triaxial extension is 0.
+    Rows with J2 = 0 have no deviatoric stress and are given a Lode angle of 0. Rows with a NaN or
+    infinite component are NaN.
+
+    Returns
+    -------
+    np.ndarray, shape (...)
+        Lode angle in radians
+    """
+    dev_tensor = calc_deviatoric_tensor(stress)
+
+    finite_rows = np.isfinite(dev_tensor).all(axis = (-2, -1))
+    dev_tensor = dev_tensor[finite_rows]
+
+    J2 = 0.5 * np.sum(dev_tensor**2, axis = (-2, -1))
+    J3 = np.linalg.det(dev_tensor)
+
+    # theta is 0 where J2 = 0
+    valid_theta = np.zeros_like(J2)
+    non_zero = J2 > 0.0
+
+    # Round off can push the value slightly outside of [-1, 1]
+    cos_3_theta = np.clip(1.5 * np.sqrt(3.0) * J3[non_zero] / J2[non_zero]**1.5, -1.0, 1.0)
+    valid_theta[non_zero] = np.arccos(cos_3_theta) / 3.0
+
+    theta = np.full(finite_rows.shape, np.nan, dtype = valid_theta.dtype)
+    theta[finite_rows] = valid_theta
+
+    return theta
+
+
+if __name__ == "__main__":
+
+    # Make a stress block
+    stress = np.array([[1, 2, 3, 4, 5, 6],
+                       [-100, -50, -50, 0, 0, 0]], dtype = float)
+
+    print(f"Principal stresses:\n{calc_principal_stresses(stress)}")
+    print(f"J3: {calc_J3_invariant(stress)}")
+    print(f"Lode angle: {calc_lode_angle(stress)}")
+
+    # 2D layout
+    strain = np.array([[0.01, -0.005, 0.0, 0.002]])
+    print(f"Principal strains:\n{calc_principal_strains(strain)}")
@@ -0,0 +1,124 @@
+"""
+Runs a WorkQueue with several local ``python -m lib worker`` processes against a stub solver.
+
+One worker is killed while it runs a job. The other workers put the job back in the queue once its
+heartbeat is stale and finish every job. Run from the repository folder with ``python -m pytest tests``
+"""
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from lib.data_classes.modelClass import AnuraModel
+from lib.data_classes.workQueue import WorkQueue
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STALE_AFTER = 2.0
+
+CPS = "$$NUMBER_OF_LOADSTEPS\n10\n$$TIME_PER_LOADSTEP\n0.1\n$$END\n"
+GOM = "$$DIMENSION\n2D-plane\n$$END\n"
+
+# Writes the output of one stage. The first run of a model with a "slow" file hangs until it's killed
+STUB_SOLVER = """\
+#!{python}
+import os, sys, time
+model_path = sys.argv[1]
+folder_dir = os.path.dirname(model_path)
+if os.path.exists(os.path.join(folder_dir, "slow")) and not os.path.exists(os.path.join(folder_dir, "started")):
+    with open(os.path.join(folder_dir, "started"), "w") as f:
+        f.write(str(os.getpid()))
+    time.sleep(600)
+with open(model_path + ".PAR_1", "w") as f:
+    f.write("SigmaXX SigmaYY SigmaZZ SigmaXY\\n1 2 3 4\\n")
+with open(model_path + ".OUT", "w") as f:
+    f.write("done\\n")
+"""
+
+def make_model(folder_dir, exe_path, slow = False):
+    os.makedirs(folder_dir)
+    with open(os.path.join(folder_dir, "m.CPS_001"), "w") as f:
+        f.write(CPS)
+    with open(os.path.join(folder_dir, "m.GOM"), "w") as f:
+        f.write(GOM)
+    if slow:
+        open(os.path.join(folder_dir, "slow"), "w").close()
+
+    return AnuraModel(exe_path, folder_dir, "m", benchmark = False)
+
+def start_worker(queue_dir, worker_id, *args):
+    return subprocess.Popen([sys.executable, "-m", "lib", "worker", queue_dir, "--worker-id", worker_id,
+                             "--poll-interval", "0.2", "--stale-after", str(STALE_AFTER), *args],
+                            cwd = REPO_DIR, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, text = True)
+
+def wait_for(condition, timeout = 60.0):
+    end_time = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end_time:
+            raise TimeoutError("The condition wasn't met in time")
+        time.sleep(0.05)
+
+@pytest.mark.skipif(os.name != "posix", reason = "the stub solver is a posix script")
+def test_workers_requeue_a_killed_worker_and_finish_every_job(tmp_path):
+    exe_path = os.path.join(tmp_path, "stub_solver.py")
+    with open(exe_path, "w") as f:
+        f.write(STUB_SOLVER.format(python = sys.executable))
+    os.chmod(exe_path, 0o755)
+
+    queue = WorkQueue(os.path.join(tmp_path, "queue"), stale_after = STALE_AFTER)
+    slow_model = make_model(os.path.join(tmp_path, "slow"), exe_path, slow = True)
+    slow_job_id = queue.enqueue(slow_model)
+
+    # Claim: the first worker takes the slow job and its solver starts
+    victim = start_worker(queue.queue_dir, "victim", "--max-runs", "1")
+    started_path = os.path.join(slow_model.folder.folder_dir, "started")
+    try:
+        wait_for(lambda: os.path.exists(started_path) and os.path.getsize(started_path) > 0)
+        assert queue.get_status(slow_job_id) == "running"
+
+        # Heartbeat: the running file of the claim is touched while the solver runs
+        running_dir = os.path.join(queue.queue_dir, "running")
+        running_names = [name for name in os.listdir(running_dir) if not name.endswith(".owner.json")]
+        assert len(running_names) == 1
+        running_path = os.path.join(running_dir, running_names[0])
+        claimed_mtime = os.path.getmtime(running_path)
+        wait_for(lambda: os.path.getmtime(running_path) > claimed_mtime, timeout = STALE_AFTER)
+    finally:
+        # Kill the worker, then its solver which runs in a process group of its own
+        victim.kill()
+        if os.path.exists(started_path) and os.path.getsize(started_path) > 0:
+            with open(started_path) as f:
+                os.kill(int(f.read()), signal.SIGKILL)
+        victim.communicate()
+
+    assert queue.get_status(slow_job_id) == "running"
+
+    job_ids = [queue.enqueue(make_model(os.path.join(tmp_path, f"model_{i}"), exe_path)) for i in range(3)]
+
+    # Requeue and completion: the other workers take the slow job back once its heartbeat is stale
+    workers = [start_worker(queue.queue_dir, f"worker_{i}", "--exit-when-empty") for i in range(2)]
+    try:
+        outputs = [worker.communicate(timeout = 120)[0] for worker in workers]
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.kill()
+
+    assert all(worker.returncode == 0 for worker in workers), outputs
+
+    assert queue.get_counts() == {"pending": 0, "running": 0, "done": 4, "failed": 0}
+    assert os.listdir(os.path.join(queue.queue_dir, "running")) == []
+
+    results = queue.get_results()
+    assert all(results[job_id]["status"] == "finished" for job_id in [slow_job_id] + job_ids)
+    assert results[slow_job_id]["worker_id"] in ("worker_0", "worker_1")
+
+    # The killed worker's claim and the claim that finished the job
+    assert len([name for name in os.listdir(os.path.join(queue.queue_dir, "claims"))
+                if name.startswith(slow_job_id)]) == 2
+
+    for model_dir in ["slow"] + [f"model_{i}" for i in range(3)]:
+        assert os.path.exists(os.path.join(tmp_path, model_dir, "m.PAR_1"))